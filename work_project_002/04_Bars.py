@@ -3,11 +3,86 @@ import os.path
 
 import pandas as pd
 from QuikPy import QuikPy  # Работа с QUIK из Python через LUA скрипты QuikSharp
+from BackTraderQuik.QKBarStore import QKBarStore, get_interval_open, resample_bars  # Хранилище баров в двоичных файлах по колонкам
+from BackTraderQuik.QKDownloader import QKDownloader, get_interval  # Конвейерная загрузка истории многих тикеров
+from BackTraderQuik.QKContinuous import QKContinuous, find_stores  # Непрерывный фьючерс из хранилищ контрактов
+from BackTraderQuik.QKIntegrity import QKIntegrity  # Индекс целостности хранилища баров
+
+
+def open_store(class_code, sec_code, time_frame, compression):
+    """Хранилище баров тикера и интервала. Если хранилища нет, но есть текстовый файл прошлых версий, то бары переносятся из него"""
+    file_name = f'{datapath}{class_code}.{sec_code}_{time_frame}{compression}.txt'
+    store = QKBarStore(QKBarStore.get_path(datapath, class_code, sec_code, time_frame, compression))  # Хранилище баров
+    if not store.exists() and os.path.isfile(file_name):  # Если хранилища нет, но есть файл прошлых версий
+        print(f'Перенос файла {file_name} в хранилище {store.path}')
+        store.import_csv(file_name)  # то переносим бары из файла в хранилище
+    if store.exists():  # Если хранилище существует
+        dt = store.read()['datetime']  # Время баров читается из файла колонки без разбора
+        print(f'Хранилище {store.path}')
+        print(f'- Первая запись хранилища: {dt[0]}')
+        print(f'- Последняя запись хранилища: {dt[-1]}')
+        print(f'- Кол-во записей в хранилище: {len(store)}')
+        index = QKIntegrity(store).update()  # Индекс целостности пересчитывается только с последнего проверенного дня
+        print(f'- Пропусков: {len(index["gaps"])}, повторов: {len(index["duplicates"])}, нарушений порядка: {len(index["disorders"])}, баров вне сессий: {index["outside"]}')
+    else:  # Хранилище не существует
+        print(f'Хранилище {store.path} не найдено и будет создано')
+    return store
+
+
+def get_candles_from_quik(class_code, sec_code, interval, count=0):
+    """Бары из QUIK в виде pandas DataFrame
+
+    :param int count: Кол-во последних баров. 0 - все бары
+    """
+    new_bars = qp_provider.GetCandlesFromDataSource(class_code, sec_code, interval, count)['data']  # Получаем
+    # бары из QUIK
+    pd_bars = pd.json_normalize(new_bars)  # Переводим список баров в pandas DataFrame
+    pd_bars.rename(columns={'datetime.year': 'year', 'datetime.month': 'month', 'datetime.day': 'day',
+                            'datetime.hour': 'hour', 'datetime.min': 'minute', 'datetime.sec': 'second'},
+                   inplace=True)  # Чтобы получить дату/время переименовываем колонки
+    pd_bars.index = pd.to_datetime(pd_bars[['year', 'month', 'day', 'hour', 'minute', 'second']])  # Собираем
+    # дату/время из колонок
+    pd_bars = pd_bars[['open', 'high', 'low', 'close', 'volume']]  # Отбираем нужные колонки
+    pd_bars.index.name = 'datetime'  # Ставим название индекса даты/времени
+    pd_bars.volume = pd.to_numeric(pd_bars.volume, downcast='integer')  # Объемы могут быть только целыми
+    return pd_bars
+
+
+def skip_dates(pd_bars, skip_first_date=False, skip_last_date=False):
+    """Удаление баров на первую и последнюю дату"""
+    if skip_first_date:  # Если убираем бары на первую дату
+        len_with_first_date = len(pd_bars)  # Кол-во баров до удаления на первую дату
+        first_date = pd_bars.index[0].date()  # Первая дата
+        pd_bars.drop(pd_bars[(pd_bars.index.date == first_date)].index, inplace=True)  # Удаляем их
+        print(f'- Удалено баров на первую дату {first_date}: {len_with_first_date - len(pd_bars)}')
+    if skip_last_date:  # Если убираем бары на последнюю дату
+        len_with_last_date = len(pd_bars)  # Кол-во баров до удаления на последнюю дату
+        last_date = pd_bars.index[-1].date()  # Последняя дата
+        pd_bars.drop(pd_bars[(pd_bars.index.date == last_date)].index, inplace=True)  # Удаляем их
+        print(f'- Удалено баров на последнюю дату {last_date}: {len_with_last_date - len(pd_bars)}')
+
+
+def skip_four_price_doji(pd_bars):
+    """Удаление баров с дожи 4-х цен"""
+    len_with_doji = len(pd_bars)  # Кол-во баров до удаления дожи
+    pd_bars.drop(pd_bars[(pd_bars.high == pd_bars.low)].index, inplace=True)  # Удаляем их по
+    # условию High == Low
+    print('- Удалено дожи 4-х цен:', len_with_doji - len(pd_bars))
+
+
+def save_bars(store, pd_bars, file_name, export_csv=False):
+    """Сохранение баров в хранилище и выгрузка в текстовый файл"""
+    written = store.upsert(pd_bars.index.values, pd_bars.open.values, pd_bars.high.values, pd_bars.low.values,
+                           pd_bars.close.values, pd_bars.volume.values)  # Перезаписываем только хвост хранилища
+    # с первого нового/измененного бара
+    print(f'- В хранилище {store.path} записано записей: {written}, всего записей: {len(store)}')
+    if export_csv:  # Если нужен текстовый файл
+        print(f'- В файл {file_name} выгружено записей: {store.export_csv(file_name)}')
 
 
 def save_candles_to_file(class_code='TQBR', sec_codes=('SBER',), time_frame='D', compression=1,
-                         skip_first_date=False, skip_last_date=False, four_price_doji=False):
-    """Получение баров, объединение с имеющимися барами в файле (если есть), сохранение баров в файл
+                         skip_first_date=False, skip_last_date=False, four_price_doji=False, export_csv=False):
+    """Получение баров, объединение с имеющимися барами в хранилище (если есть), сохранение новых баров в хранилище
 
     :param str class_code: Код площадки
     :param tuple sec_codes: Коды тикеров в виде кортежа
@@ -17,68 +92,108 @@ def save_candles_to_file(class_code='TQBR', sec_codes=('SBER',), time_frame='D',
     :param bool skip_first_date: Убрать бары на первую полученную дату
     :param bool skip_last_date: Убрать бары на последнюю полученную дату
     :param bool four_price_doji: Оставить бары с дожи 4-х цен
+    :param bool export_csv: Выгрузить бары в текстовый файл. Если хранилище только дополнялось, то в файл дописываются только новые строки
     """
-    interval = compression  # Для минутных временнЫх интервалов ставим кол-во минут
-    if time_frame == 'D':  # Дневной временной интервал
-        interval = 1440  # В минутах
-    elif time_frame == 'W':  # Недельный временной интервал
-        interval = 10080  # В минутах
-    elif time_frame == 'MN':  # Месячный временной интервал
-        interval = 23200  # В минутах
-
+    interval = get_interval(time_frame, compression)  # Интервал QUIK в минутах
     for sec_code in sec_codes:  # Пробегаемся по всем тикерам
-        file_bars = None  # Дальше будем пытаться получить бары из файла
         file_name = f'{datapath}{class_code}.{sec_code}_{time_frame}{compression}.txt'
-        file_exists = os.path.isfile(file_name)  # Существует ли файл
-        if file_exists:  # Если файл существует
-            print(f'Получение файла {file_name}')
-            file_bars = pd.read_csv(file_name, sep='\t', index_col='datetime')  # Считываем файл в DataFrame
-            file_bars.index = pd.to_datetime(file_bars.index, format='%d.%m.%Y %H:%M')  # Переводим индекс
-            # в формат datetime
-            print(f'- Первая запись файла: {file_bars.index[0]}')
-            print(f'- Последняя запись файла: {file_bars.index[-1]}')
-            print(f'- Кол-во записей в файле: {len(file_bars)}')
-        else:  # Файл не существует
-            print(f'Файл {file_name} не найден и будет создан')
+        store = open_store(class_code, sec_code, time_frame, compression)  # Хранилище баров
         print(f'Получение истории {class_code}.{sec_code} {time_frame}{compression} из QUIK')
-        new_bars = qp_provider.GetCandlesFromDataSource(class_code, sec_code, interval, 0)['data']  # Получаем
-        # все бары из QUIK
-        pd_bars = pd.json_normalize(new_bars)  # Переводим список баров в pandas DataFrame
-        pd_bars.rename(columns={'datetime.year': 'year', 'datetime.month': 'month', 'datetime.day': 'day',
-                                'datetime.hour': 'hour', 'datetime.min': 'minute', 'datetime.sec': 'second'},
-                       inplace=True)  # Чтобы получить дату/время переименовываем колонки
-        pd_bars.index = pd.to_datetime(pd_bars[['year', 'month', 'day', 'hour', 'minute', 'second']])  # Собираем
-        # дату/время из колонок
-        pd_bars = pd_bars[['open', 'high', 'low', 'close', 'volume']]  # Отбираем нужные колонки
-        pd_bars.index.name = 'datetime'  # Ставим название индекса даты/времени
-        pd_bars.volume = pd.to_numeric(pd_bars.volume, downcast='integer')  # Объемы могут быть только целыми
-        if not file_exists and skip_first_date:  # Если файла нет, и убираем бары на первую дату
-            len_with_first_date = len(pd_bars)  # Кол-во баров до удаления на первую дату
-            first_date = pd_bars.index[0].date()  # Первая дата
-            pd_bars.drop(pd_bars[(pd_bars.index.date == first_date)].index, inplace=True)  # Удаляем их
-            print(f'- Удалено баров на первую дату {first_date}: {len_with_first_date - len(pd_bars)}')
-        if skip_last_date:  # Если убираем бары на последнюю дату
-            len_with_last_date = len(pd_bars)  # Кол-во баров до удаления на последнюю дату
-            last_date = pd_bars.index[-1].date()  # Последняя дата
-            pd_bars.drop(pd_bars[(pd_bars.index.date == last_date)].index, inplace=True)  # Удаляем их
-            print(f'- Удалено баров на последнюю дату {last_date}: {len_with_last_date - len(pd_bars)}')
+        pd_bars = get_candles_from_quik(class_code, sec_code, interval)  # Получаем все бары из QUIK
+        skip_dates(pd_bars, skip_first_date and not store.exists(), skip_last_date)  # Первую дату убираем, только если хранилища нет
         if not four_price_doji:  # Если удаляем дожи 4-х цен
-            len_with_doji = len(pd_bars)  # Кол-во баров до удаления дожи
-            pd_bars.drop(pd_bars[(pd_bars.high == pd_bars.low)].index, inplace=True)  # Удаляем их по
-            # условию High == Low
-            print('- Удалено дожи 4-х цен:', len_with_doji - len(pd_bars))
+            skip_four_price_doji(pd_bars)
+        if len(pd_bars) == 0:  # Если нечего объединять
+            print('Новых записей нет')
+            continue  # то переходим к следующему тикеру, дальше не продолжаем
+        print('- Первая запись в QUIK:', pd_bars.index[0])
+        print('- Последняя запись в QUIK:', pd_bars.index[-1])
+        print('- Кол-во записей в QUIK:', len(pd_bars))
+        save_bars(store, pd_bars, file_name, export_csv)
+
+
+def save_candles_from_m1(class_code='TQBR', sec_codes=('SBER',), time_frames=(('D', 1, True),),
+                         skip_first_date=False, skip_last_date=False, export_csv=False, verify=True):
+    """Получение из QUIK только минутных баров. Бары остальных интервалов строятся из хранилища минутных баров
+    Минутные бары сохраняются вместе с дожи 4-х цен, т.к. из них строятся остальные интервалы
+
+    :param str class_code: Код площадки
+    :param tuple sec_codes: Коды тикеров в виде кортежа
+    :param tuple time_frames: Интервалы: (временной интервал 'M'/'D'/'W'/'MN', кол-во минут, оставить дожи 4-х цен)
+    :param bool skip_first_date: Убрать бары на первую полученную дату, если хранилища минутных баров нет
+    :param bool skip_last_date: Убрать бары на последнюю полученную дату во всех интервалах
+    :param bool export_csv: Выгрузить бары в текстовые файлы
+    :param bool verify: Сверить построенные бары первого тикера с барами QUIK за период минутных баров
+    """
+    for sec_code in sec_codes:  # Пробегаемся по всем тикерам
+        file_name = f'{datapath}{class_code}.{sec_code}_M1.txt'
+        store = open_store(class_code, sec_code, 'M', 1)  # Хранилище минутных баров
+        print(f'Получение истории {class_code}.{sec_code} M1 из QUIK')
+        m1_bars = get_candles_from_quik(class_code, sec_code, 1)  # Получаем все минутные бары из QUIK
+        if len(m1_bars) == 0:  # Если баров нет
+            print('Новых записей нет')
+            continue  # то переходим к следующему тикеру, дальше не продолжаем
+        if verify and sec_code == sec_codes[0]:  # Если сверяем бары, то только по первому тикеру
+            for time_frame, compression, _ in time_frames:  # Пробегаемся по всем интервалам
+                verify_resample(class_code, sec_code, m1_bars, time_frame, compression)
+        pd_bars = m1_bars.copy()  # Бары, которые сохраняем
+        skip_dates(pd_bars, skip_first_date and not store.exists(), skip_last_date)  # Первую дату убираем, только если хранилища нет
         if len(pd_bars) == 0:  # Если нечего объединять
             print('Новых записей нет')
             continue  # то переходим к следующему тикеру, дальше не продолжаем
         print('- Первая запись в QUIK:', pd_bars.index[0])
         print('- Последняя запись в QUIK:', pd_bars.index[-1])
         print('- Кол-во записей в QUIK:', len(pd_bars))
-        if file_exists:  # Если файл существует
-            pd_bars = pd.concat([file_bars, pd_bars]).drop_duplicates(keep='last').sort_index()  # Объединяем файл с
-            # данными из QUIK,
-            # убираем дубликаты, сортируем заново
-        pd_bars.to_csv(file_name, sep='\t', date_format='%d.%m.%Y %H:%M')
-        print(f'- В файл {file_name} сохранено записей: {len(pd_bars)}')
+        save_bars(store, pd_bars, file_name, export_csv)
+        first_dt = pd_bars.index.values[:1]  # С этого минутного бара бары хранилища могли измениться
+        for time_frame, compression, four_price_doji in time_frames:  # Пробегаемся по всем интервалам
+            tf_store = open_store(class_code, sec_code, time_frame, compression)  # Хранилище баров интервала
+            start = get_interval_open(first_dt, time_frame, compression)[0] if tf_store.exists() else None  # Бары интервала пересчитываем с бара,
+            # в который входит первый новый минутный бар. Новое хранилище строим по всем минутным барам
+            tf_bars = resample_bars(store.read(start), time_frame, compression)  # Строим бары интервала из минутных баров хранилища
+            tf_bars = pd.DataFrame({name: tf_bars[name] for name in ('open', 'high', 'low', 'close', 'volume')},
+                                   index=pd.DatetimeIndex(tf_bars['datetime'].astype('M8[ns]'), name='datetime'))
+            print(f'- Построено баров {time_frame}{compression} из M1: {len(tf_bars)}')
+            if not four_price_doji:  # Если удаляем дожи 4-х цен
+                skip_four_price_doji(tf_bars)
+            save_bars(tf_store, tf_bars, f'{datapath}{class_code}.{sec_code}_{time_frame}{compression}.txt', export_csv)
+
+
+def save_continuous(class_code, base, time_frame, compression, export_csv=False):
+    """Склейка непрерывного фьючерса из хранилищ баров контрактов с корректировкой цен прошлых контрактов
+    Переходы и бары пересчитываются только с последнего не измененного контракта
+
+    :param str base: Тикер базового актива. Например, VB для VBZ3, VBH4, ...
+    """
+    continuous = QKContinuous(QKBarStore.get_path(datapath, class_code, base, time_frame, compression))  # Непрерывный фьючерс
+    rolls, written = continuous.update(find_stores(datapath, class_code, base, time_frame, compression))
+    print(f'Непрерывный фьючерс {continuous.store.path}: пересчитано переходов {rolls}, записано записей {written}, всего записей {len(continuous)}')
+    file_name = f'{datapath}{class_code}.{base}_{time_frame}{compression}.txt'
+    if export_csv and len(continuous) and (written or not os.path.isfile(file_name)):  # Корректировка меняет всю историю, поэтому файл пишется заново
+        print(f'- В файл {file_name} выгружено записей: {continuous.export_csv(file_name)}')
+
+
+def verify_resample(class_code, sec_code, m1_bars, time_frame, compression):
+    """Сверка баров, построенных из минутных баров, с барами QUIK за тот же период
+    Первый бар может быть построен не из всех минутных баров, последний бар еще формируется. Они не сверяются
+
+    :param pandas.DataFrame m1_bars: Минутные бары из QUIK
+    :return: Кол-во несовпавших баров
+    """
+    columns = dict(datetime=m1_bars.index.values, **{name: m1_bars[name].values for name in m1_bars.columns})
+    tf_bars = resample_bars(columns, time_frame, compression)  # Строим бары интервала из минутных баров
+    dt = tf_bars['datetime'].astype('M8[ns]')
+    if len(dt) < 3:  # Если полностью построенных баров нет
+        return 0  # то сверять нечего
+    quik_bars = get_candles_from_quik(class_code, sec_code, get_interval(time_frame, compression), len(dt))  # Бары QUIK за период минутных баров
+    quik_bars = quik_bars[~quik_bars.index.duplicated(keep='last')]
+    checked = pd.DatetimeIndex(dt[1:-1]).intersection(quik_bars.index)  # Полностью построенные бары, которые есть в QUIK
+    local_bars = pd.DataFrame({name: tf_bars[name][1:-1] for name in m1_bars.columns}, index=pd.DatetimeIndex(dt[1:-1]))
+    mismatch = (local_bars.loc[checked] != quik_bars.loc[checked, m1_bars.columns]).any(axis=1)  # Несовпавшие бары
+    print(f'- Сверка {time_frame}{compression} с QUIK: совпало {len(checked) - mismatch.sum()} из {len(checked)} баров')
+    for dt_bar in checked[mismatch][:3]:  # Первые несовпавшие бары
+        print(f'  {dt_bar} построен {local_bars.loc[dt_bar].tolist()}, в QUIK {quik_bars.loc[dt_bar, m1_bars.columns].tolist()}')
+    return int(mismatch.sum())
 
 
 if __name__ == '__main__':  # Точка входа при запуске этого скрипта
@@ -99,15 +214,49 @@ if __name__ == '__main__':  # Точка входа при запуске это
 
     skip_last_date = True  # Если получаем данные внутри сессии, то не берем бары за дату незавершенной сессии
     # skip_last_date = False  # Если получаем данные, когда рынок не работает, то берем все бары
-    save_candles_to_file(class_code, sec_codes, four_price_doji=True)  # Дневные бары
-    save_candles_to_file(class_code, sec_codes, 'M', 240, skip_last_date=skip_last_date)  # 4-х часовые бары
-    save_candles_to_file(class_code, sec_codes, 'M', 120, skip_last_date=skip_last_date)  # 2-х часовые бары
-    save_candles_to_file(class_code, sec_codes, 'M', 60, skip_last_date=skip_last_date)  # часовые бары
-    save_candles_to_file(class_code, sec_codes, 'M', 30, skip_last_date=skip_last_date)  # 15-и минутные бары
-    save_candles_to_file(class_code, sec_codes, 'M', 15, skip_last_date=skip_last_date)  # 15-и минутные бары
-    save_candles_to_file(class_code, sec_codes, 'M', 5, skip_last_date=skip_last_date)  # 5-и минутные бары
-    save_candles_to_file(class_code, sec_codes, 'M', 1, skip_last_date=skip_last_date, four_price_doji=True)  # минутные
-    # бары
+    export_csv = True  # Выгружаем бары в текстовые файлы для BackTrader (GenericCSVData)
+    # export_csv = False  # Бары только в хранилищах
+    refetch_days = 5  # Конвейером запрашиваем из QUIK только бары с первого пропуска за последние 5 дней хранилища или с последнего бара хранилища
+    # refetch_days = None  # Запрашиваем всю историю
+    pipeline = True  # Загружаем все тикеры конвейером: несколько запросов в QUIK, разбор в пуле процессов, запись отдельным потоком
+    # pipeline = False  # Загружаем тикеры по одному с подробным выводом и сверкой построенных баров с QUIK
+    continuous = True  # Склеиваем непрерывные фьючерсы из хранилищ контрактов (VBZ3, VBH4, ...) в хранилища SPBFUT.VB_<Интервал>
+    # continuous = False  # Только хранилища контрактов
+    from_m1 = True  # Получаем из QUIK только минутные бары, остальные интервалы строим из них
+    # from_m1 = False  # Получаем из QUIK бары каждого интервала. История минутных баров в QUIK короче, чем у больших интервалов
+    time_frames = (('D', 1, True),  # Дневные бары
+                   ('M', 240, False),  # 4-х часовые бары
+                   ('M', 120, False),  # 2-х часовые бары
+                   ('M', 60, False),  # часовые бары
+                   ('M', 30, False),  # 30-и минутные бары
+                   ('M', 15, False),  # 15-и минутные бары
+                   ('M', 5, False))  # 5-и минутные бары
+    if pipeline:  # Если загружаем конвейером
+        downloader = QKDownloader(qp_provider, datapath, export_csv=export_csv, refetch_days=refetch_days)
+        if from_m1:  # Если строим интервалы из минутных баров
+            downloader.add_from_m1(class_code, sec_codes, time_frames, skip_last_date=skip_last_date)
+        else:  # Если получаем каждый интервал из QUIK
+            for time_frame, compression, four_price_doji in time_frames:  # Пробегаемся по всем интервалам
+                downloader.add(class_code, sec_codes, time_frame, compression, skip_last_date=skip_last_date and time_frame != 'D', four_price_doji=four_price_doji)
+            downloader.add(class_code, sec_codes, 'M', 1, skip_last_date=skip_last_date, four_price_doji=True)  # минутные бары
+        stats = downloader.run()
+        print(f'Загружено {stats["done"] - stats["errors"]} из {stats["jobs"]}, ошибок {stats["errors"]}. Получено баров {stats["received"]}, записано {stats["written"]}')
+    elif from_m1:  # Если строим интервалы из минутных баров
+        save_candles_from_m1(class_code, sec_codes, time_frames, skip_last_date=skip_last_date, export_csv=export_csv)
+    else:  # Если получаем каждый интервал из QUIK
+        save_candles_to_file(class_code, sec_codes, four_price_doji=True, export_csv=export_csv)  # Дневные бары
+        save_candles_to_file(class_code, sec_codes, 'M', 240, skip_last_date=skip_last_date, export_csv=export_csv)  # 4-х часовые бары
+        save_candles_to_file(class_code, sec_codes, 'M', 120, skip_last_date=skip_last_date, export_csv=export_csv)  # 2-х часовые бары
+        save_candles_to_file(class_code, sec_codes, 'M', 60, skip_last_date=skip_last_date, export_csv=export_csv)  # часовые бары
+        save_candles_to_file(class_code, sec_codes, 'M', 30, skip_last_date=skip_last_date, export_csv=export_csv)  # 15-и минутные бары
+        save_candles_to_file(class_code, sec_codes, 'M', 15, skip_last_date=skip_last_date, export_csv=export_csv)  # 15-и минутные бары
+        save_candles_to_file(class_code, sec_codes, 'M', 5, skip_last_date=skip_last_date, export_csv=export_csv)  # 5-и минутные бары
+        save_candles_to_file(class_code, sec_codes, 'M', 1, skip_last_date=skip_last_date, four_price_doji=True,
+                             export_csv=export_csv)  # минутные бары
+    if continuous and class_code == 'SPBFUT':  # Если склеиваем непрерывные фьючерсы
+        for base in sorted({sec_code[:-2] for sec_code in sec_codes}):  # Пробегаемся по базовым активам без месяца и года экспирации
+            for time_frame, compression, _ in time_frames + (('M', 1, True),):  # Пробегаемся по всем интервалам
+                save_continuous(class_code, base, time_frame, compression, export_csv)
 
     qp_provider.CloseConnectionAndThread()  # Перед выходом закрываем соединение и поток QuikPy
     print(f'Скрипт выполнен за {(time() - start_time):.2f} с')
@@ -0,0 +1,240 @@
+import os
+from json import dumps, loads
+
+import numpy as np
+
+
+class QKBarStore:
+    """Хранилище баров одного тикера и интервала в двоичных файлах по колонкам
+    Каждая колонка - отдельный файл, в который строки только добавляются. Время баров отсортировано и служит индексом.
+    Новые бары заменяют только хвост хранилища, начиная с первого отличающегося бара. Остальные бары не перезаписываются.
+    Кол-во строк фиксируется в файле описания после записи колонок. Не зафиксированный при сбое хвост отбрасывается при открытии
+    """
+    columns = (('datetime', '<M8[s]'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'), ('close', '<f8'), ('volume', '<f8'))  # Колонки и их типы
+
+    def __init__(self, path):
+        """Инициализация
+
+        :param str path: Папка хранилища
+        """
+        self.path = path  # Папка хранилища
+        self.meta_file = os.path.join(path, 'meta.json')  # Файл описания
+        self.rows = 0  # Кол-во зафиксированных строк
+        self.exports = {}  # Кол-во строк и размер файлов, выгруженных в CSV, по имени файла
+        if os.path.isfile(self.meta_file):  # Если хранилище уже есть
+            with open(self.meta_file, encoding='utf-8') as f:
+                meta = loads(f.read())
+            self.rows = meta['rows']
+            self.exports = meta.get('exports', {})
+            self.truncate(self.rows)  # Отбрасываем не зафиксированный хвост
+
+    @staticmethod
+    def get_path(datapath, class_code, sec_code, time_frame, compression):
+        """Папка хранилища по тикеру и интервалу рядом с текстовым файлом 04_Bars.py (без расширения .txt)"""
+        return f'{datapath}{class_code}.{sec_code}_{time_frame}{compression}'
+
+    def __len__(self):
+        return self.rows
+
+    def exists(self):
+        """Хранилище создано"""
+        return os.path.isfile(self.meta_file)
+
+    def read(self, start=None, end=None):
+        """Колонки баров без копирования в память (numpy.memmap)
+
+        :param numpy.datetime64 start: Первое время баров. None - с начала
+        :param numpy.datetime64 end: Последнее время баров. None - до конца
+        :return: Массивы по имени колонки
+        """
+        columns = {name: self.read_column(name, dtype) for name, dtype in self.columns}
+        if start is None and end is None:  # Если нужны все бары
+            return columns
+        dt = columns['datetime']  # Время отсортировано, поэтому границы находим бинарным поиском
+        i = 0 if start is None else np.searchsorted(dt, np.datetime64(start, 's'), 'left')
+        j = len(dt) if end is None else np.searchsorted(dt, np.datetime64(end, 's'), 'right')
+        return {name: column[i:j] for name, column in columns.items()}
+
+    def upsert(self, datetime, open_, high, low, close, volume):
+        """Добавление/замена баров. Бары с тем же временем заменяются новыми, остальные бары хранилища сохраняются
+
+        :param numpy.ndarray datetime: Время открытия баров
+        :return: Кол-во записанных строк
+        """
+        new = dict(datetime=np.asarray(datetime, dtype='M8[s]'), open=open_, high=high, low=low, close=close, volume=volume)
+        new = {name: np.asarray(new[name], dtype=dtype) for name, dtype in self.columns}  # Приводим к типам колонок
+        order = np.argsort(new['datetime'], kind='stable')  # Новые бары сортируем по времени
+        keep = np.append(new['datetime'][order][1:] != new['datetime'][order][:-1], True)  # Из одинакового времени берем последний бар
+        new = {name: column[order][keep] for name, column in new.items()}
+        if not len(new['datetime']):  # Если новых баров нет
+            return 0  # то записывать нечего
+        old = self.read()  # Бары хранилища
+        start = int(np.searchsorted(old['datetime'], new['datetime'][0]))  # С этой строки бары хранилища могут измениться
+        overlap = min(self.rows - start, len(new['datetime']))  # Кол-во строк хранилища, которые сравниваем с новыми барами
+        same = np.ones(overlap, dtype=bool)  # Совпадающие строки
+        for name, _ in self.columns:  # Пробегаемся по всем колонкам
+            same &= old[name][start:start + overlap] == new[name][:overlap]
+        skip = overlap if same.all() else int(np.argmin(same))  # Кол-во первых новых баров, которые уже есть в хранилище
+        if skip == len(new['datetime']):  # Если все новые бары уже есть
+            return 0  # то ничего не меняется
+        rows = start + skip  # С этой строки хранилище перезаписывается
+        new = {name: column[skip:] for name, column in new.items()}  # Новые бары, которых нет в хранилище
+        keep = ~np.isin(old['datetime'][rows:], new['datetime'])  # Бары хранилища, которые не заменяются новыми, остаются
+        merged = {name: np.concatenate((old[name][rows:][keep], new[name])) for name, _ in self.columns}  # Перезаписываемый хвост
+        order = np.argsort(merged['datetime'], kind='stable')  # Сортируем хвост по времени
+        merged = {name: column[order] for name, column in merged.items()}
+        del old  # Файлы колонок больше не читаем
+        self.commit(rows)  # Сначала фиксируем обрезку. При сбое потеряется только хвост, который заново придет из QUIK
+        self.truncate(rows)
+        os.makedirs(self.path, exist_ok=True)
+        for name, _ in self.columns:  # Пробегаемся по всем колонкам
+            with open(self.get_column_file(name), 'ab') as f:  # Дописываем в конец файла колонки
+                merged[name].tofile(f)
+                f.flush()
+                os.fsync(f.fileno())  # Сбрасываем на диск до фиксации
+        written = len(merged['datetime'])  # Кол-во записанных строк
+        self.commit(rows + written)  # Фиксируем новые строки
+        return written
+
+    def import_csv(self, file_name, sep='\t', date_format='%d.%m.%Y %H:%M'):
+        """Загрузка баров из текстового файла 04_Bars.py
+
+        :return: Кол-во записанных строк
+        """
+        import pandas as pd  # pandas нужен только для текстовых файлов
+        pd_bars = pd.read_csv(file_name, sep=sep, index_col='datetime')
+        dt = pd.to_datetime(pd_bars.index, format=date_format).values
+        return self.upsert(dt, pd_bars.open.values, pd_bars.high.values, pd_bars.low.values, pd_bars.close.values, pd_bars.volume.values)
+
+    def to_dataframe(self, start=None, end=None):
+        """Бары в виде pandas DataFrame с индексом datetime"""
+        import pandas as pd  # pandas нужен только для выгрузки
+        columns = self.read(start, end)
+        pd_bars = pd.DataFrame({name: np.array(columns[name]) for name, _ in self.columns[1:]},
+                               index=pd.DatetimeIndex(np.array(columns['datetime']).astype('M8[ns]'), name='datetime'))
+        pd_bars.volume = pd.to_numeric(pd_bars.volume, downcast='integer')  # Объемы могут быть только целыми
+        return pd_bars
+
+    def export_csv(self, file_name, sep='\t', date_format='%d.%m.%Y %H:%M'):
+        """Выгрузка баров в текстовый файл в формате 04_Bars.py. Если хранилище только дополнялось с прошлой выгрузки, то дописываются только новые строки
+
+        :return: Кол-во записанных строк
+        """
+        if not self.rows:  # Если баров нет
+            return 0  # то выгружать нечего
+        rows, size = self.exports.get(file_name, (0, 0))  # Выгруженные строки и размер файла после выгрузки
+        append = 0 < rows <= self.rows and os.path.isfile(file_name) and os.path.getsize(file_name) == size  # Файл не менялся, и выгруженные строки не перезаписывались
+        if not append:  # Если файл нужно переписать
+            rows = 0  # то выгружаем все строки
+        if append and rows == self.rows:  # Если новых строк нет
+            return 0  # то выгружать нечего
+        columns = {name: np.array(column[rows:]) for name, column in self.read().items()}  # Строки для выгрузки
+        lines = zip(format_datetime(columns['datetime'], date_format), *(format_values(columns[name], name == 'volume') for name, _ in self.columns[1:]))  # Строки файла
+        with open(file_name, 'a' if append else 'w', encoding='utf-8', newline='') as f:  # Как pandas.DataFrame.to_csv
+            if not append:  # Если файл пишется заново
+                f.write(sep.join(name for name, _ in self.columns) + os.linesep)  # то пишем заголовок
+            f.writelines(sep.join(line) + os.linesep for line in lines)
+        self.exports[file_name] = (self.rows, os.path.getsize(file_name))
+        self.commit(self.rows)
+        return len(columns['datetime'])
+
+    # Функции
+
+    def get_column_file(self, name):
+        """Файл колонки"""
+        return os.path.join(self.path, f'{name}.bin')
+
+    def read_column(self, name, dtype):
+        """Колонка зафиксированных строк"""
+        if not self.rows:  # Пустой файл отобразить в память нельзя
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self.get_column_file(name), dtype=dtype, mode='r', shape=(self.rows,))
+
+    def truncate(self, rows):
+        """Обрезка файлов колонок до кол-ва строк"""
+        for name, dtype in self.columns:  # Пробегаемся по всем колонкам
+            file_name = self.get_column_file(name)
+            size = rows * np.dtype(dtype).itemsize  # Размер файла колонки
+            if os.path.isfile(file_name) and os.path.getsize(file_name) > size:  # Если в файле есть лишние строки
+                os.truncate(file_name, size)  # то отбрасываем их
+
+    def commit(self, rows):
+        """Фиксация кол-ва строк в файле описания. Файл заменяется атомарно"""
+        self.rows = rows
+        self.exports = {file_name: (export_rows, size) if export_rows <= rows else (0, 0)
+                        for file_name, (export_rows, size) in self.exports.items()}  # Если выгруженные строки перезаписаны, то файл выгрузится заново
+        os.makedirs(self.path, exist_ok=True)
+        tmp_file = f'{self.meta_file}.tmp'  # Сначала пишем во временный файл
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(dumps(dict(columns=[name for name, _ in self.columns], rows=rows, exports=self.exports)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.meta_file)
+
+
+def format_datetime(dt, date_format='%d.%m.%Y %H:%M'):
+    """Время в виде строк формата strftime. Формат из %Y, %m, %d, %H, %M, %S собирается из частей ISO строк без strftime по каждому значению"""
+    iso = np.datetime_as_string(np.asarray(dt, dtype='M8[s]'), unit='s').tolist()  # Строки вида 2023-10-19T10:43:00
+    parts = dict(Y='{0[0]}', m='{0[1]}', d='{0[2]}', H='{0[3]}', M='{0[4]}', S='{0[5]}')  # Поля формата по частям ISO строки
+    tokens = date_format.split('%')  # Текст формата до первого поля и поля с текстом после них
+    if not all(token[:1] in parts for token in tokens[1:]):  # Если в формате есть другие поля
+        return [value.strftime(date_format) for value in np.asarray(dt, dtype='M8[s]').astype(object)]
+    template = tokens[0].replace('{', '{{').replace('}', '}}') + ''.join(parts[token[0]] + token[1:].replace('{', '{{').replace('}', '}}') for token in tokens[1:])
+    return [template.format((value[:4], value[5:7], value[8:10], value[11:13], value[14:16], value[17:19])) for value in iso]
+
+
+def format_values(column, integer=False):
+    """Значения в виде строк, как в pandas.DataFrame.to_csv: кратчайшее представление float, NaN - пустая строка
+
+    :param bool integer: Если все значения целые (объемы), то выводить их без дробной части
+    """
+    column = np.asarray(column, dtype=np.float64)
+    if integer and np.isfinite(column).all() and (column == np.trunc(column)).all():  # Если значения целые
+        return list(map(str, column.astype(np.int64).tolist()))
+    values = list(map(repr, column.tolist()))  # Кратчайшее представление, как str(float)
+    for i in np.flatnonzero(np.isnan(column)):  # Пропуски
+        values[i] = ''
+    return values
+
+
+def get_interval_open(dt, time_frame='D', compression=1):
+    """Время открытия баров интервала, в которые входит время, как в QUIK
+    Внутри дня границы считаются от начала дня, поэтому бар не переходит через границу дня и сессии биржи ММВБ.
+    Дневные бары - по календарным дням (вечерняя сессия срочного рынка входит в свой календарный день), недели - с понедельника, месяцы - по календарю
+
+    :param numpy.ndarray dt: Время (numpy.datetime64)
+    :param str time_frame: Временной интервал 'M'-Минуты, 'D'-дни, 'W'-недели, 'MN'-месяцы
+    :param int compression: Кол-во минут для минутного интервала
+    :return: Время открытия баров (numpy.datetime64[s])
+    """
+    dt = np.asarray(dt, dtype='M8[s]')
+    day = dt.astype('M8[D]')  # Начало дня
+    if time_frame == 'M':  # Минутный интервал
+        minutes = (dt - day).astype('m8[m]').astype(np.int64)  # Минуты от начала дня
+        return (day + (minutes // compression * compression).astype('m8[m]')).astype('M8[s]')
+    if time_frame == 'W':  # Недельный интервал
+        return (day - ((day.astype(np.int64) + 3) % 7).astype('m8[D]')).astype('M8[s]')  # 01.01.1970 - четверг
+    if time_frame == 'MN':  # Месячный интервал
+        return dt.astype('M8[M]').astype('M8[s]')
+    return day.astype('M8[s]')  # Дневной интервал
+
+
+def resample_bars(columns, time_frame='D', compression=1):
+    """Бары большего интервала из баров меньшего интервала одним проходом по массивам
+
+    :param dict columns: Колонки баров, отсортированных по времени: datetime, open, high, low, close, volume (QKBarStore.read)
+    :param str time_frame: Временной интервал 'M'-Минуты, 'D'-дни, 'W'-недели, 'MN'-месяцы
+    :param int compression: Кол-во минут для минутного интервала
+    :return: Колонки баров большего интервала
+    """
+    dt = get_interval_open(columns['datetime'], time_frame, compression)  # Время открытия баров большего интервала
+    if not len(dt):  # Если баров нет
+        return {name: np.empty(0, dtype=dtype) for name, dtype in QKBarStore.columns}
+    starts = np.flatnonzero(np.append(True, dt[1:] != dt[:-1]))  # Первые бары меньшего интервала в барах большего интервала
+    ends = np.append(starts[1:], len(dt)) - 1  # Последние бары
+    return dict(datetime=dt[starts],
+                open=np.asarray(columns['open'])[starts],
+                high=np.maximum.reduceat(columns['high'], starts),
+                low=np.minimum.reduceat(columns['low'], starts),
+                close=np.asarray(columns['close'])[ends],
+                volume=np.add.reduceat(columns['volume'], starts))
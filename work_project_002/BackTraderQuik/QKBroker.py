@@ -1,5 +1,6 @@
 import collections
 from datetime import datetime, date
+import logging
 import time
 
 from backtrader import BrokerBase, Order, BuyOrder, SellOrder
@@ -7,6 +8,11 @@ from backtrader.position import Position
 from backtrader.utils.py3 import with_metaclass
 
 from BackTraderQuik import QKStore
+from BackTraderQuik.QKJournal import QKJournal
+from BackTraderQuik.QKMetrics import metrics
+from BackTraderQuik.QKRisk import QKRisk
+
+logger = logging.getLogger(__name__)  # Лог брокера
 
 
 class MetaQKBroker(BrokerBase.__class__):
@@ -17,10 +23,7 @@ class MetaQKBroker(BrokerBase.__class__):
 
 class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
     """Брокер QUIK"""
-    # TODO Сделать обертку для поддержки множества брокеров
-    # TODO Сделать пример постановки заявок по разным портфелям
-    # Обсуждение решения: https://community.backtrader.com/topic/1165/does-backtrader-support-multiple-brokers
-    # Пример решения: https://github.com/JacobHanouna/backtrader/blob/ccxt_multi_broker/backtrader/brokers/ccxtmultibroker.py
+    # Для работы с несколькими счетами/портфелями используйте обертку QKMultiBroker
 
     params = (
         ('use_positions', True),  # При запуске брокера подтягиваются текущие позиции с биржи
@@ -33,6 +36,9 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         ('LimitKind', 0),  # День лимита
         ('CurrencyCode', 'SUR'),  # Валюта
         ('IsFutures', True),  # Фьючерсный счет
+        ('Journal', None),  # Имя файла журнала заявок, сделок и позиций для быстрого перезапуска после сбоя. None - журнал не ведется
+        ('NativeBrackets', False),  # Дочерние заявки bracket (тейк профит и стоп) ставятся в QUIK одной стоп заявкой, которая активируется исполнением родительской заявки
+        ('Risk', None),  # Предторговые лимиты счета. Словарь параметров QKRisk (max_order_size, max_position, max_notional, max_orders_per_minute, max_daily_loss). None - заявки не проверяются
     )
 
     def __init__(self, **kwargs):
@@ -43,18 +49,36 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         self.startingvalue = self.value = 0  # Стартовый и текущий баланс счета
         if not self.p.ClientCodeForOrders:  # Для брокера Финам нужно вместо кода клиента
             self.p.ClientCodeForOrders = self.p.ClientCode  # указать Номер торгового терминала
-        self.trade_nums = dict()  # Список номеров сделок по тикеру для фильтрации дублей сделок
+        self.trade_nums = dict()  # Номера сделок по тикеру для фильтрации дублей сделок
         self.positions = collections.defaultdict(Position)  # Список позиций
         self.orders = collections.OrderedDict()  # Список заявок, отправленных на биржу
         self.ocos = {}  # Список связанных заявок (One Cancel Others)
         self.pcs = collections.defaultdict(collections.deque)  # Очередь всех родительских/дочерних заявок (Parent - Children)
+        self.journal = QKJournal(self.p.Journal) if self.p.Journal else None  # Журнал заявок, сделок и позиций
+        self.journal_orders = {}  # Активные заявки из журнала, выставленные до перезапуска
+        self.risk = QKRisk(**self.p.Risk) if self.p.Risk else None  # Предторговые проверки заявок
+        self.brackets = {}  # Заявки тейк профит и стоп по номеру транзакции их общей стоп заявки QUIK
+        self.stop_order_links = {}  # Номера транзакций стоп заявок QUIK по номеру заявки, выставленной при срабатывании
+        self.ref_offset = 0  # Смещение номеров транзакций QUIK относительно номеров заявок BackTrader. После перезапуска номера продолжают журнал
 
     def start(self):
         super(QKBroker, self).start()
+        self.store.brokers += 1  # Еще один брокер счета работает с хранилищем
         self.store.provider.OnTransReply = self.on_trans_reply  # Ответ на транзакцию пользователя
         self.store.provider.OnTrade = self.on_trade  # Получение новой / изменение существующей сделки
-        if self.p.use_positions:  # Если нужно при запуске брокера получить текущие позиции на бирже
+        self.store.provider.OnStopOrder = self.on_stop_order  # Получение новой / изменение существующей стоп заявки
+        metrics.set_function('qk_active_orders', lambda: sum(1 for order in list(self.orders.values()) if order.alive()), account=self.p.TradeAccountId)  # Кол-во активных заявок
+        metrics.set_function('qk_broker_notifications_queue', lambda: len(self.notifs), account=self.p.TradeAccountId)  # Кол-во неполученных уведомлений
+        state = self.journal.load() if self.journal else None  # Состояние из журнала
+        if state is not None:  # Если есть журнал
+            self.restore_from_journal(state)  # то восстанавливаем состояние из него и сверяем с QUIK
+        elif self.p.use_positions:  # Если нужно при запуске брокера получить текущие позиции на бирже
             self.get_all_active_positions(self.p.ClientCode, self.p.FirmId, self.p.LimitKind, self.p.Lots, self.p.IsFutures)  # То получаем их
+        if self.journal:  # Если ведем журнал
+            self.journal.open(self.get_journal_state())  # то переписываем его из текущего состояния и открываем на запись
+        if self.risk:  # Если проверяем заявки
+            for dataname, pos in self.positions.items():  # то передаем в проверки текущие позиции
+                self.risk.set_position(dataname, pos.size, self.get_mult(dataname), pos.price)
         self.startingcash = self.cash = self.getcash()  # Стартовые и текущие свободные средства по счету
         self.startingvalue = self.value = self.getvalue()  # Стартовый и текущий баланс счета
 
@@ -117,7 +141,14 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         self.store.provider.OnDisconnected = self.store.provider.DefaultHandler  # Отключение терминала от сервера QUIK
         self.store.provider.OnTransReply = self.store.provider.DefaultHandler  # Ответ на транзакцию пользователя
         self.store.provider.OnTrade = self.store.provider.DefaultHandler  # Получение новой / изменение существующей сделки
-        self.store.BrokerCls = None  # Удаляем класс брокера из хранилища
+        self.store.provider.OnStopOrder = self.store.provider.DefaultHandler  # Получение новой / изменение существующей стоп заявки
+        if self.journal:  # Если ведем журнал
+            self.journal.close()  # то сбрасываем его на диск и закрываем
+        metrics.remove('qk_active_orders', account=self.p.TradeAccountId)  # Брокер больше не работает
+        metrics.remove('qk_broker_notifications_queue', account=self.p.TradeAccountId)
+        self.store.brokers -= 1  # Брокер счета больше не работает с хранилищем
+        if not self.store.brokers:  # Если это был последний брокер хранилища. Хранилище общее для всех счетов терминала
+            self.store.BrokerCls = None  # то удаляем класс брокера из хранилища
 
     # Функции
 
@@ -161,6 +192,56 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
                 dataname = self.store.class_sec_code_to_data_name(class_code, sec_code)  # Получаем название тикера по коду площадки и коду тикера
                 self.positions[dataname] = Position(size, price)  # Сохраняем в списке открытых позиций
 
+    def restore_from_journal(self, state):
+        """Восстановление заявок, сделок и позиций из журнала со сверкой по сделкам из QUIK
+
+        :param dict state: Состояние из журнала
+        """
+        for dataname, (size, price) in state['positions'].items():  # Пробегаемся по всем позициям из журнала
+            self.positions[dataname] = Position(size, price)  # Восстанавливаем позицию
+        self.trade_nums = state['trade_nums']  # Восстанавливаем номера обработанных сделок
+        self.journal_orders = state['orders']  # Активные заявки, выставленные до перезапуска
+        self.ref_offset = state['last_ref']  # Номера транзакций новых заявок продолжаем после последнего номера из журнала. Общий счетчик заявок BackTrader не меняем
+        # Сверка с QUIK. Применяем сделки, которые прошли, пока брокер не работал
+        today_trade_nums = collections.defaultdict(set)  # Номера сделок за сегодня по тикерам
+        for qk_trade in self.store.provider.GetAllTrades()['data']:  # Пробегаемся по всем сделкам за сегодня
+            if qk_trade['account'] != self.p.TradeAccountId:  # Если сделка по другому счету
+                continue  # то пропускаем ее
+            dataname, size, price = self.get_trade_size_price(qk_trade)  # Название тикера, кол-во и цена сделки
+            trade_num = int(qk_trade['trade_num'])  # Номер сделки
+            today_trade_nums[dataname].add(trade_num)  # Запоминаем сделку за сегодня
+            if trade_num in self.trade_nums.get(dataname, ()):  # Если сделка уже есть в журнале
+                continue  # то она уже учтена в позиции
+            self.positions[dataname].update(size, price)  # Обновляем позицию на сделку
+            logger.info('Сверка с QUIK: учтена сделка %s по тикеру %s кол-во %s по цене %s', trade_num, dataname, size, price)
+        self.trade_nums = today_trade_nums  # Номера сделок прошлых сессий больше не нужны
+        if self.journal_orders:  # Если до перезапуска были активные заявки
+            order_nums = {order['order_num'] for order in self.journal_orders.values() if order.get('order_num')}  # Номера заявок на бирже
+            active_order_nums = {int(qk_order['order_num']) for qk_order in self.store.provider.GetAllOrders()['data']
+                                 if int(qk_order['order_num']) in order_nums and qk_order['flags'] & 0b1 == 0b1}  # Активные заявки (бит 0)
+            self.journal_orders = {ref: order for ref, order in self.journal_orders.items()
+                                   if order.get('order_num') is None or order['order_num'] in active_order_nums}  # Оставляем только активные заявки
+        logger.info('Из журнала восстановлено позиций: %d, активных заявок: %d', len([p for p in self.positions.values() if p.size]), len(self.journal_orders))
+
+    def get_journal_state(self):
+        """Текущее состояние брокера для записи в журнал"""
+        return dict(orders=self.journal_orders,
+                    positions={dataname: (pos.size, pos.price) for dataname, pos in self.positions.items() if pos.size},
+                    trade_nums=self.trade_nums,
+                    last_ref=self.ref_offset)  # Последний номер транзакции. Журнал переписывается до отправки новых заявок
+
+    def get_mult(self, dataname):
+        """Множитель стоимости тикера из схемы комиссии. Для позиций без данных (при запуске и из журнала)"""
+        return self.comminfo.get(dataname, self.comminfo[None]).p.mult
+
+    def get_trans_id(self, ref):
+        """Номер транзакции QUIK по номеру заявки BackTrader"""
+        return ref + self.ref_offset
+
+    def get_ref(self, trans_id):
+        """Номер заявки BackTrader по номеру транзакции QUIK"""
+        return trans_id - self.ref_offset
+
     def get_money_limits(self, client_code, firm_id, trade_account_id, limit_kind, currency_code, is_futures=False):
         """Свободные средства по счету
 
@@ -184,12 +265,12 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
                 futures_limit = self.store.provider.GetFuturesLimit(firm_id, trade_account_id, 0, 'SUR')['data']  # Фьючерсные лимиты
                 return float(futures_limit['cbplimit']) + float(futures_limit['varmargin']) + float(futures_limit['accruedint'])  # Лимит откр.поз. + Вариац.маржа + Накоплен.доход
             except Exception:  # При ошибке Futures limit returns nil
-                print(f'QUIK не вернул фьючерсные лимиты с FirmId={firm_id}, TradeAccountId={trade_account_id}. Проверьте правильность значений')
+                logger.warning('QUIK не вернул фьючерсные лимиты с FirmId=%s, TradeAccountId=%s. Проверьте правильность значений', firm_id, trade_account_id)
                 return None
         # Для остальных фирм
         money_limits = self.store.provider.GetMoneyLimits()['data']  # Все денежные лимиты (остатки на счетах)
         if len(money_limits) == 0:  # Если денежных лимитов нет
-            print('QUIK не вернул денежные лимиты (остатки на счетах). Свяжитесь с брокером')
+            logger.warning('QUIK не вернул денежные лимиты (остатки на счетах). Свяжитесь с брокером')
             return None
         cash = [money_limit for money_limit in money_limits  # Из всех денежных лимитов
                 if money_limit['client_code'] == client_code and  # выбираем по коду клиента
@@ -197,7 +278,7 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
                 money_limit['limit_kind'] == limit_kind and  # дню лимита
                 money_limit["currcode"] == currency_code]  # и валюте
         if len(cash) != 1:  # Если ни один денежный лимит не подходит
-            print(f'Денежный лимит не найден с ClientCode={client_code}, FirmId={firm_id}, LimitKind={limit_kind}, CurrencyCode={currency_code}. Проверьте правильность значений')
+            logger.warning('Денежный лимит не найден с ClientCode=%s, FirmId=%s, LimitKind=%s, CurrencyCode=%s. Проверьте правильность значений', client_code, firm_id, limit_kind, currency_code)
             # print(f'Полученные денежные лимиты: {money_limits}')  # Для отладки, если нужно разобраться, что указано неверно
             return None
         return float(cash[0]['currentbal'])  # Денежный лимит (остаток) по счету
@@ -236,7 +317,7 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         order.addinfo(ClassCode=class_code, SecCode=sec_code)  # Код площадки ClassCode и тикера SecCode
         si = self.store.get_symbol_info(class_code, sec_code)  # Получаем параметры тикера (min_price_step, scale)
         if not si:  # Если тикер не найден
-            print(f'Постановка заявки {order.ref} по тикеру {class_code}.{sec_code} отменена. Тикер не найден')
+            logger.warning('Постановка заявки %s по тикеру %s.%s отменена. Тикер не найден', order.ref, class_code, sec_code)
             order.reject(self)  # то отменяем заявку (статус Order.Rejected)
             return order  # Возвращаем отмененную заявку
         order.addinfo(MinPriceStep=float(si['min_price_step']))  # Минимальный шаг цены
@@ -247,7 +328,7 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         if not transmit or parent:  # Для родительской/дочерних заявок
             parent_ref = getattr(order.parent, 'ref', order.ref)  # Номер транзакции родительской заявки или номер заявки, если родительской заявки нет
             if order.ref != parent_ref and parent_ref not in self.pcs:  # Если есть родительская заявка, но она не найдена в очереди родительских/дочерних заявок
-                print(f'Постановка заявки {order.ref} по тикеру {class_code}.{sec_code} отменена. Родительская заявка не найдена')
+                logger.warning('Постановка заявки %s по тикеру %s.%s отменена. Родительская заявка не найдена', order.ref, class_code, sec_code)
                 order.reject(self)  # то отменяем заявку (статус Order.Rejected)
                 return order  # Возвращаем отмененную заявку
             pcs = self.pcs[parent_ref]  # В очередь к родительской заявке
@@ -265,6 +346,14 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         """Отправка заявки (транзакции) на биржу"""
         class_code = order.info['ClassCode']  # Код площадки
         sec_code = order.info['SecCode']  # Код тикера
+        if self.risk:  # Если проверяем заявки
+            risk_price = order.price or order.data.close[0]  # Цена заявки. Для рыночной заявки последняя цена
+            mult = order.comminfo.p.mult if order.comminfo else 1  # Множитель стоимости
+            reason = self.risk.check(order.data._name, order.size, risk_price, mult)  # Проверяем заявку до отправки на биржу
+            if reason:  # Если заявка нарушает лимиты
+                logger.warning('Постановка заявки %s по тикеру %s.%s отменена. %s', order.ref, class_code, sec_code, reason)
+                order.reject(self)  # то отменяем заявку (статус Order.Rejected)
+                return order  # Возвращаем отмененную заявку
         size = abs(self.store.size_to_lots(class_code, sec_code, order.size))  # Размер позиции в лотах. В QUIK всегда передается положительный размер лота
         price = order.price  # Цена заявки
         if not price:  # Если цена не указана для рыночных заявок
@@ -283,7 +372,7 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         if price.is_integer():  # Целое значение цены мы должны отправлять без десятичных знаков
             price = int(price)  # поэтому, приводим такую цену к целому числу
         transaction = {  # Все значения должны передаваться в виде строк
-            'TRANS_ID': str(order.ref),  # Номер транзакции задается клиентом
+            'TRANS_ID': str(self.get_trans_id(order.ref)),  # Номер транзакции задается клиентом
             'CLIENT_CODE': order.info['ClientCode'],  # Код клиента. Для фьючерсов его нет
             'ACCOUNT': order.info['TradeAccountId'],  # Счет
             'CLASSCODE': class_code,  # Код площадки
@@ -320,12 +409,17 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         else:  # Для рыночных или лимитных заявок
             transaction['ACTION'] = 'NEW_ORDER'  # Новая рыночная или лимитная заявка
             transaction['TYPE'] = 'L' if order.exectype == Order.Limit else 'M'  # L = лимитная заявка (по умолчанию), M = рыночная заявка
+        order.addinfo(SubmitTime=time.time())  # Время отправки заявки. Для сравнения задержек с QKPaperBroker
         response = self.store.provider.SendTransaction(transaction)  # Отправляем транзакцию на биржу
         order.submit(self)  # Отправляем заявку на биржу (статус Order.Submitted)
         if response['cmd'] == 'lua_transaction_error':  # Если возникла ошибка при постановке заявки на уровне QUIK
-            print(f'Ошибка отправки заявки в QUIK {response["data"]["CLASSCODE"]}.{response["data"]["SECCODE"]} {response["lua_error"]}')  # то заявка не отправляется на биржу, выводим сообщение об ошибке
+            logger.error('Ошибка отправки заявки в QUIK %s.%s %s', response['data']['CLASSCODE'], response['data']['SECCODE'], response['lua_error'])  # то заявка не отправляется на биржу, выводим сообщение об ошибке
             order.reject(self)  # Отклоняем заявку (Order.Rejected)
+        elif self.risk:  # Если заявка отправлена, и проверяем заявки
+            self.risk.on_submit(order.ref, order.data._name, order.size, risk_price, mult)  # то учитываем ее остаток
         self.orders[order.ref] = order  # Сохраняем заявку в списке заявок, отправленных на биржу
+        if self.journal:  # Если ведем журнал
+            self.journal.write_order(order, self.get_trans_id(order.ref))  # Записываем заявку до ответа биржи
         return order  # Возвращаем заявку
 
     def cancel_order(self, order):
@@ -336,10 +430,15 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
             return  # то выходим, дальше не продолжаем
         order_num = order.info['order_num']  # Номер заявки на бирже
         class_code, sec_code = self.store.data_name_to_class_sec_code(order.data._name)  # По названию тикера получаем код площадки и код тикера
-        is_stop = order.exectype in [Order.Stop, Order.StopLimit] and \
-            isinstance(self.store.provider.GetOrderByNumber(order_num)['data'], int)  # Задана стоп заявка и лимитная заявка не выставлена
+        if order.info.get('BracketTransId'):  # Для тейк профит и стоп заявок bracket снимаем их общую стоп заявку
+            is_stop = isinstance(self.store.provider.GetOrderByNumber(order_num)['data'], int)  # Стоп заявка еще не сработала
+            trans_id = self.get_trans_id(order.info['BracketTransId'])  # Номер транзакции общей стоп заявки
+        else:  # Для остальных заявок
+            is_stop = order.exectype in [Order.Stop, Order.StopLimit] and \
+                isinstance(self.store.provider.GetOrderByNumber(order_num)['data'], int)  # Задана стоп заявка и лимитная заявка не выставлена
+            trans_id = self.get_trans_id(order.ref)  # Номер транзакции заявки
         transaction = {
-            'TRANS_ID': str(order.ref),  # Номер транзакции задается клиентом
+            'TRANS_ID': str(trans_id),  # Номер транзакции задается клиентом
             'CLASSCODE': class_code,  # Код площадки
             'SECCODE': sec_code}  # Код тикера
         if is_stop:  # Для стоп заявки
@@ -363,11 +462,18 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
             oco_ref = self.ocos[order.ref]  # то получаем номер транзакции связанной заявки
             self.cancel_order(self.orders[oco_ref])  # отменяем связанную заявку
 
-        if not order.parent and not order.transmit and order.status == Order.Completed:  # Если исполнена родительская заявка
+        if not order.parent and order.info.get('NativeBracket'):  # Если дочерние заявки стоят в QUIK стоп заявкой
+            if order.status != Order.Completed and not order.executed.size:  # Если родительская заявка снята, не исполнившись
+                self.cancel_order(self.pcs[order.ref][-1])  # то снимаем стоп заявку
+        elif not order.parent and not order.transmit and order.status == Order.Completed:  # Если исполнена родительская заявка
             pcs = self.pcs[order.ref]  # Получаем очередь родительской/дочерних заявок
             for child in pcs:  # Пробегаемся по всем заявкам
                 if child.parent:  # Пропускаем первую (родительскую) заявку
                     self.place_order(child)  # Отправляем дочернюю заявку на биржу
+        elif order.parent and order.info.get('BracketTransId'):  # Если исполнена/отменена заявка из стоп заявки QUIK
+            for child in self.brackets.get(order.info['BracketTransId'], ()):  # Вторая заявка снимается в QUIK вместе с первой
+                if child is not order:
+                    self.set_bracket_status(child, Order.Canceled)  # Поэтому ее только отменяем в BackTrader
         elif order.parent:  # Если исполнена/отменена дочерняя заявка
             pcs = self.pcs[order.parent.ref]  # Получаем очередь родительской/дочерних заявок
             for child in pcs:  # Пробегаемся по всем заявкам
@@ -381,16 +487,30 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         if trans_id == 0:  # Заявки, выставленные не из автоторговли / только что (с нулевыми номерами транзакции)
             return  # не обрабатываем, пропускаем
         order_num = int(qk_trans_reply['order_num'])  # Номер заявки на бирже
-        if trans_id not in self.orders:  # Пришла заявка не из автоторговли
-            print(f'Заявка {order_num} на бирже с номером транзакции {trans_id} не найдена')
+        if trans_id in self.journal_orders:  # Если пришел ответ по заявке, выставленной до перезапуска
+            if 'снят' in str(qk_trans_reply['result_msg']).lower():  # Если заявка снята
+                journal_order = self.journal_orders.pop(trans_id)  # то она больше не активна
+                journal_order = {key: value for key, value in journal_order.items() if key != 'kind'}  # Тип записи из журнала задается при записи
+                self.journal.write('order', **dict(journal_order, status=Order.Canceled))  # Записываем снятие заявки
+            return  # Заявки в BackTrader нет, дальше не продолжаем
+        ref = self.get_ref(trans_id)  # Номер заявки BackTrader
+        if ref not in self.orders:  # Пришла заявка не из автоторговли
+            logger.warning('Заявка %s на бирже с номером транзакции %s не найдена', order_num, trans_id)
             return  # не обрабатываем, пропускаем
-        order: Order = self.orders[trans_id]  # Ищем заявку по номеру транзакции
+        order: Order = self.orders[ref]  # Ищем заявку по номеру транзакции
         order.addinfo(order_num=order_num)  # Сохраняем номер заявки на бирже
         # TODO Есть поле flags, но оно не документировано. Лучше вместо текстового результата транзакции разбирать по нему
         result_msg = str(qk_trans_reply['result_msg']).lower()  # По результату исполнения транзакции (очень плохое решение)
         status = int(qk_trans_reply['status'])  # Статус транзакции
         if status == 15 or 'зарегистрирован' in result_msg:  # Если пришел ответ по новой заявке
+            if order.executed.size:  # Если сделка (OnTrade) пришла раньше ответа на транзакцию (OnTransReply)
+                if self.journal:  # Если ведем журнал
+                    self.journal.write_order(order, trans_id)  # то записываем номер заявки на бирже
+                return  # Исполненную заявку не принимаем повторно. Уведомление и проверка связанных заявок уже были при исполнении
             order.accept(self)  # Заявка принята на бирже (Order.Accepted)
+            order.addinfo(AcceptTime=time.time())  # Время принятия заявки
+            if self.p.NativeBrackets and not order.parent and not order.transmit and not order.info.get('NativeBracket'):  # Если принята родительская заявка bracket
+                self.place_native_bracket(order)  # то сразу ставим дочерние заявки в QUIK
         elif 'снят' in result_msg:  # Если пришел ответ по отмене существующей заявки
             try:  # TODO В BT очень редко при order.cancel() возникает ошибка:
                 #    order.py, line 487, in cancel
@@ -428,6 +548,14 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
             except (KeyError, IndexError):  # При ошибке
                 order.status = Order.Margin  # все равно ставим статус заявки Order.Margin
         self.notifs.append(order.clone())  # Уведомляем брокера о заявке
+        for child in self.brackets.get(ref, ()):  # Для общей стоп заявки тейк профит и стоп
+            if child is not order:  # вторая заявка получает тот же номер и статус
+                child.addinfo(order_num=order_num)
+                self.set_bracket_status(child, order.status)
+        if self.risk and not order.alive():  # Если заявка снята/отклонена, и проверяем заявки
+            self.risk.on_close(order.ref)  # то ее остаток больше не учитываем
+        if self.journal:  # Если ведем журнал
+            self.journal.write_order(order, self.get_trans_id(order.ref))  # Записываем состояние заявки и ее номер на бирже
         if order.status != Order.Accepted:  # Если новая заявка не зарегистрирована
             self.oco_pc_check(order)  # то проверяем связанные и родительскую/дочерние заявки (Canceled, Rejected, Margin)
 
@@ -439,35 +567,32 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         order_num = int(qk_trade['order_num'])  # Номер заявки на бирже
         json_order = self.store.provider.GetOrderByNumber(order_num)['data']  # По номеру заявки в сделке пробуем получить заявку с биржи
         if isinstance(json_order, int):  # Если заявка не найдена, то в ответ получаем целое число номера заявки. Возможно заявка есть, но она не успела прийти к брокеру
-            print(f'Заявка с номером {order_num} не найдена на бирже с 1-ой попытки. Через 3 с будет 2-ая попытка')
+            logger.warning('Заявка с номером %s не найдена на бирже с 1-ой попытки. Через 3 с будет 2-ая попытка', order_num)
             time.sleep(3)  # Ждем 3 секунды, пока заявка не придет к брокеру
             json_order = self.store.provider.GetOrderByNumber(order_num)['data']  # Снова пробуем получить заявку с биржи по ее номеру
             if isinstance(json_order, int):  # Если заявка так и не была найдена
-                print(f'Заявка с номером {order_num} не найдена на бирже со 2-ой попытки')
+                logger.warning('Заявка с номером %s не найдена на бирже со 2-ой попытки', order_num)
                 return  # то выходим, дальше не продолжаем
         trans_id = int(json_order['trans_id'])  # Получаем номер транзакции из заявки с биржи
+        trans_id = self.stop_order_links.get(order_num, trans_id)  # Заявка, выставленная при срабатывании стоп заявки, относится к стоп заявке
         if trans_id == 0:  # Заявки, выставленные не из автоторговли / только что (с нулевыми номерами транзакции)
             return  # не обрабатываем, пропускаем
-        if trans_id not in self.orders:  # Пришла заявка не из автоторговли
-            print(f'Заявка с номером {order_num} и номером транзакции {trans_id} была выставлена не из торговой системы')
+        if trans_id in self.journal_orders:  # Если заявка была выставлена до перезапуска
+            self.on_journal_order_trade(qk_trade)  # то учитываем сделку только в позиции
+            return  # Заявки в BackTrader нет, дальше не продолжаем
+        ref = self.get_ref(trans_id)  # Номер заявки BackTrader
+        if ref not in self.orders:  # Пришла заявка не из автоторговли
+            logger.info('Заявка с номером %s и номером транзакции %s была выставлена не из торговой системы', order_num, trans_id)
             return  # выходим, дальше не продолжаем
-        order: Order = self.orders[trans_id]  # Ищем заявку по номеру транзакции
-        order.addinfo(order_num=order_num)  # Сохраняем номер заявки на бирже (может быть переход от стоп заявки к лимитной с изменением номера на бирже)
-        class_code = qk_trade['class_code']  # Код площадки
-        sec_code = qk_trade['sec_code']  # Код тикера
-        dataname = self.store.class_sec_code_to_data_name(class_code, sec_code)  # Получаем название тикера по коду площадки и коду тикера
+        order: Order = self.orders[ref]  # Ищем заявку по номеру транзакции
         trade_num = int(qk_trade['trade_num'])  # Номер сделки (дублируется 3 раза)
-        if dataname not in self.trade_nums.keys():  # Если это первая сделка по тикеру
-            self.trade_nums[dataname] = []  # то ставим пустой список сделок
-        elif trade_num in self.trade_nums[dataname]:  # Если номер сделки есть в списке (фильтр для дублей)
+        dataname, size, price = self.get_trade_size_price(qk_trade)  # Название тикера, кол-во и цена сделки
+        if ref in self.brackets:  # Если сработала общая стоп заявка тейк профит и стоп
+            order = self.get_bracket_order(ref, price)  # то по цене сделки определяем, какая из заявок исполнилась
+        order.addinfo(order_num=order_num)  # Сохраняем номер заявки на бирже (может быть переход от стоп заявки к лимитной с изменением номера на бирже)
+        if trade_num in self.trade_nums.setdefault(dataname, set()):  # Если номер сделки есть в списке (фильтр для дублей)
             return  # то выходим, дальше не продолжаем
-        self.trade_nums[dataname].append(trade_num)  # Запоминаем номер сделки по тикеру, чтобы в будущем ее не обрабатывать (фильтр для дублей)
-        size = int(qk_trade['qty'])  # Абсолютное кол-во
-        if self.p.Lots:  # Если входящий остаток в лотах
-            size = self.store.lots_to_size(class_code, sec_code, size)  # то переводим кол-во из лотов в штуки
-        if qk_trade['flags'] & 0b100 == 0b100:  # Если сделка на продажу (бит 2)
-            size *= -1  # то кол-во ставим отрицательным
-        price = self.store.quik_to_bt_price(class_code, sec_code, float(qk_trade['price']))  # Переводим цену исполнения за лот в цену исполнения за штуку
+        self.trade_nums[dataname].add(trade_num)  # Запоминаем номер сделки по тикеру, чтобы в будущем ее не обрабатывать (фильтр для дублей)
         try:  # TODO Очень редко возникает ошибка:
             #    linebuffer.py, line 163, in __getitem__
             #    return self.array[self.idx + ago]
@@ -478,13 +603,160 @@ class QKBroker(with_metaclass(MetaQKBroker, BrokerBase)):
         pos = self.getposition(order.data)  # Получаем позицию по тикеру или нулевую позицию если тикера в списке позиций нет
         psize, pprice, opened, closed = pos.update(size, price)  # Обновляем размер/цену позиции на размер/цену сделки
         order.execute(dt, size, price, closed, 0, 0, opened, 0, 0, 0, 0, psize, pprice)  # Исполняем заявку в BackTrader
+        if self.risk:  # Если проверяем заявки
+            self.risk.on_fill(ref, dataname, size, price, order.comminfo.p.mult if order.comminfo else 1)  # Учитываем сделку в позиции и убытке за день
+        if self.journal:  # Если ведем журнал
+            self.journal.write('trade', dataname=dataname, trade_num=trade_num, ref=trans_id, size=size, price=price)  # Записываем сделку
+            self.journal.write('position', dataname=dataname, size=psize, price=pprice)  # Записываем позицию после сделки
         if order.executed.remsize:  # Если заявка исполнена частично (осталось что-то к исполнению)
             if order.status != order.Partial:  # Если заявка переходит в статус частичного исполнения (может исполняться несколькими частями)
                 order.partial()  # Переводим заявку в статус Order.Partial
                 self.notifs.append(order.clone())  # Уведомляем брокера о частичном исполнении заявки
         else:  # Если заявка исполнена полностью (ничего нет к исполнению)
             order.completed()  # Переводим заявку в статус Order.Completed
+            order.addinfo(FillTime=time.time())  # Время полного исполнения заявки
+            if self.risk:  # Если проверяем заявки
+                self.risk.on_close(order.ref)  # Заявка больше не активна
             self.notifs.append(order.clone())  # Уведомляем брокера о полном исполнении заявки
             # Снимаем oco-заявку только после полного исполнения заявки
             # Если нужно снять oco-заявку на частичном исполнении, то прописываем это правило в ТС
             self.oco_pc_check(order)  # Проверяем связанные и родительскую/дочерние заявки (Completed)
+        if self.journal:  # Если ведем журнал
+            self.journal.write_order(order, self.get_trans_id(order.ref))  # Записываем состояние заявки
+
+    def on_stop_order(self, data):
+        """Обработчик события получения новой / изменения существующей стоп заявки"""
+        qk_stop_order = data['data']  # Стоп заявка в QUIK
+        trans_id = int(qk_stop_order.get('trans_id') or 0)  # Номер транзакции стоп заявки
+        ref = self.get_ref(trans_id)  # Номер стоп заявки bracket в BackTrader
+        if not trans_id or ref not in self.brackets:  # Если это не стоп заявка тейк профит и стоп из торговой системы
+            return  # то ее не обрабатываем
+        linked_order_num = int(qk_stop_order.get('linkedorder') or 0)  # Номер заявки, выставленной при срабатывании
+        if linked_order_num:  # Если стоп заявка сработала
+            self.stop_order_links[linked_order_num] = trans_id  # то сделки по выставленной заявке относим к стоп заявке
+        flags = int(qk_stop_order['flags'])  # Флаги стоп заявки: бит 0 - активна, бит 1 - снята
+        if flags & 0b1 == 0 and flags & 0b10 == 0b10:  # Если стоп заявка снята (например, снята родительская заявка или истек срок)
+            for order in self.brackets[ref]:  # Пробегаемся по заявкам тейк профит и стоп
+                self.set_bracket_status(order, Order.Canceled)  # Отменяем заявку в BackTrader
+
+    def place_native_bracket(self, parent):
+        """Постановка дочерних заявок bracket в QUIK стоп заявкой "тейк профит и стоп лимит",
+        которая активируется исполнением родительской заявки. Защитные заявки ставятся сразу, не дожидаясь сделок
+
+        :param Order parent: Принятая на бирже родительская заявка
+        """
+        children = [order for order in self.pcs[parent.ref] if order.parent]  # Дочерние заявки
+        take_profits = [order for order in children if order.exectype == Order.Limit]  # Тейк профит
+        stops = [order for order in children if order.exectype in (Order.Stop, Order.StopLimit)]  # Стоп
+        if len(children) != 2 or len(take_profits) != 1 or len(stops) != 1:  # Если это не пара тейк профит и стоп
+            return  # то дочерние заявки поставим после исполнения родительской заявки, как обычно
+        take_profit, stop = take_profits[0], stops[0]
+        class_code, sec_code = stop.info['ClassCode'], stop.info['SecCode']  # Код площадки и тикера
+        scale = stop.info['Scale']  # Кол-во значащих цифр после запятой
+        min_price_step = stop.info['MinPriceStep']  # Минимальный шаг цены
+        slippage = stop.info['Slippage']  # Размер проскальзывания в деньгах
+        stop_price = self.get_quik_price(class_code, sec_code, stop.price, scale)  # Цена срабатывания стопа
+        if stop.pricelimit:  # Если задана лимитная цена стопа
+            limit_price = self.get_quik_price(class_code, sec_code, stop.pricelimit, scale)  # то ее и берем
+        else:  # Если цена не задана, то исполняем хуже цены срабатывания в размер проскальзывания
+            limit_price = round(stop_price + slippage if stop.isbuy() else stop_price - slippage, scale)
+        transaction = {  # Все значения должны передаваться в виде строк
+            'TRANS_ID': str(self.get_trans_id(stop.ref)),  # Номер транзакции общей стоп заявки - номер стоп заявки bracket
+            'CLIENT_CODE': stop.info['ClientCode'],  # Код клиента
+            'ACCOUNT': stop.info['TradeAccountId'],  # Счет
+            'ACTION': 'NEW_STOP_ORDER',  # Новая стоп заявка
+            'STOP_ORDER_KIND': 'ACTIVATED_BY_ORDER_TAKE_PROFIT_AND_STOP_LIMIT_ORDER',  # Тейк профит и стоп лимит по исполнению заявки
+            'BASE_ORDER_KEY': str(parent.info['order_num']),  # Номер родительской заявки на бирже
+            'USE_BASE_ORDER_BALANCE': 'YES',  # Кол-во берем по исполненной части родительской заявки
+            'ACTIVATE_IF_BASE_ORDER_PARTLY_FILLED': 'YES',  # Защищаем и частично исполненную позицию
+            'CLASSCODE': class_code,  # Код площадки
+            'SECCODE': sec_code,  # Код тикера
+            'OPERATION': 'B' if stop.isbuy() else 'S',  # B = покупка, S = продажа
+            'QUANTITY': str(abs(self.store.size_to_lots(class_code, sec_code, stop.size))),  # Кол-во в лотах
+            'STOPPRICE': str(self.get_quik_price(class_code, sec_code, take_profit.price, scale)),  # Цена тейк профита
+            'STOPPRICE2': str(stop_price),  # Цена срабатывания стопа
+            'PRICE': str(int(limit_price) if float(limit_price).is_integer() else limit_price),  # Лимитная цена стопа
+            'OFFSET_UNITS': 'PRICE_UNITS',  # Отступ тейк профита в шагах цены
+            'OFFSET': f'{min_price_step:.{scale}f}',  # Переводим в строку, чтобы избежать научной записи числа шага цены
+            'SPREAD_UNITS': 'PRICE_UNITS',  # Защитный спрэд тейк профита в шагах цены
+            'SPREAD': f'{min_price_step:.{scale}f}',
+            'MARKET_TAKE_PROFIT': 'NO',  # Тейк профит исполняется лимитной заявкой с защитным спрэдом
+            'MARKET_STOP_LIMIT': 'NO',  # Стоп исполняется лимитной заявкой по лимитной цене
+            'EXPIRY_DATE': 'GTC'}  # Держим до отмены
+        parent.addinfo(NativeBracket=True)  # Дочерние заявки стоят в QUIK
+        for order in (take_profit, stop):  # Пробегаемся по дочерним заявкам
+            order.addinfo(BracketTransId=stop.ref, SubmitTime=time.time())  # Номер транзакции общей стоп заявки и время отправки
+        self.brackets[stop.ref] = (take_profit, stop)  # Заявки общей стоп заявки
+        response = self.store.provider.SendTransaction(transaction)  # Отправляем транзакцию на биржу
+        for order in (take_profit, stop):  # Пробегаемся по дочерним заявкам
+            order.submit(self)  # Заявка отправлена на биржу (статус Order.Submitted)
+            self.orders[order.ref] = order  # Сохраняем заявку в списке заявок, отправленных на биржу
+            self.notifs.append(order.clone())  # Уведомляем брокера об отправке заявки
+        if response['cmd'] == 'lua_transaction_error':  # Если возникла ошибка при постановке заявки на уровне QUIK
+            logger.error('Ошибка отправки стоп заявки bracket в QUIK %s.%s %s', class_code, sec_code, response['lua_error'])
+            for order in (take_profit, stop):  # Отклоняем обе дочерние заявки
+                self.set_bracket_status(order, Order.Rejected)
+        if self.journal:  # Если ведем журнал
+            for order in (take_profit, stop):
+                self.journal.write_order(order, self.get_trans_id(order.ref))  # Записываем заявки до ответа биржи
+
+    def get_quik_price(self, class_code, sec_code, price, scale):
+        """Цена BackTrader в QUIK, округленная до кол-ва значащих цифр. Целое значение без десятичных знаков"""
+        price = round(self.store.bt_to_quik_price(class_code, sec_code, price), scale)  # Переводим цену из BackTrader в QUIK
+        return int(price) if price.is_integer() else price
+
+    def get_bracket_order(self, ref, price):
+        """Заявка из общей стоп заявки тейк профит и стоп, которая исполнилась по цене сделки
+        Тейк профит и стоп стоят по разные стороны от цены входа. Исполнилась заявка, к цене которой ближе цена сделки
+        """
+        take_profit, stop = self.brackets[ref]
+        if not take_profit.alive() or not stop.alive():  # Если одна из заявок уже завершена
+            return take_profit if take_profit.alive() else stop  # то исполняется оставшаяся
+        return take_profit if abs(price - take_profit.price) < abs(price - stop.price) else stop
+
+    def set_bracket_status(self, order, status):
+        """Статус заявки из общей стоп заявки без транзакции в QUIK. Заявки завершаются в QUIK вместе"""
+        if order.status == status or not order.alive():  # Если статус уже стоит, или заявка уже завершена
+            return  # то статус не меняем
+        try:  # При смене статуса BackTrader берет дату последнего бара, которого может не быть
+            if status == Order.Accepted:  # Заявка принята
+                order.accept(self)
+            elif status == Order.Canceled:  # Заявка снята
+                order.cancel()
+            elif status == Order.Rejected:  # Заявка отклонена
+                order.reject(self)
+            elif status == Order.Margin:  # Не хватает средств
+                order.margin()
+            else:  # Остальные статусы (исполнение) приходят со сделками
+                return
+        except (KeyError, IndexError):  # При ошибке
+            order.status = status  # все равно ставим статус заявки
+        self.notifs.append(order.clone())  # Уведомляем брокера о заявке
+        if self.journal:  # Если ведем журнал
+            self.journal.write_order(order, self.get_trans_id(order.ref))  # Записываем состояние заявки
+
+    def on_journal_order_trade(self, qk_trade):
+        """Учет сделки по заявке, выставленной до перезапуска (из журнала)"""
+        trade_num = int(qk_trade['trade_num'])  # Номер сделки
+        dataname, size, price = self.get_trade_size_price(qk_trade)  # Название тикера, кол-во и цена сделки
+        if trade_num in self.trade_nums.setdefault(dataname, set()):  # Если сделка уже учтена
+            return  # то выходим, дальше не продолжаем
+        self.trade_nums[dataname].add(trade_num)  # Запоминаем номер сделки
+        psize, pprice, _, _ = self.positions[dataname].update(size, price)  # Обновляем позицию на сделку
+        if self.risk:  # Если проверяем заявки
+            self.risk.on_fill(None, dataname, size, price, self.get_mult(dataname))  # Учитываем сделку в позиции и убытке за день
+        self.journal.write('trade', dataname=dataname, trade_num=trade_num, ref=int(qk_trade.get('trans_id', 0)), size=size, price=price)  # Записываем сделку
+        self.journal.write('position', dataname=dataname, size=psize, price=pprice)  # Записываем позицию после сделки
+
+    def get_trade_size_price(self, qk_trade):
+        """Название тикера, кол-во в штуках со знаком и цена в BackTrader из сделки QUIK"""
+        class_code = qk_trade['class_code']  # Код площадки
+        sec_code = qk_trade['sec_code']  # Код тикера
+        dataname = self.store.class_sec_code_to_data_name(class_code, sec_code)  # Получаем название тикера по коду площадки и коду тикера
+        size = int(qk_trade['qty'])  # Абсолютное кол-во
+        if self.p.Lots:  # Если входящий остаток в лотах
+            size = self.store.lots_to_size(class_code, sec_code, size)  # то переводим кол-во из лотов в штуки
+        if qk_trade['flags'] & 0b100 == 0b100:  # Если сделка на продажу (бит 2)
+            size *= -1  # то кол-во ставим отрицательным
+        price = self.store.quik_to_bt_price(class_code, sec_code, float(qk_trade['price']))  # Переводим цену исполнения за лот в цену исполнения за штуку
+        return dataname, size, price
@@ -0,0 +1,155 @@
+import logging
+import math
+import os
+import pickle
+
+from backtrader import Analyzer
+from backtrader.lineiterator import LineIterator
+
+logger = logging.getLogger(__name__)  # Лог контрольной точки
+
+
+class QKCheckpoint(Analyzer):
+    """Контрольная точка торговой системы. Сохраняет последние значения линий данных, торговой системы и ее индикаторов
+    При следующем запуске значения восстанавливаются, а в торговую систему приходят только бары после контрольной точки
+    Состояние индикаторов (EMA, SMMA, окна Highest/Lowest) хранится в их линиях, поэтому повторно прогонять историю не нужно
+    Работает в режиме next (LiveBars=True или cerebro.run(preload=False, runonce=False)) при одинаковом составе данных и индикаторов
+    Чтобы не загружать историю до контрольной точки, в данные QKData передается тот же файл (Checkpoint). Они запросят только бары после нее
+    """
+    params = (
+        ('FileName', 'checkpoint.pkl'),  # Файл контрольной точки
+        ('Size', 1000),  # Кол-во последних значений каждой линии. Не меньше минимального периода индикаторов
+        ('Interval', 100),  # Кол-во баров между сохранениями. В режиме новых баров (LIVE) сохраняем на каждом баре
+    )
+
+    def __init__(self):
+        self.bars = 0  # Кол-во баров после последнего сохранения
+        self.restored = False  # Торговая система восстановлена из контрольной точки
+
+    def start(self):
+        if not os.path.isfile(self.p.FileName):  # Если контрольной точки нет
+            return  # то восстанавливать нечего
+        with open(self.p.FileName, 'rb') as f:  # Читаем контрольную точку
+            checkpoint = pickle.load(f)
+        objects = self.get_objects()  # Объекты с линиями
+        if checkpoint['signature'] != self.get_signature(objects):  # Если состав данных и индикаторов изменился
+            logger.warning('Контрольная точка %s не подходит к торговой системе. Индикаторы будут рассчитаны по загруженной истории', self.p.FileName)
+            return  # то не восстанавливаем
+        for obj, lines_values in zip(objects, checkpoint['lines']):  # Пробегаемся по всем объектам с линиями
+            for line, values in zip(self.get_lines(obj), lines_values):  # и по всем их линиям
+                self.set_line_values(line, values)  # Восстанавливаем значения линии
+        for data in self.datas:  # Пробегаемся по всем данным
+            if len(data):  # Если у данных есть восстановленные бары
+                data.fromdate = max(data.fromdate, math.nextafter(data.datetime[0], math.inf))  # то принимаем только бары после последнего восстановленного
+        self.restored = True
+        logger.info('Торговая система восстановлена из контрольной точки %s', self.p.FileName)
+
+    def next(self):
+        self.bars += 1  # Еще один бар после последнего сохранения
+        if self.bars >= self.p.Interval or any(data._laststatus == data.LIVE for data in self.datas):  # Если прошло много баров или получаем новые бары
+            self.save()  # то сохраняем контрольную точку
+
+    def stop(self):
+        self.save()  # Сохраняем контрольную точку при выходе
+
+    def get_analysis(self):
+        return dict(restored=self.restored)
+
+    # Функции
+
+    def save(self):
+        """Сохранение контрольной точки"""
+        objects = self.get_objects()  # Объекты с линиями
+        size = max([self.p.Size] + [getattr(obj, '_minperiod', 1) for obj in objects])  # Кол-во значений должно покрывать минимальные периоды
+        checkpoint = dict(signature=self.get_signature(objects),
+                          dates={get_data_key(data): data.datetime[0] for data in self.datas if len(data)},  # Время последнего бара данных для загрузки истории
+                          states={get_data_key(data): data.get_checkpoint_state() for data in self.datas if hasattr(data, 'get_checkpoint_state')},  # Бары данных, которые еще формируются
+                          lines=[[self.get_line_values(line, size) for line in self.get_lines(obj)] for obj in objects])
+        tmp_filename = f'{self.p.FileName}.tmp'  # Сначала пишем во временный файл
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, self.p.FileName)  # Заменяем контрольную точку атомарно
+        self.bars = 0
+
+    def get_objects(self):
+        """Данные, торговая система, ее индикаторы и обозреватели в постоянном порядке"""
+        objects = list(self.datas) + [self.strategy]  # Сначала данные и торговая система
+        seen = set(id(obj) for obj in objects)  # Один объект может быть в нескольких списках
+        stack = list(reversed(self.get_children(self.strategy)))  # Обходим индикаторы в глубину
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:  # Если объект уже учли
+                continue  # то пропускаем его
+            seen.add(id(obj))
+            objects.append(obj)
+            stack.extend(reversed(self.get_children(obj)))
+        return objects
+
+    @staticmethod
+    def get_children(obj):
+        """Индикаторы и обозреватели объекта"""
+        if not hasattr(obj, '_lineiterators'):  # У операций над линиями может не быть вложенных индикаторов
+            return []
+        return list(obj._lineiterators[LineIterator.IndType]) + list(obj._lineiterators[LineIterator.ObsType])
+
+    @staticmethod
+    def get_lines(obj):
+        """Линии объекта. У операций над линиями линия - это сам объект"""
+        return list(getattr(obj.lines, 'lines', obj.lines))
+
+    def get_signature(self, objects):
+        """Состав объектов и их линий для проверки контрольной точки"""
+        return [(type(obj).__name__, len(self.get_lines(obj))) for obj in objects]
+
+    @staticmethod
+    def get_line_values(line, size):
+        """Последние значения линии"""
+        return list(line.get(size=min(len(line), size)))
+
+    @staticmethod
+    def set_line_values(line, values):
+        """Запись значений в пустую линию. Пишем напрямую в буфер, чтобы не трогать привязанные линии"""
+        if not values:  # Если значений нет
+            return  # то записывать нечего
+        line.forward(size=len(values))  # Добавляем место под значения
+        for ago in range(1 - len(values), 1):  # Пробегаемся от самого старого значения к последнему
+            line.array[line.idx + ago] = values[len(values) - 1 + ago]
+
+
+def get_data_key(data):
+    """Ключ данных в контрольной точке: тикер и интервал"""
+    return data.p.dataname, data._timeframe, data._compression
+
+
+def load_checkpoint(file_name):
+    """Чтение контрольной точки
+
+    :param str file_name: Файл контрольной точки
+    :return: Контрольная точка или None, если ее нет
+    """
+    if not os.path.isfile(file_name):  # Если контрольной точки нет
+        return None
+    with open(file_name, 'rb') as f:  # Читаем контрольную точку
+        return pickle.load(f)
+
+
+def get_last_datetime(file_name, data):
+    """Время последнего бара данных в контрольной точке. Читается данными до загрузки истории, т.к. торговая система восстанавливается позже
+
+    :param str file_name: Файл контрольной точки
+    :param data: Данные
+    :return: Время последнего бара (число date2num) или None, если контрольной точки или бара данных нет
+    """
+    checkpoint = load_checkpoint(file_name)
+    return checkpoint.get('dates', {}).get(get_data_key(data)) if checkpoint else None  # Контрольные точки прошлых версий времени баров не содержат
+
+
+def get_data_state(file_name, data):
+    """Состояние данных в контрольной точке (get_checkpoint_state). Читается данными при запуске
+
+    :param str file_name: Файл контрольной точки
+    :param data: Данные
+    :return: Состояние данных или None, если контрольной точки или состояния данных нет
+    """
+    checkpoint = load_checkpoint(file_name)
+    return checkpoint.get('states', {}).get(get_data_key(data)) if checkpoint else None  # Контрольные точки прошлых версий состояний данных не содержат
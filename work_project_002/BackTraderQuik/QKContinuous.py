@@ -0,0 +1,225 @@
+import os
+from glob import glob
+from json import dumps, loads
+import zlib
+
+import numpy as np
+
+from BackTraderQuik.QKBarStore import QKBarStore, format_datetime, format_values, resample_bars
+
+MONTHS = 'FGHJKMNQUVXZ'  # Месяцы экспирации фьючерсов: F - январь, G - февраль, ..., Z - декабрь
+
+
+class QKContinuous:
+    """Непрерывный фьючерс, склеенный из хранилищ баров отдельных контрактов (QKBarStore)
+    В хранилище непрерывного фьючерса бары контрактов лежат без корректировки. Цены прошлых контрактов корректируются при чтении по таблице переходов.
+    Поэтому новый контракт меняет только хвост хранилища и таблицы переходов, начиная с отрезка последнего не измененного контракта
+    """
+    def __init__(self, path, roll='volume', days=5, adjust='add'):
+        """Инициализация
+
+        :param str path: Папка хранилища непрерывного фьючерса
+        :param str roll: Правило перехода на следующий контракт: 'volume' - на следующий день после дня, когда объем следующего контракта больше объема текущего,
+        но не позже, чем за days торговых дней до последнего дня текущего контракта. 'date' - за days торговых дней до последнего дня текущего контракта.
+        Последний день известен только у контракта, который уже не торгуется. Пока текущий контракт торгуется, переходим только по объему
+        :param int days: Кол-во торговых дней до последнего дня текущего контракта, в которые переходим на следующий контракт
+        :param str adjust: Корректировка цен прошлых контрактов при чтении: 'add' - на разницу цен при переходе, 'ratio' - на отношение цен, None - без корректировки
+        """
+        self.store = QKBarStore(path)  # Хранилище склеенных баров без корректировки
+        self.rolls_file = os.path.join(path, 'rolls.json')  # Файл таблицы переходов
+        self.roll = roll  # Правило перехода
+        self.days = days  # Кол-во торговых дней до последнего дня контракта
+        self.adjust = adjust  # Корректировка цен прошлых контрактов
+        self.contracts = []  # Таблица переходов по контрактам непрерывного фьючерса
+        if os.path.isfile(self.rolls_file):  # Если таблица переходов уже есть
+            with open(self.rolls_file, encoding='utf-8') as f:
+                rolls = loads(f.read())
+            if (rolls['roll'], rolls['days']) == (roll, days):  # Если правило перехода не менялось
+                self.contracts = rolls['contracts']  # то переходы можно не пересчитывать
+
+    def __len__(self):
+        return len(self.store)
+
+    def update(self, stores):
+        """Пересчет по хранилищам контрактов. Переходы и бары пересчитываются с отрезка последнего не измененного контракта
+
+        :param stores: Хранилища баров контрактов (QKBarStore). Контракты упорядочиваются по месяцу экспирации из тикера
+        :return: Кол-во пересчитанных переходов, кол-во записанных строк
+        """
+        contracts = []  # Контракты: тикер, колонки баров, отпечаток баров, месяц экспирации
+        for store in stores:  # Пробегаемся по всем хранилищам контрактов
+            if len(store):  # Если в хранилище есть бары
+                columns = store.read()
+                sec_code = get_sec_code(store.path)  # Тикер контракта
+                contracts.append((sec_code, columns, get_stamp(columns), get_expiry(sec_code, columns['datetime'][0])))
+        contracts.sort(key=lambda contract: contract[3])  # Контракты по месяцу экспирации. Несколько контрактов могут торговаться одновременно
+        keep = 0  # Кол-во первых контрактов, которые не менялись
+        while keep < min(len(contracts), len(self.contracts)) and \
+                [contracts[keep][0], contracts[keep][2]] == [self.contracts[keep]['sec_code'], self.contracts[keep]['stamp']]:
+            keep += 1
+        if keep == len(contracts) == len(self.contracts):  # Если контракты не менялись
+            return 0, 0  # то пересчитывать нечего
+        table = self.contracts[:keep]  # Переходы на не измененные контракты зависят только от них и не меняются
+        rolled = keep == 0 or self.contracts[keep - 1]['start'] is not None  # На последний не измененный контракт перешли
+        for i in range(keep, len(contracts)):  # Пробегаемся по измененным и новым контрактам
+            sec_code, columns, stamp, _ = contracts[i]
+            prev = next((j for j in range(i - 1, -1, -1) if table[j]['start'] is not None), None)  # Предыдущий контракт непрерывного фьючерса
+            if not rolled:  # Пока не перешли на предыдущий контракт, на следующие не переходим
+                start, gap, ratio = None, 0.0, 1.0
+            elif prev is None:  # Первый контракт непрерывного фьючерса
+                start, gap, ratio = columns['datetime'][0], 0.0, 1.0
+            else:  # Переход с предыдущего контракта
+                start, gap, ratio = get_roll(contracts[prev][1], columns, np.datetime64(table[prev]['start'], 's'), self.roll, self.days)
+            rolled = start is not None
+            # Контракт, на который еще не перешли, в непрерывный фьючерс не входит (start=None)
+            table.append(dict(sec_code=sec_code, stamp=stamp, start=None if start is None else str(start), gap=gap, ratio=ratio))
+        segments = [i for i, contract in enumerate(table) if contract['start'] is not None]  # Контракты непрерывного фьючерса
+        starts = np.array([table[i]['start'] for i in segments], dtype='M8[s]')  # Начала отрезков контрактов
+        first = sum(i < keep for i in segments) - 1  # Конец отрезка последнего не измененного контракта зависит от следующего. Пересчитываем с его отрезка
+        rows = 0  # Кол-во строк хранилища, которые не меняются. Если все контракты изменились, то хранилище пишется заново
+        if first >= 0 and len(self.store):  # Если есть не измененный контракт
+            rows = int(np.searchsorted(self.store.read()['datetime'], starts[first], 'left'))
+        first = max(first, 0)
+        tail = {name: [] for name, _ in QKBarStore.columns}  # Перезаписываемый хвост хранилища
+        for k in range(first, len(segments)):  # Пробегаемся по пересчитываемым отрезкам
+            dt = contracts[segments[k]][1]['datetime']
+            i = np.searchsorted(dt, starts[k], 'left')  # Отрезок контракта от перехода на него до перехода на следующий контракт
+            j = np.searchsorted(dt, starts[k + 1], 'left') if k + 1 < len(starts) else len(dt)
+            for name, _ in QKBarStore.columns:
+                tail[name].append(np.asarray(contracts[segments[k]][1][name][i:j]))
+        self.store.commit(rows)  # Отбрасываем хвост, как в QKBarStore.upsert
+        self.store.truncate(rows)
+        written = self.store.upsert(*(np.concatenate(tail[name]) for name, _ in QKBarStore.columns)) if tail['datetime'] else 0
+        self.contracts = table
+        tmp_file = f'{self.rolls_file}.tmp'  # Таблицу переходов пишем после хранилища и заменяем атомарно
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(dumps(dict(roll=self.roll, days=self.days, contracts=table), indent=1))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.rolls_file)
+        return len(table) - keep, written
+
+    def read(self, start=None, end=None):
+        """Колонки баров непрерывного фьючерса с корректировкой цен прошлых контрактов
+
+        :param numpy.datetime64 start: Первое время баров. None - с начала
+        :param numpy.datetime64 end: Последнее время баров. None - до конца
+        :return: Массивы по имени колонки
+        """
+        columns = {name: np.array(column) for name, column in self.store.read(start, end).items()}  # Копии, т.к. цены меняются
+        contracts = [contract for contract in self.contracts if contract['start'] is not None]  # Контракты непрерывного фьючерса
+        if self.adjust is None or len(contracts) < 2:  # Если корректировать нечего
+            return columns
+        starts = np.array([contract['start'] for contract in contracts], dtype='M8[s]')  # Начала отрезков контрактов
+        segment = np.searchsorted(starts, columns['datetime'], 'right') - 1  # Отрезок каждого бара
+        if self.adjust == 'ratio':  # Цены прошлых контрактов умножаем на отношения цен всех следующих переходов
+            factors = np.append(np.cumprod([contract['ratio'] for contract in contracts][:0:-1])[::-1], 1.0)
+            for name in ('open', 'high', 'low', 'close'):
+                columns[name] *= factors[segment]
+        else:  # К ценам прошлых контрактов прибавляем разницы цен всех следующих переходов
+            offsets = np.append(np.cumsum([contract['gap'] for contract in contracts][:0:-1])[::-1], 0.0)
+            for name in ('open', 'high', 'low', 'close'):
+                columns[name] += offsets[segment]
+        return columns
+
+    def export_csv(self, file_name, sep='\t', date_format='%d.%m.%Y %H:%M'):
+        """Выгрузка баров с корректировкой в текстовый файл в формате 04_Bars.py. Корректировка меняет всю историю, поэтому файл пишется заново
+
+        :return: Кол-во записанных строк
+        """
+        columns = self.read()
+        lines = zip(format_datetime(columns['datetime'], date_format), *(format_values(columns[name], name == 'volume') for name, _ in QKBarStore.columns[1:]))
+        with open(file_name, 'w', encoding='utf-8', newline='') as f:  # Как QKBarStore.export_csv
+            f.write(sep.join(name for name, _ in QKBarStore.columns) + os.linesep)
+            f.writelines(sep.join(line) + os.linesep for line in lines)
+        return len(columns['datetime'])
+
+
+def get_sec_code(path):
+    """Тикер по папке хранилища QKBarStore.get_path: <Код площадки>.<Тикер>_<Интервал>"""
+    return os.path.basename(os.path.normpath(path)).split('.', 1)[-1].rsplit('_', 1)[0]
+
+
+def get_stamp(columns):
+    """Отпечаток баров контракта: кол-во, время последнего бара и контрольная сумма всех колонок. Меняется и при перезаписи прошлых баров
+
+    :param dict columns: Колонки баров (QKBarStore.read)
+    :return: Отпечаток для таблицы переходов
+    """
+    crc = 0  # Контрольная сумма колонок
+    for name, _ in QKBarStore.columns:  # Пробегаемся по всем колонкам
+        crc = zlib.crc32(np.ascontiguousarray(columns[name]).view(np.uint8), crc)  # Байты колонки. Буфер numpy.datetime64 напрямую не отдается
+    return [len(columns['datetime']), str(columns['datetime'][-1]), crc]
+
+
+def get_expiry(sec_code, first):
+    """Месяц экспирации фьючерса по тикеру <Тикер><Месяц экспирации><Последняя цифра года>
+
+    :param str sec_code: Тикер фьючерса. Например, VBZ3
+    :param numpy.datetime64 first: Время первого бара. Год экспирации - ближайший с последней цифрой, не раньше года первого бара
+    :return: Месяц экспирации (numpy.datetime64[M]). Если тикер не в формате фьючерса, то месяц первого бара
+    """
+    first = np.datetime64(first, 'M')
+    if len(sec_code) < 3 or sec_code[-2] not in MONTHS or not sec_code[-1].isdigit():  # Если тикер не в формате фьючерса
+        return first
+    year = first.astype('M8[Y]').astype(np.int64) + 1970  # Год первого бара
+    year += (int(sec_code[-1]) - year) % 10  # Ближайший год с последней цифрой
+    return np.datetime64(f'{year:04d}-{MONTHS.index(sec_code[-2]) + 1:02d}', 'M')
+
+
+def find_stores(datapath, class_code, base, time_frame, compression):
+    """Хранилища баров контрактов фьючерса. Формат фьючерса: <Тикер><Месяц экспирации><Последняя цифра года>
+
+    :param str base: Тикер базового актива. Например, VB для VBZ3, VBH4, ...
+    :return: Существующие хранилища контрактов
+    """
+    pattern = QKBarStore.get_path(datapath, class_code, f'{base}[FGHJKMNQUVXZ][0-9]', time_frame, compression)
+    return [store for store in map(QKBarStore, sorted(glob(pattern))) if store.exists()]
+
+
+def get_roll(current, following, start, roll='volume', days=5):
+    """Переход с текущего контракта на следующий
+
+    :param dict current: Колонки баров текущего контракта (QKBarStore.read)
+    :param dict following: Колонки баров следующего контракта
+    :param numpy.datetime64 start: Начало отрезка текущего контракта. Переход не раньше следующего торгового дня
+    :param str roll: Правило перехода 'volume'/'date'
+    :param int days: Кол-во торговых дней до последнего дня текущего контракта
+    :return: Время первого бара следующего контракта, разница и отношение цен закрытия контрактов перед переходом.
+    None, если переходить еще рано или у следующего контракта нет баров после начала дня отрезка текущего контракта
+    """
+    current_days, following_days = resample_bars(current, 'D'), resample_bars(following, 'D')  # Дневные бары контрактов
+    first_day = start.astype('M8[D]') + np.timedelta64(1, 'D')  # Переходим не раньше следующего дня после начала отрезка
+    dates = following_days['datetime'][following_days['datetime'] >= first_day]  # Дни, в которые можно перейти на следующий контракт
+    if not len(dates):  # Если таких дней нет
+        return None, 0.0, 1.0
+    cur_dates = current_days['datetime']
+    roll_day = None  # День перехода
+    if following_days['datetime'][-1] > cur_dates[-1]:  # Если следующий контракт торгуется после последнего дня текущего, то текущий уже не торгуется.
+        # Его последний день известен
+        if days > 0:  # Последний день, в который переходим
+            roll_day = cur_dates[max(len(cur_dates) - days, 0)]
+        else:  # Переходим после последнего дня текущего контракта
+            roll_day = cur_dates[-1] + np.timedelta64(1, 'D')
+    if roll == 'volume':  # Если переходим по объему
+        common, i, j = np.intersect1d(cur_dates, following_days['datetime'], return_indices=True)  # Дни торгов обоих контрактов
+        more = (following_days['volume'][j] > current_days['volume'][i]) & (common >= first_day)  # Дни, в которые объем следующего контракта больше
+        if more.any():  # Если такие дни есть
+            day = common[np.argmax(more)] + np.timedelta64(1, 'D')  # то переходим на следующий день после первого из них,
+            # т.к. объем за день известен только после его окончания
+            roll_day = day if roll_day is None else min(roll_day, day)
+    if roll_day is None:  # Если текущий контракт торгуется, а объем следующего еще не больше
+        return None, 0.0, 1.0  # то переходить рано
+    k = np.searchsorted(dates, roll_day, 'left')  # День торгов следующего контракта
+    if k == len(dates):  # Если этого дня еще не было
+        return None, 0.0, 1.0  # то переходить рано
+    roll_day = dates[k]
+    dt = np.asarray(following['datetime'])
+    roll_dt = dt[np.searchsorted(dt, roll_day, 'left')]  # Первый бар следующего контракта в день перехода
+    i = np.searchsorted(current['datetime'], roll_dt, 'left') - 1  # Последний бар текущего контракта перед переходом
+    j = np.searchsorted(dt, roll_dt, 'left') - 1  # Последний бар следующего контракта перед переходом
+    if i < 0:  # Если у текущего контракта нет баров перед переходом
+        return roll_dt, 0.0, 1.0
+    before = current['close'][i]  # Цена текущего контракта перед переходом
+    after = following['close'][j] if j >= 0 else following['open'][j + 1]  # Цена следующего контракта перед переходом или на открытии
+    return roll_dt, float(after - before), float(after / before)
@@ -1,10 +1,20 @@
+import collections
 from datetime import datetime, timedelta, time
+import logging
+from time import monotonic
+
+import numpy as np
 
 from backtrader.feed import AbstractDataBase
 from backtrader.utils.py3 import with_metaclass
-from backtrader import TimeFrame, date2num
+from backtrader import TimeFrame, date2num, num2date
 
 from BackTraderQuik import QKStore
+from BackTraderQuik.QKCheckpoint import get_last_datetime, get_data_state
+from BackTraderQuik.QKIntegrity import SESSIONS, get_expected
+from BackTraderQuik.QKMetrics import metrics
+
+logger = logging.getLogger(__name__)  # Лог данных
 
 
 class MetaQKData(AbstractDataBase.__class__):
@@ -18,11 +28,19 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
     params = (
         ('FourPriceDoji', False),  # False - не пропускать дожи 4-х цен, True - пропускать
         ('LiveBars', False),  # False - только история, True - история и новые бары
+        ('BaseData', None),  # Данные меньшего интервала того же тикера. Бары строятся из них без своей загрузки истории и подписки
+        ('TickBars', False),  # False - новые бары по подписке на бары, True - новые бары строятся из обезличенных сделок
+        ('TickCloseDelay', 0.5),  # Задержка в секундах закрытия бара по часам, если сделок следующего интервала еще нет
+        ('Backfill', True),  # Догружать из истории QUIK бары, пропущенные подпиской (переподключение, пропуск перед новым баром)
+        ('BackfillBars', 1000),  # Максимальное кол-во баров в запросе догрузки
+        ('Checkpoint', None),  # Файл контрольной точки QKCheckpoint. Если в нем есть бар этих данных, то загружаются только бары после него
     )
 
     def islive(self):
-        """Если подаем новые бары, то Cerebro не будет запускать preload и runonce, т.к. новые бары должны идти один за другим"""
-        return self.p.LiveBars
+        """Если подаем новые бары, то Cerebro не будет запускать preload и runonce, т.к. новые бары должны идти один за другим
+        Бары большего интервала строятся из баров меньшего интервала тоже по одному, чтобы не заглядывать в будущее
+        """
+        return self.p.LiveBars or self.baseData is not None or len(self.derivedDatas) > 0
 
     def __init__(self, **kwargs):
         self.interval = self.p.compression  # Для минутных временнЫх интервалов ставим кол-во минут
@@ -38,7 +56,28 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
 
         self.jsonBars = []  # Исторические бары после применения фильтров
         self.newCandleSubscribed = False  # Наличие подписки на получение новых баров
+        self.bars = None  # Очередь новых баров по подписке
+        self.missedBars = collections.deque()  # Догруженные пропущенные бары. Отдаются до новых баров по подписке
+        self.lastBarDt = None  # Дата и время открытия последнего полученного бара, в т.ч. пропущенного дожи 4-х цен
         self.liveMode = False  # Режим получения баров. False = История, True = Новые бары
+        self.historyDone = False  # Все исторические бары отданы, а новые бары не принимаем
+        self.derivedDatas = []  # Данные большего интервала, которые строятся из баров этих данных
+
+        self.baseData = self.p.BaseData  # Данные меньшего интервала, из которых строятся бары
+        self.derivedBar = None  # Формируемый бар
+        self.derivedBars = collections.deque()  # Сформированные, но еще не отданные бары
+        self.lastBaseDt = None  # Дата и время открытия последнего учтенного бара меньшего интервала
+        self.ticks = None  # Очередь обезличенных сделок
+        self.tickBar = None  # Бар, формируемый из обезличенных сделок
+        self.seedTicks = 0  # Кол-во сделок в очереди, пришедших до получения формируемого бара из истории. Они уже учтены в нем
+        self.seedOpen = None  # Дата и время открытия формируемого бара из истории
+        self.lastBarTime = None  # Время получения последнего бара
+        if self.baseData is not None:  # Если бары строятся из данных меньшего интервала
+            if (self.baseData.classCode, self.baseData.secCode) != (self.classCode, self.secCode):  # Тикер должен совпадать
+                raise ValueError(f'Бары {self.p.dataname} нельзя построить из баров другого тикера {self.baseData.p.dataname}')
+            if self.baseData.interval >= self.interval or self.interval < 1440 and self.interval % self.baseData.interval:  # Интервал должен быть кратным
+                raise ValueError(f'Интервал {self.interval} мин. нельзя построить из интервала {self.baseData.interval} мин.')
+            self.baseData.derivedDatas.append(self)  # Бары будем получать от данных меньшего интервала
 
     def setenvironment(self, env):
         """Добавление хранилища QUIK в cerebro"""
@@ -47,8 +86,24 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
 
     def start(self):
         super(QKData, self).start()
+        metrics.set_function('qk_last_bar_age_seconds', lambda: monotonic() - self.lastBarTime if self.lastBarTime else None,
+                             data=self.p.dataname, interval=self.interval)  # Время с получения последнего бара
         self.put_notification(self.DELAYED)  # Отправляем уведомление об отправке исторических (не новых) баров
-        json_bars = self.store.provider.GetCandlesFromDataSource(self.classCode, self.secCode, self.interval, 0)['data']  # Получаем все бары из QUIK
+        if self.baseData is not None:  # Если бары строятся из данных меньшего интервала
+            checkpoint = self.p.Checkpoint or self.baseData.p.Checkpoint  # Файл контрольной точки этих данных или данных меньшего интервала
+            state = get_data_state(checkpoint, self) if checkpoint else None  # Бары, которые формировались в контрольной точке
+            if state:  # Данные меньшего интервала загрузят только бары после контрольной точки
+                self.derivedBar = state['derivedBar']  # Поэтому формируемый бар продолжаем строить с того же места
+                self.derivedBars = collections.deque(state['derivedBars'])  # Сформированные, но еще не отданные бары
+                self.lastBaseDt = state['lastBaseDt']  # Уже учтенные бары меньшего интервала повторно не добавляем
+            return  # Историю не загружаем
+        count = 0  # Кол-во последних баров. 0 - все бары
+        last = get_last_datetime(self.p.Checkpoint, self) if self.p.Checkpoint else None  # Время последнего бара в контрольной точке
+        if last is not None:  # Если торговая система восстановится из контрольной точки
+            count = int((self.get_quik_date_time_now() - num2date(last)).total_seconds() // 60 // self.interval) + 2  # то получаем только бары после нее
+            # и формируемый бар. Бары есть не на всех интервалах, поэтому это верхняя граница
+            logger.info('%s Загрузка истории после контрольной точки %s: до %s баров', self.p.dataname, num2date(last), count)
+        json_bars = self.store.market_request('GetCandlesFromDataSource', self.classCode, self.secCode, self.interval, count)['data']  # Получаем бары из QUIK
         for bar in json_bars:  # Пробегаемся по всем полученным барам из QUIK
             if self.is_bar_valid(bar, False):  # Если исторический бар соответствует всем условиям выборки
                 self.jsonBars.append(bar)  # то добавляем бар
@@ -57,38 +112,68 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
 
     def _load(self):
         """Загружаем бар из истории или новый бар в BackTrader"""
-        if not self.newCandleSubscribed:  # Если получаем исторические данные
-            if len(self.jsonBars) > 0:  # Если есть исторические данные
-                bar = self.jsonBars[0]  # Берем первый бар из выборки, с ним будем работать
-                self.jsonBars.remove(bar)  # Убираем его из хранилища новых баров
-            else:  # Если исторических данных нет
+        if self.baseData is not None:  # Если бары строятся из данных меньшего интервала
+            bar = self.get_derived_bar()  # Получаем сформированный бар
+            if not bar:  # Если бара нет (None) или больше не будет (False)
+                return bar  # то передаем это в BackTrader
+        elif not self.newCandleSubscribed:  # Если получаем исторические данные
+            bar = None  # Бар еще не найден
+            while len(self.jsonBars) > 0:  # Пока есть исторические данные
+                bar = self.jsonBars.pop(0)  # Берем первый бар из выборки и убираем его из хранилища
+                self.lastBarDt = self.get_bar_open_date_time(bar)  # Запоминаем последний полученный бар
+                self.put_base_bar(bar)  # Передаем бар в данные большего интервала
+                if self.p.FourPriceDoji or not self.is_four_price_doji(bar):  # Если бар не нужно пропускать
+                    break  # то работаем с ним
+                bar = None  # Дожи 4-х цен пропускаем
+            if bar is None:  # Если исторических данных нет
                 self.put_notification(self.DISCONNECTED)  # Отправляем уведомление об окончании получения исторических баров
                 if not self.p.LiveBars:  # Если новые бары не принимаем
+                    self.historyDone = True  # Данные большего интервала заберут последний бар
                     return False  # Больше сюда заходить не будем
-                if not self.store.provider.IsSubscribed(self.classCode, self.secCode, self.interval)['data']:  # Если не было подписки на тикер/интервал
-                    self.store.provider.SubscribeToCandles(self.classCode, self.secCode, self.interval)  # Подписываемся на новые бары
-                    self.store.subscribed_symbols.append({'class': self.classCode, 'sec': self.secCode, 'interval': self.interval})  # Добавляем в список подписанных тикеров/интервалов
+                if self.p.TickBars:  # Если новые бары строим из обезличенных сделок
+                    self.start_tick_bars()  # то подписываемся на сделки
+                else:  # Если новые бары получаем по подписке
+                    self.bars = self.store.subscribe_bars(self.classCode, self.secCode, self.interval)  # Подписываемся на новые бары. Хранилище подпишется в QUIK, если подписки еще нет
                 self.newCandleSubscribed = True  # Дальше будем получать новые бары по подписке
                 return None  # Будем заходить еще
-        else:  # Если получаем новые бары по подписке
-            if len(self.store.new_bars) == 0:  # Если в хранилище никаких новых баров нет
+        elif self.p.TickBars:  # Если новые бары строим из обезличенных сделок
+            bar = self.get_tick_bar()  # Получаем закрытый бар
+            if bar is None:  # Если бар еще не закрыт
+                return None  # то нового бара нет, будем заходить еще
+            if not self.is_bar_valid(bar, True):  # Если бар не соответствует всем условиям выборки
                 return None  # то нового бара нет, будем заходить еще
-            new_bars = [newBar for newBar in self.store.new_bars  # Смотрим в хранилище новых баров
-                        if newBar['class'] == self.classCode and  # бары с нужным кодом площадки,
-                        newBar['sec'] == self.secCode and  # тикером,
-                        int(newBar['interval']) == self.interval]  # и интервалом
-            if len(new_bars) == 0:  # Если новый бар еще не появился
+            self.put_base_bar(bar)  # Передаем бар в данные большего интервала
+            if not self.p.FourPriceDoji and self.is_four_price_doji(bar):  # Если не пропускаем дожи 4-х цен, но такой бар пришел
                 return None  # то нового бара нет, будем заходить еще
-            bar = new_bars[0]  # Получаем текущий (первый) бар из выборки, с ним будем работать
-            self.store.new_bars.remove(bar)  # Убираем его из хранилища новых баров
+        else:  # Если получаем новые бары по подписке
+            if not self.missedBars:  # Если догруженных пропущенных баров нет
+                if not self.bars:  # Если новый бар еще не появился в очереди подписки
+                    return None  # то нового бара нет, будем заходить еще
+                bar = self.bars.popleft()  # Берем первый бар из очереди, с ним будем работать
+                if bar is None:  # Если хранилище переподключилось к QUIK
+                    self.backfill()  # то догружаем бары, закрывшиеся без связи
+                    return None  # Будем заходить еще
+                if self.backfill(self.get_bar_open_date_time(bar)):  # Если перед новым баром были пропущены бары
+                    self.bars.appendleft(bar)  # то новый бар отдадим после них
+            missed = len(self.missedBars) > 0  # Отдаем пропущенный бар
+            if missed:
+                bar = self.missedBars.popleft()
             if not self.is_bar_valid(bar, True):  # Если бар по подписке не соответствует всем условиям выборки
                 return None  # то нового бара нет, будем заходить еще
             dt_open = self.get_bar_open_date_time(bar)  # Дата и время открытия бара
+            self.lastBarDt = dt_open  # Запоминаем последний полученный бар
+            self.put_base_bar(bar)  # Передаем бар в данные большего интервала
+            if not self.p.FourPriceDoji and self.is_four_price_doji(bar):  # Если не пропускаем дожи 4-х цен, но такой бар пришел
+                return None  # то нового бара нет, будем заходить еще
             dt_next_bar_close = self.get_bar_close_date_time(dt_open, 2)  # Биржевое время закрытия следующего бара
             time_market_now = self.get_quik_date_time_now()  # Текущее биржевое время из QUIK
+            if missed:  # Пропущенные бары отдаем как исторические
+                if self.liveMode:  # Если находились в режиме получения новых баров
+                    self.put_notification(self.DELAYED)  # Отправляем уведомление об отправке исторических (не новых) баров
+                    self.liveMode = False  # Переходим в режим получения истории
             # Переходим в режим получения новых баров (LIVE), если не находимся в этом режиме и
             # следующий бар закроется в будущем (т.к. пришедший бар закрылся в прошлом), или пришел последний бар предыдущей сессии
-            if not self.liveMode and (dt_next_bar_close > time_market_now or dt_open.day != time_market_now.day):
+            elif not self.liveMode and (dt_next_bar_close > time_market_now or dt_open.day != time_market_now.day):
                 self.put_notification(self.LIVE)  # Отправляем уведомление о получении новых баров
                 self.liveMode = True  # Переходим в режим получения новых баров (LIVE)
             # Бывает ситуация, когда QUIK несколько минут не передает новые бары. Затем передает все пропущенные
@@ -104,12 +189,18 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         self.lines.close[0] = self.store.quik_to_bt_price(self.classCode, self.secCode, bar['close'])  # Close
         self.lines.volume[0] = bar['volume']  # Volume
         self.lines.openinterest[0] = 0  # Открытый интерес в QUIK не учитывается
+        self.lastBarTime = monotonic()  # Время получения бара
+        metrics.inc('qk_bars_total', data=self.p.dataname, interval=self.interval)  # Кол-во полученных баров
         return True  # Будем заходить сюда еще
 
     def stop(self):
         super(QKData, self).stop()
-        if self.newCandleSubscribed:  # Если принимали новые бары и подписались на них
-            self.store.provider.UnsubscribeFromCandles(self.classCode, self.secCode, self.interval)  # Отменяем подписку на новые бары
+        metrics.remove('qk_last_bar_age_seconds', data=self.p.dataname, interval=self.interval)  # Данные больше не получаем
+        if self.newCandleSubscribed and self.p.TickBars:  # Если строили новые бары из обезличенных сделок
+            self.store.unsubscribe_ticks(self.classCode, self.secCode, self.ticks)  # Отменяем подписку на сделки
+            self.put_notification(self.DISCONNECTED)  # Отправляем уведомление об окончании получения новых баров
+        elif self.newCandleSubscribed:  # Если принимали новые бары и подписались на них
+            self.store.unsubscribe_bars(self.classCode, self.secCode, self.interval, self.bars)  # Отменяем подписку на новые бары. Хранилище отменит ее в QUIK, если она больше никому не нужна
             self.put_notification(self.DISCONNECTED)  # Отправляем уведомление об окончании получения новых баров
         self.store.DataCls = None  # Удаляем класс данных в хранилище
 
@@ -123,10 +214,6 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         dt_close = self.get_bar_close_date_time(dt_open)  # Дата и время закрытия бара
         if self.p.sessionend != time(23, 59, 59, 999990) and dt_close.time() > self.p.sessionend:  # Если задано время окончания сессии и закрытие бара после этого времени
             return False  # то бар не соответствует условиям выборки
-        high = self.store.quik_to_bt_price(self.classCode, self.secCode, bar['high'])  # High
-        low = self.store.quik_to_bt_price(self.classCode, self.secCode, bar['low'])  # Low
-        if not self.p.FourPriceDoji and high == low:  # Если не пропускаем дожи 4-х цен, но такой бар пришел
-            return False  # то бар не соответствует условиям выборки
         time_market_now = self.get_quik_date_time_now()  # Текущее биржевое время
         if not live:  # Если получаем исторические данные
             if dt_close > time_market_now and time_market_now.time() < self.p.sessionend:  # Если время закрытия бара еще не наступило на бирже, и сессия еще не закончилась
@@ -139,6 +226,199 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
                 return False  # то бар не соответствует условиям выборки
         return True  # В остальных случаях бар соответствуем условиям выборки
 
+    def backfill(self, dt_to=None):
+        """Догрузка из истории QUIK баров, пропущенных подпиской
+
+        :param datetime dt_to: Дата и время открытия нового бара по подписке. Догружаются бары до него. None - все бары до текущего времени
+        :return: Кол-во догруженных баров
+        """
+        if not self.p.Backfill or self.lastBarDt is None:  # Если догружать не нужно, или последнего бара нет
+            return 0  # то догружать нечего
+        if dt_to is not None and dt_to <= self.get_bar_close_date_time(self.lastBarDt):  # Если новый бар идет сразу за последним или раньше него
+            return 0  # то пропуска нет
+        time_market_now = self.get_quik_date_time_now()  # Текущее биржевое время
+        if self.is_session_gap(self.get_bar_close_date_time(self.lastBarDt), dt_to or time_market_now):  # Если пропуск вне торговых сессий (ночь, выходные)
+            return 0  # то баров в нем нет, QUIK не запрашиваем
+        count = int((time_market_now - self.lastBarDt).total_seconds() // 60 // self.interval) + 2  # Бары после последнего и формируемый бар. Бары есть не на всех интервалах, поэтому это верхняя граница
+        if count > self.p.BackfillBars:  # Если пропуск больше, чем догружаем за раз
+            logger.warning('%s Пропуск после %s больше %s баров. Догружаются только последние бары', self.p.dataname, self.lastBarDt, self.p.BackfillBars)
+            count = self.p.BackfillBars
+        json_bars = self.store.market_request('GetCandlesFromDataSource', self.classCode, self.secCode, self.interval, count)['data']  # Получаем последние бары из QUIK
+        for bar in json_bars:  # Пробегаемся по всем полученным барам из QUIK
+            dt_open = self.get_bar_open_date_time(bar)  # Дата и время открытия бара
+            if dt_open <= self.lastBarDt or dt_to is not None and dt_open >= dt_to:  # Если бар уже был получен, или он не раньше нового бара
+                continue  # то пропускаем его
+            if dt_to is None and self.get_bar_close_date_time(dt_open) > time_market_now:  # Если бар еще формируется
+                break  # то его отдаст подписка
+            self.missedBars.append(bar)  # Бар отдадим до новых баров по подписке
+        if self.missedBars:  # Если были пропущены бары
+            logger.info('%s Догружено %s пропущенных баров с %s', self.p.dataname, len(self.missedBars), self.get_bar_open_date_time(self.missedBars[0]))
+            metrics.inc('qk_backfill_bars_total', len(self.missedBars), data=self.p.dataname, interval=self.interval)  # Кол-во догруженных баров
+        return len(self.missedBars)
+
+    def is_session_gap(self, dt_from, dt_to):
+        """Пропуск вне торговых сессий площадки: по календарю в нем не открывается ни один бар
+
+        :param datetime dt_from: Дата и время начала пропуска
+        :param datetime dt_to: Дата и время окончания пропуска (не включая)
+        :return: True - баров в пропуске нет. False - бары могут быть, или календаря площадки (SESSIONS) и интервала нет
+        """
+        sessions = SESSIONS.get(self.classCode)  # Торговые сессии площадки
+        if sessions is None or self.interval > 1440 or dt_from >= dt_to:  # Для недель и месяцев календарь не строится
+            return False
+        expected, _ = get_expected(np.datetime64(dt_from.date()), np.datetime64(dt_to.date()), 'D' if self.interval == 1440 else 'M', self.interval, sessions)  # Бары по календарю
+        return not ((expected >= np.datetime64(dt_from, 's')) & (expected < np.datetime64(dt_to, 's'))).any()
+
+    def is_four_price_doji(self, bar):
+        """Бар является дожи 4-х цен"""
+        high = self.store.quik_to_bt_price(self.classCode, self.secCode, bar['high'])  # High
+        low = self.store.quik_to_bt_price(self.classCode, self.secCode, bar['low'])  # Low
+        return high == low
+
+    def put_base_bar(self, bar):
+        """Передача бара в данные большего интервала"""
+        for data in self.derivedDatas:  # Пробегаемся по всем данным большего интервала
+            data.add_base_bar(bar)  # Добавляем бар в формируемый бар
+
+    def add_base_bar(self, bar):
+        """Добавление бара меньшего интервала в формируемый бар"""
+        dt_base_open = self.get_bar_open_date_time(bar)  # Дата и время открытия бара меньшего интервала
+        if self.lastBaseDt is not None and dt_base_open <= self.lastBaseDt:  # Если бар уже учли
+            return  # то выходим, дальше не продолжаем
+        self.lastBaseDt = dt_base_open
+        dt_open = self.get_interval_open_date_time(dt_base_open)  # Дата и время открытия бара, в который входит бар меньшего интервала
+        if self.derivedBar is not None and self.get_bar_open_date_time(self.derivedBar) != dt_open:  # Если пришел бар следующего интервала
+            self.derivedBars.append(self.derivedBar)  # то формируемый бар закрыт
+            self.derivedBar = None
+        if self.derivedBar is None:  # Если бар не формируется
+            self.derivedBar = dict(bar, datetime=dict(year=dt_open.year, month=dt_open.month, day=dt_open.day, hour=dt_open.hour, min=dt_open.minute))  # то начинаем новый бар
+        else:  # Если бар формируется
+            self.derivedBar['high'] = max(self.derivedBar['high'], bar['high'])  # High
+            self.derivedBar['low'] = min(self.derivedBar['low'], bar['low'])  # Low
+            self.derivedBar['close'] = bar['close']  # Close
+            self.derivedBar['volume'] += bar['volume']  # Volume
+        if self.baseData.get_bar_close_date_time(dt_base_open) >= self.get_interval_close_date_time(dt_open):  # Если бар меньшего интервала закрывает бар
+            self.derivedBars.append(self.derivedBar)  # то бар сформирован
+            self.derivedBar = None
+
+    def get_checkpoint_state(self):
+        """Состояние данных для контрольной точки QKCheckpoint. Бары, которые строятся из данных меньшего интервала, но еще не отданы
+
+        :return: Формируемый и сформированные бары, время последнего учтенного бара меньшего интервала. None - бары не строятся
+        """
+        if self.baseData is None:  # Если бары не строятся из данных меньшего интервала
+            return None  # то сохранять нечего
+        return dict(derivedBar=self.derivedBar, derivedBars=list(self.derivedBars), lastBaseDt=self.lastBaseDt)
+
+    def get_derived_bar(self):
+        """Сформированный бар из баров меньшего интервала
+
+        :return: Бар, None - бара пока нет, False - баров больше не будет
+        """
+        if len(self.derivedBars) == 0 and self.derivedBar is not None:  # Если сформированных баров нет, но бар формируется
+            dt_close = self.get_interval_close_date_time(self.get_bar_open_date_time(self.derivedBar))  # Дата и время закрытия формируемого бара
+            time_market_now = datetime.now(self.store.MarketTimeZone).replace(tzinfo=None)  # Текущее время МСК из локального времени
+            if self.baseData.historyDone and dt_close <= time_market_now or \
+                    self.baseData.liveMode and self.baseData.get_bar_close_date_time(dt_close) <= time_market_now:  # Если баров меньшего интервала в баре больше не будет
+                self.derivedBars.append(self.derivedBar)  # то бар сформирован (например, сессия закончилась раньше)
+                self.derivedBar = None
+        if len(self.derivedBars) == 0:  # Если сформированных баров нет
+            if self.baseData.historyDone:  # Если данные меньшего интервала закончились
+                self.put_notification(self.DISCONNECTED)  # Отправляем уведомление об окончании получения баров
+                return False  # Больше сюда заходить не будем
+            return None  # Нового бара нет, будем заходить еще
+        bar = self.derivedBars.popleft()  # Берем первый сформированный бар
+        if not self.p.FourPriceDoji and self.is_four_price_doji(bar):  # Если не пропускаем дожи 4-х цен, но такой бар пришел
+            return None  # то нового бара нет, будем заходить еще
+        if self.liveMode != self.baseData.liveMode:  # Если данные меньшего интервала сменили режим получения баров
+            self.liveMode = self.baseData.liveMode  # то меняем его и здесь
+            self.put_notification(self.LIVE if self.liveMode else self.DELAYED)  # Отправляем уведомление о смене режима
+        return bar
+
+    def start_tick_bars(self):
+        """Переход к построению новых баров из обезличенных сделок"""
+        self.ticks = self.store.subscribe_ticks(self.classCode, self.secCode)  # Сначала подписываемся, чтобы не пропустить сделки
+        last_dt = num2date(self.lines.datetime[-1]) if len(self) > 1 else None  # Дата и время последнего отданного бара. Текущая ячейка еще пустая
+        time_market_now = self.get_quik_date_time_now()  # Текущее биржевое время
+        count = 1  # Если истории нет, то нужен только формируемый бар
+        if last_dt is not None:  # Если история была
+            count = int((time_market_now - last_dt).total_seconds() // 60 // self.interval) + 2  # то получаем бары, закрывшиеся после нее, и формируемый бар
+        json_bars = self.store.market_request('GetCandlesFromDataSource', self.classCode, self.secCode, self.interval, count)['data']  # Получаем последние бары из QUIK
+        self.seedTicks = 0  # Формируемого бара из истории может не быть
+        for bar in json_bars:  # Пробегаемся по всем полученным барам из QUIK
+            dt_open = self.get_bar_open_date_time(bar)  # Дата и время открытия бара
+            if last_dt is not None and dt_open <= last_dt:  # Если бар уже был отдан
+                continue  # то пропускаем его
+            if self.get_bar_close_date_time(dt_open) > time_market_now:  # Если бар еще формируется
+                self.tickBar = dict(bar)  # то продолжаем его строить из сделок
+                self.seedOpen = dt_open  # Сделки этого бара, пришедшие до ответа QUIK, в нем уже есть
+                self.seedTicks = len(self.ticks)  # Поэтому их пропустим, чтобы не учесть объем дважды
+            elif self.is_bar_valid(bar, False):  # Если бар закрыт и соответствует условиям выборки
+                self.jsonBars.append(bar)  # то отдадим его до баров из сделок
+
+    def get_tick_bar(self):
+        """Закрытый бар, построенный из обезличенных сделок
+
+        :return: Бар или None, если бар еще не закрыт
+        """
+        if self.jsonBars:  # Если есть бары, закрывшиеся до начала построения из сделок
+            return self.jsonBars.pop(0)  # то сначала отдаем их
+        dt_open = self.get_bar_open_date_time(self.tickBar) if self.tickBar else None  # Дата и время открытия формируемого бара
+        while self.ticks:  # Пока есть новые сделки
+            tick = self.ticks.popleft()  # Берем первую сделку
+            dt_json = tick['datetime']  # Дата и время сделки
+            dt_tick_open = self.get_interval_open_date_time(datetime(dt_json['year'], dt_json['month'], dt_json['day'], dt_json['hour'], dt_json['min']))  # Дата и время открытия бара сделки
+            if self.seedTicks:  # Если сделка пришла до получения формируемого бара из истории
+                self.seedTicks -= 1
+                if dt_tick_open <= self.seedOpen:  # Если сделка по этому бару или раньше
+                    continue  # то она уже учтена в его объеме
+            if dt_open is not None and dt_tick_open < dt_open:  # Если сделка пришла по уже закрытому бару
+                continue  # то пропускаем ее
+            price, qty = tick['price'], tick['qty']  # Цена и кол-во сделки
+            if dt_open is not None and dt_tick_open == dt_open:  # Если сделка по формируемому бару
+                self.tickBar['high'] = max(self.tickBar['high'], price)  # High
+                self.tickBar['low'] = min(self.tickBar['low'], price)  # Low
+                self.tickBar['close'] = price  # Close
+                self.tickBar['volume'] += qty  # Volume
+                continue
+            bar = self.tickBar  # Сделка следующего бара закрывает формируемый бар
+            self.tickBar = dict(datetime=dict(year=dt_tick_open.year, month=dt_tick_open.month, day=dt_tick_open.day, hour=dt_tick_open.hour, min=dt_tick_open.minute),
+                                open=price, high=price, low=price, close=price, volume=qty)  # Сделка открывает новый бар
+            dt_open = dt_tick_open
+            if bar is not None:  # Если бар формировался
+                return self.set_tick_bar_live(bar)  # то отдаем его сразу по первой сделке следующего бара
+        if self.tickBar is None:  # Если бар не формируется
+            return None  # то закрывать нечего
+        time_market_now = datetime.now(self.store.MarketTimeZone).replace(tzinfo=None)  # Текущее время МСК из локального времени
+        if self.get_interval_close_date_time(dt_open) + timedelta(seconds=self.p.TickCloseDelay) > time_market_now:  # Если время бара еще не вышло
+            return None  # то бар не закрыт
+        bar, self.tickBar = self.tickBar, None  # Бар закрываем по часам
+        return self.set_tick_bar_live(bar)
+
+    def set_tick_bar_live(self, bar):
+        """Переход в режим получения новых баров (LIVE) по первому бару из сделок"""
+        if not self.liveMode:  # Если не находимся в режиме получения новых баров
+            self.put_notification(self.LIVE)  # Отправляем уведомление о получении новых баров
+            self.liveMode = True  # Переходим в режим получения новых баров (LIVE)
+        return bar
+
+    def get_interval_open_date_time(self, dt):
+        """Дата и время открытия бара, в который входит время. Границы считаются от начала дня, как в QUIK"""
+        day = datetime(dt.year, dt.month, dt.day)  # Начало дня
+        if self.interval < 1440:  # Для минутных интервалов
+            return day + timedelta(minutes=(dt.hour * 60 + dt.minute) // self.interval * self.interval)
+        if self.p.timeframe == TimeFrame.Weeks:  # Для недельного интервала
+            return day - timedelta(days=day.weekday())  # Начало недели с понедельника
+        if self.p.timeframe == TimeFrame.Months:  # Для месячного интервала
+            return day.replace(day=1)  # Начало месяца
+        return day  # Для дневного интервала
+
+    def get_interval_close_date_time(self, dt_open):
+        """Дата и время закрытия бара интервала. Месяцы считаются по календарю"""
+        if self.p.timeframe == TimeFrame.Months:  # Для месячного интервала
+            return (dt_open + timedelta(days=32)).replace(day=1)  # Начало следующего месяца
+        return self.get_bar_close_date_time(dt_open)
+
     @staticmethod
     def get_bar_open_date_time(bar):
         """Дата и время открытия бара"""
@@ -156,9 +436,4 @@ class QKData(with_metaclass(MetaQKData, AbstractDataBase)):
         """
         if not self.liveMode:  # Если не находимся в режиме получения новых баров
             return datetime.now(self.store.MarketTimeZone).replace(tzinfo=None)  # То время МСК получаем из локального времени
-        d = self.store.provider.GetInfoParam('TRADEDATE')['data']  # Дата на сервере в виде строки dd.mm.yyyy. Может прийти неверная дата
-        t = self.store.provider.GetInfoParam('SERVERTIME')['data']  # Время на сервере в виде строки hh:mi:ss
-        try:  # Проверяем, можно ли привести полученные строки в дату и время
-            return datetime.strptime(f'{d} {t}', '%d.%m.%Y %H:%M:%S')  # Переводим строки в дату и время и возвращаем ее
-        except ValueError:  # Если нельзя привести полученные строки в дату и время
-            return datetime.now(self.store.MarketTimeZone).replace(tzinfo=None)  # То время МСК получаем из локального времени
+        return self.store.get_quik_date_time_now()  # Время QUIK хранилище запрашивает один раз за итерацию Cerebro для всех данных
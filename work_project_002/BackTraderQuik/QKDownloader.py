@@ -0,0 +1,287 @@
+from concurrent.futures import ProcessPoolExecutor
+from json import loads
+import os
+from queue import Queue
+from threading import Thread, Semaphore
+import time
+
+import numpy as np
+
+from BackTraderQuik.QKBarStore import QKBarStore, get_interval_open, resample_bars
+from BackTraderQuik.QKIntegrity import QKIntegrity
+
+
+class QKDownloader:
+    """Конвейерная загрузка истории многих тикеров из QUIK в хранилища баров QKBarStore
+    Стадии работают одновременно:
+    - Запросы. В QUIK отправляется до in_flight запросов истории без ожидания ответов (QuikPy.process_requests)
+    - Разбор и объединение. Ответы разбираются в массивы, бары фильтруются и объединяются с хранилищем, строятся интервалы из минутных баров. Пул процессов
+    - Запись. Отдельный поток записывает бары в хранилища и выгружает текстовые файлы
+    Каждое хранилище обновляется только своей загрузкой, поэтому загрузки разных тикеров не мешают друг другу
+    """
+    def __init__(self, provider, datapath, in_flight=4, workers=None, pending=None, export_csv=False, refetch_days=None, progress=print):
+        """Инициализация
+
+        :param QuikPy provider: Подключение к QUIK
+        :param str datapath: Путь к хранилищам и текстовым файлам
+        :param int in_flight: Максимальное кол-во запросов в QUIK без ответа
+        :param int workers: Кол-во процессов разбора. None - по кол-ву ядер. 0 - разбор и запись в потоке запросов по очереди (без конвейера)
+        :param int pending: Максимальное кол-во полученных, но не записанных ответов. Если их больше, то новые запросы ждут. None - 2 на процесс разбора
+        :param bool export_csv: Выгружать бары в текстовые файлы. Если хранилище только дополнялось, то в файл дописываются только новые строки
+        :param int refetch_days: Запрашивать бары только с первого пропуска за последние refetch_days дней хранилища (QKIntegrity) или с последнего бара хранилища.
+        None - всю историю
+        :param progress: Функция вывода хода загрузки. None - не выводить
+        """
+        self.provider = provider  # Подключение к QUIK
+        self.datapath = datapath  # Путь к хранилищам
+        self.in_flight = in_flight  # Кол-во запросов без ответа
+        self.workers = workers  # Кол-во процессов разбора
+        self.pending = pending  # Кол-во не записанных ответов
+        self.export_csv = export_csv  # Выгрузка в текстовые файлы
+        self.refetch_days = refetch_days  # Кол-во дней хранилища, пропуски за которые запрашиваются снова
+        self.progress = progress  # Функция вывода хода загрузки
+        self.jobs = []  # Загрузки: тикер, интервал запроса, хранилища
+        self.stats = {}  # Итоги последнего запуска
+
+    def add(self, class_code, sec_codes, time_frame='D', compression=1, skip_first_date=False, skip_last_date=False, four_price_doji=False):
+        """Загрузка интервала по тикерам, как save_candles_to_file в 04_Bars.py
+
+        :param str class_code: Код площадки
+        :param tuple sec_codes: Коды тикеров в виде кортежа
+        :param str time_frame: Временной интервал 'M'-Минуты, 'D'-дни, 'W'-недели, 'MN'-месяцы
+        :param int compression: Кол-во минут для минутного интервала
+        :param bool skip_first_date: Убрать бары на первую полученную дату, если хранилища нет
+        :param bool skip_last_date: Убрать бары на последнюю полученную дату
+        :param bool four_price_doji: Оставить бары с дожи 4-х цен
+        """
+        for sec_code in sec_codes:  # Пробегаемся по всем тикерам
+            self.jobs.append(dict(class_code=class_code, sec_code=sec_code, interval=get_interval(time_frame, compression),
+                                  time_frames=((time_frame, compression, four_price_doji),),
+                                  skip_first_date=skip_first_date, skip_last_date=skip_last_date))
+
+    def add_from_m1(self, class_code, sec_codes, time_frames=(('D', 1, True),), skip_first_date=False, skip_last_date=False):
+        """Загрузка минутных баров по тикерам и построение из них остальных интервалов, как save_candles_from_m1 в 04_Bars.py
+
+        :param str class_code: Код площадки
+        :param tuple sec_codes: Коды тикеров в виде кортежа
+        :param tuple time_frames: Интервалы: (временной интервал 'M'/'D'/'W'/'MN', кол-во минут, оставить дожи 4-х цен)
+        :param bool skip_first_date: Убрать бары на первую полученную дату, если хранилища минутных баров нет
+        :param bool skip_last_date: Убрать бары на последнюю полученную дату во всех интервалах
+        """
+        for sec_code in sec_codes:  # Пробегаемся по всем тикерам
+            self.jobs.append(dict(class_code=class_code, sec_code=sec_code, interval=1,
+                                  time_frames=(('M', 1, True),) + tuple(time_frames),  # Минутные бары сохраняются вместе с дожи 4-х цен
+                                  skip_first_date=skip_first_date, skip_last_date=skip_last_date))
+
+    def run(self):
+        """Загрузка всех добавленных тикеров и интервалов
+
+        :return: Итоги: кол-во загрузок, ошибок, полученных байт и баров, записанных баров, время в секундах
+        """
+        jobs, self.jobs = self.jobs, []  # Загрузки этого запуска
+        self.stats = dict(jobs=len(jobs), done=0, errors=0, bytes=0, received=0, written=0, seconds=0.0)
+        self.start_time = time.perf_counter()  # Время начала загрузки
+        for job in jobs:  # Пробегаемся по всем загрузкам
+            self.import_csv(job)  # До разбора ответов, т.к. он объединяет бары с хранилищем
+        requests = ({'data': f'{job["class_code"]}|{job["sec_code"]}|{job["interval"]}|{self.get_count(job)}', 'id': str(i), 'cmd': 'get_candles_from_data_source', 't': ''}
+                    for i, job in enumerate(jobs))  # Запросы баров, как в QuikPy.GetCandlesFromDataSource
+        if self.workers == 0:  # Если конвейер не нужен
+            def process(request, response):
+                """Ответ разбираем и записываем сразу"""
+                job = jobs[int(request['id'])]
+                self.write(job, self.prepare(job, response))
+
+            self.provider.process_requests(requests, process, 1, False)  # Запрос, разбор и запись идут по очереди
+        else:  # Если загружаем конвейером
+            workers = self.workers or os.cpu_count() or 1  # Кол-во процессов разбора
+            executor = ProcessPoolExecutor(workers)  # Пул процессов разбора
+            slots = Semaphore(self.pending or 2 * workers)  # Места для полученных, но не записанных ответов
+            results = Queue()  # Разобранные ответы в порядке готовности
+            writer = Thread(target=self.write_results, args=(results, slots), name='QKDownloader', daemon=True)  # Поток записи
+            writer.start()
+
+            def submit(request, response):
+                """Ответ отправляем в пул процессов разбора"""
+                job = jobs[int(request['id'])]
+                self.stats['bytes'] += len(response)
+                slots.acquire()  # Если запись не успевает, то ждем и не читаем следующие ответы
+                future = executor.submit(prepare_bars, self.datapath, job, response)
+                future.add_done_callback(lambda f: results.put((job, f)))
+
+            try:
+                self.provider.process_requests(requests, submit, self.in_flight, False)
+            finally:  # Даже если запросы прервались, записываем уже полученные ответы
+                executor.shutdown()  # Ждем разбора всех отправленных в пул ответов
+                results.put(None)  # Больше ответов не будет
+                writer.join()
+        self.stats['seconds'] = time.perf_counter() - self.start_time
+        return self.stats
+
+    # Функции
+
+    def import_csv(self, job):
+        """Перенос текстовых файлов прошлых версий в хранилища загрузки, которых еще нет, как open_store в 04_Bars.py.
+        Иначе выгрузка в текстовый файл заменит его историей QUIK, которая короче"""
+        for time_frame, compression, _ in job['time_frames']:  # Пробегаемся по всем интервалам загрузки
+            store = QKBarStore(QKBarStore.get_path(self.datapath, job['class_code'], job['sec_code'], time_frame, compression))  # Хранилище баров
+            file_name = f'{store.path}.txt'  # Файл прошлых версий
+            if not store.exists() and os.path.isfile(file_name):  # Если хранилища нет, но есть файл прошлых версий
+                store.import_csv(file_name)  # то переносим бары из файла в хранилище
+                if self.progress:  # Если ход загрузки выводим
+                    self.progress(f'Перенос файла {file_name} в хранилище {store.path}: {len(store)} записей')
+
+    def get_count(self, job):
+        """Кол-во последних баров запроса. QUIK отдает только последние бары, поэтому запрашиваем их с первого пропуска за последние refetch_days дней
+        или с последнего бара хранилища до текущего времени с запасом
+
+        :param dict job: Загрузка
+        :return: Кол-во баров. 0 - все бары
+        """
+        if self.refetch_days is None:  # Если запрашиваем всю историю
+            return 0
+        time_frame, compression, _ = job['time_frames'][0]  # Интервал запроса
+        store = QKBarStore(QKBarStore.get_path(self.datapath, job['class_code'], job['sec_code'], time_frame, compression))  # Хранилище интервала запроса
+        if not len(store):  # Если хранилища нет
+            return 0  # то запрашиваем всю историю
+        last = store.read()['datetime'][-1]  # Последний бар хранилища. Мог быть не завершен, поэтому запрашивается снова
+        missing = QKIntegrity(store).get_missing(last - np.timedelta64(self.refetch_days, 'D'))  # Пропуски за последние дни
+        start = min([last] + [first for first, _ in missing])  # Первый бар, с которого запрашиваем
+        seconds = (np.datetime64('now', 's') + np.timedelta64(1, 'D') - start).astype(np.int64)  # Время до текущего с запасом на часовой пояс QUIK
+        bar_seconds = {'D': 86400, 'W': 7 * 86400, 'MN': 28 * 86400}.get(time_frame, compression * 60)  # Наименьшая длительность бара
+        return max(int(seconds // bar_seconds) + 1, 1)
+
+    def prepare(self, job, response):
+        """Разбор и объединение в текущем потоке"""
+        self.stats['bytes'] += len(response)
+        try:
+            return prepare_bars(self.datapath, job, response)
+        except Exception as e:  # Если ответ разобрать не удалось
+            return e
+
+    def write_results(self, results, slots):
+        """Поток записи разобранных ответов"""
+        while True:  # Пока есть ответы
+            item = results.get()
+            if item is None:  # Если ответов больше не будет
+                return
+            job, future = item
+            try:
+                self.write(job, future.exception() or future.result())
+            finally:
+                slots.release()  # Освобождаем место для следующего ответа
+
+    def write(self, job, result):
+        """Запись баров загрузки в хранилища и вывод хода загрузки"""
+        ticker = f'{job["class_code"]}.{job["sec_code"]}'  # Тикер
+        self.stats['done'] += 1
+        if isinstance(result, Exception):  # Если разбор не удался
+            self.stats['errors'] += 1
+            self.report(f'{ticker}: ошибка {result!r}')
+            return
+        received, bars = result
+        self.stats['received'] += received
+        written = []  # Кол-во записанных баров по интервалам
+        for time_frame, compression, columns in bars:  # Пробегаемся по всем интервалам
+            store = QKBarStore(QKBarStore.get_path(self.datapath, job['class_code'], job['sec_code'], time_frame, compression))  # Хранилище баров
+            count = store.upsert(*(columns[name] for name, _ in QKBarStore.columns))  # Перезаписываем только хвост хранилища с первого нового/измененного бара
+            if self.refetch_days is not None:  # Если запрашиваем пропуски, то индекс целостности обновляем сразу после записи
+                QKIntegrity(store).update()
+            if self.export_csv and store.exists():  # Если нужен текстовый файл
+                store.export_csv(f'{store.path}.txt')
+            self.stats['written'] += count
+            written.append(f'{time_frame}{compression} {count}')
+        self.report(f'{ticker}: получено {received}, записано {", ".join(written) if written else "0"}')
+
+    def report(self, txt):
+        """Строка хода загрузки с пропускной способностью"""
+        if not self.progress:  # Если ход загрузки не выводим
+            return
+        seconds = time.perf_counter() - self.start_time  # Время с начала загрузки
+        self.progress(f'[{self.stats["done"]}/{self.stats["jobs"]}] {txt} | {seconds:.2f} с, '
+                      f'{self.stats["done"] / seconds:.1f} загрузок/с, {self.stats["received"] / seconds:.0f} баров/с, {self.stats["bytes"] / seconds / 1048576:.1f} МБ/с')
+
+
+def get_interval(time_frame, compression):
+    """Интервал QUIK в минутах по временному интервалу и кол-ву минут"""
+    if time_frame == 'D':  # Дневной временной интервал
+        return 1440  # В минутах
+    if time_frame == 'W':  # Недельный временной интервал
+        return 10080  # В минутах
+    if time_frame == 'MN':  # Месячный временной интервал
+        return 23200  # В минутах
+    return compression  # Для минутных временнЫх интервалов ставим кол-во минут
+
+
+def parse_candles(response):
+    """Колонки баров из ответа QUIK на запрос get_candles_from_data_source
+
+    :param str response: Строка ответа JSON
+    :return: Колонки баров, как в QKBarStore.read
+    """
+    bars = loads(response)['data']  # Бары из QUIK
+    if not isinstance(bars, list):  # Если QUIK вернул ошибку
+        raise ValueError(f'Нет баров в ответе QUIK: {response[:200]}')
+    n = len(bars)
+    dt = np.array([(b['datetime']['year'], b['datetime']['month'], b['datetime']['day'], b['datetime']['hour'], b['datetime']['min'], b['datetime']['sec'])
+                   for b in bars], dtype=np.int64).reshape(n, 6)  # Год, месяц, день, час, минута, секунда
+    day = ((dt[:, 0] - 1970).astype('M8[Y]').astype('M8[M]') + (dt[:, 1] - 1).astype('m8[M]')).astype('M8[D]') + (dt[:, 2] - 1).astype('m8[D]')
+    columns = dict(datetime=day.astype('M8[s]') + (dt[:, 3] * 3600 + dt[:, 4] * 60 + dt[:, 5]).astype('m8[s]'))
+    for name, dtype in QKBarStore.columns[1:]:  # Пробегаемся по всем колонкам цен и объема
+        columns[name] = np.fromiter((b[name] for b in bars), dtype, n)
+    order = np.argsort(columns['datetime'], kind='stable')  # Бары сортируем по времени
+    return {name: column[order] for name, column in columns.items()}
+
+
+def filter_bars(columns, mask):
+    """Колонки баров по условию"""
+    return {name: column[mask] for name, column in columns.items()}
+
+
+def skip_dates(columns, skip_first_date=False, skip_last_date=False):
+    """Удаление баров на первую и последнюю дату"""
+    day = columns['datetime'].astype('M8[D]')  # Даты баров
+    mask = np.ones(len(day), dtype=bool)
+    if skip_first_date and len(day):  # Если убираем бары на первую дату
+        mask &= day != day[0]
+    if skip_last_date and len(day):  # Если убираем бары на последнюю дату
+        mask &= day != day[-1]
+    return filter_bars(columns, mask)
+
+
+def skip_four_price_doji(columns):
+    """Удаление баров с дожи 4-х цен"""
+    return filter_bars(columns, columns['high'] != columns['low'])
+
+
+def prepare_bars(datapath, job, response):
+    """Разбор ответа и объединение с хранилищем. Выполняется в процессе разбора, хранилища только читаются
+
+    :param str datapath: Путь к хранилищам
+    :param dict job: Загрузка: тикер, интервал запроса, хранилища
+    :param str response: Строка ответа QUIK
+    :return: Кол-во полученных баров, бары для записи по интервалам (временной интервал, кол-во минут, колонки)
+    """
+    columns = parse_candles(response)  # Полученные бары
+    received = len(columns['datetime'])
+    class_code, sec_code = job['class_code'], job['sec_code']
+    (time_frame, compression, four_price_doji), *time_frames = job['time_frames']  # Интервал запроса и интервалы, которые из него строятся
+    store = QKBarStore(QKBarStore.get_path(datapath, class_code, sec_code, time_frame, compression))  # Хранилище интервала запроса
+    columns = skip_dates(columns, job['skip_first_date'] and not store.exists(), job['skip_last_date'])  # Первую дату убираем, только если хранилища нет
+    if not four_price_doji:  # Если удаляем дожи 4-х цен
+        columns = skip_four_price_doji(columns)
+    if not len(columns['datetime']):  # Если новых баров нет
+        return received, []
+    bars = [(time_frame, compression, columns)]
+    for tf, comp, doji in time_frames:  # Пробегаемся по всем интервалам, которые строятся из интервала запроса
+        tf_store = QKBarStore(QKBarStore.get_path(datapath, class_code, sec_code, tf, comp))  # Хранилище интервала
+        start = get_interval_open(columns['datetime'][:1], tf, comp)[0] if tf_store.exists() else None  # Бары интервала пересчитываем с бара,
+        # в который входит первый новый бар. Новое хранилище строим по всем барам
+        old = store.read(start)  # Бары хранилища интервала запроса, какими они будут после записи
+        keep = ~np.isin(old['datetime'], columns['datetime'])  # Остаются бары хранилища, которые не заменяются новыми
+        merged = {name: np.concatenate((np.asarray(old[name])[keep], columns[name])) for name, _ in QKBarStore.columns}
+        order = np.argsort(merged['datetime'], kind='stable')
+        tf_bars = resample_bars(filter_bars(merged, order), tf, comp)  # Строим бары интервала
+        if not doji:  # Если удаляем дожи 4-х цен
+            tf_bars = skip_four_price_doji(tf_bars)
+        bars.append((tf, comp, tf_bars))
+    return received, bars
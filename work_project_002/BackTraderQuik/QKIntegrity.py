@@ -0,0 +1,165 @@
+import os
+from json import dumps, loads
+
+import numpy as np
+
+from BackTraderQuik.QKBarStore import get_interval_open
+
+# Торговые сессии площадок Московской биржи: начало и окончание в минутах от начала дня. Бары открываются внутри сессий
+SESSIONS = {'SPBFUT': ((8 * 60 + 50, 14 * 60), (14 * 60 + 5, 18 * 60 + 50), (19 * 60 + 5, 23 * 60 + 50)),  # Срочный рынок: утренняя и основная сессии
+            # с клирингом в 14:00 - 14:05, вечерняя сессия
+            'TQBR': ((10 * 60, 18 * 60 + 50), (19 * 60 + 5, 23 * 60 + 50))}  # Акции: основная сессия с аукционом закрытия, вечерняя сессия
+
+
+class QKIntegrity:
+    """Индекс целостности хранилища баров QKBarStore: пропуски баров по календарю торговых сессий, покрытие дней, повторы и нарушения порядка времени
+    Индекс хранится в папке хранилища. После дополнения хранилища пересчитывается только с последнего проверенного дня
+    """
+    def __init__(self, store, sessions=None, holidays=(), min_gap=30):
+        """Инициализация
+
+        :param QKBarStore store: Хранилище баров
+        :param tuple sessions: Торговые сессии (начало, окончание) в минутах от начала дня. None - по площадке из папки хранилища (SESSIONS)
+        :param tuple holidays: Выходные дни биржи в будни (numpy.datetime64 или строки ГГГГ-ММ-ДД)
+        :param int min_gap: Минимальная длительность пропуска внутри сессии в минутах. Короткие пропуски - минуты без сделок
+        """
+        self.store = store  # Хранилище баров
+        self.class_code, _, self.time_frame, self.compression = parse_path(store.path)  # Площадка и интервал из папки хранилища
+        self.sessions = SESSIONS.get(self.class_code) if sessions is None else sessions  # Торговые сессии. None - пропуски не ищем
+        self.holidays = np.array(holidays, dtype='M8[D]')  # Выходные дни биржи в будни
+        self.min_gap = min_gap  # Минимальная длительность пропуска
+        self.index_file = os.path.join(store.path, 'integrity.json')  # Файл индекса
+        self.index = None  # Индекс целостности
+
+    def update(self):
+        """Индекс целостности по текущему состоянию хранилища. Если хранилище только дополнялось, то пересчитывается с последнего проверенного дня
+
+        :return: Индекс: кол-во проверенных строк и время последней, пропуски [первый, последний пропущенный бар, кол-во баров],
+        покрытие дней [дата, кол-во баров, кол-во баров по календарю], строки повторов и нарушений порядка времени, кол-во баров вне сессий
+        """
+        params = dict(sessions=self.sessions and [list(session) for session in self.sessions],
+                      holidays=[str(day) for day in self.holidays], min_gap=self.min_gap)  # Параметры, с которыми построен индекс
+        if self.index is None and os.path.isfile(self.index_file):  # Если индекс не загружен, но сохранен
+            with open(self.index_file, encoding='utf-8') as f:
+                self.index = loads(f.read())
+        dt = self.store.read()['datetime']
+        index = self.index
+        if index is not None and index['params'] == params and index['rows'] == len(dt) and (not len(dt) or index['last'] == str(dt[-1])):
+            return index  # Хранилище не менялось
+        if index is None or index['params'] != params or not 0 < index['rows'] <= len(dt) or index['last'] != str(dt[index['rows'] - 1]) or index['disorders']:  # Если
+            # хранилище перезаписывалось не только в конце (например, заполнены пропуски) или время проверенных строк не по порядку, и строку дня двоичным поиском
+            # не найти, то пересчитываем весь индекс
+            index = dict(params=params, rows=0, last=None, gaps=[], coverage=[], duplicates=[], disorders=[], outside=0)
+        day = np.datetime64(index['coverage'][-1][0], 'D') if index['coverage'] else None  # Последний проверенный день. Мог быть не полным
+        row = int(np.searchsorted(dt[:index['rows']], day, 'left')) if day is not None else 0  # Строки пересчитываем с начала этого дня
+        scan = scan_bars(np.array(dt[max(row - 1, 0):]), self.time_frame, self.compression, self.sessions, self.holidays, self.min_gap)  # Одна строка
+        # до дня для проверки порядка и повторов на границе
+        offset = max(row - 1, 0)  # Номер первой проверенной строки
+        day = str(day) if day is not None else ''
+        index = dict(params=params, rows=len(dt), last=str(dt[-1]) if len(dt) else None,
+                     gaps=[gap for gap in index['gaps'] if gap[1][:10] < day] + [gap for gap in scan['gaps'] if gap[1][:10] >= day],  # Пропуск на границе дня
+                     # переходит в новый индекс
+                     coverage=[cover for cover in index['coverage'] if cover[0] < day] + [cover for cover in scan['coverage'] if cover[0] >= day],
+                     duplicates=[i for i in index['duplicates'] if i < row] + [i + offset for i in scan['duplicates'] if i + offset >= row],
+                     disorders=[i for i in index['disorders'] if i < row] + [i + offset for i in scan['disorders'] if i + offset >= row],
+                     outside=index['outside'] - sum(cover[3] for cover in index['coverage'] if cover[0] >= day) + sum(cover[3] for cover in scan['coverage'] if cover[0] >= day))
+        self.index = index
+        os.makedirs(self.store.path, exist_ok=True)
+        tmp_file = f'{self.index_file}.tmp'  # Файл индекса заменяется атомарно, как файл описания хранилища
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(dumps(index))
+        os.replace(tmp_file, self.index_file)
+        return index
+
+    def get_missing(self, start=None):
+        """Пропуски баров для повторной загрузки
+
+        :param numpy.datetime64 start: Пропуски, которые заканчиваются не раньше этого времени. None - все
+        :return: Время первого и последнего пропущенного бара (numpy.datetime64[s])
+        """
+        gaps = self.update()['gaps']
+        start = None if start is None else np.datetime64(start, 's')
+        return [(np.datetime64(first, 's'), np.datetime64(last, 's')) for first, last, _ in gaps
+                if start is None or np.datetime64(last, 's') >= start]
+
+    def is_valid(self):
+        """В хранилище нет повторов и нарушений порядка времени"""
+        index = self.update()
+        return not index['duplicates'] and not index['disorders']
+
+
+def parse_path(path):
+    """Площадка, тикер, временной интервал и кол-во минут по папке хранилища QKBarStore.get_path: <Код площадки>.<Тикер>_<Интервал><Кол-во минут>"""
+    class_code, name = os.path.basename(os.path.normpath(path)).split('.', 1)
+    sec_code, interval = name.rsplit('_', 1)
+    time_frame = interval.rstrip('0123456789')
+    return class_code, sec_code, time_frame, int(interval[len(time_frame):] or 1)
+
+
+def get_expected(first_day, last_day, time_frame='M', compression=1, sessions=None, holidays=()):
+    """Время открытия баров по календарю торговых сессий. Торги идут в будни, кроме выходных дней биржи
+
+    :param numpy.datetime64 first_day: Первый день
+    :param numpy.datetime64 last_day: Последний день
+    :param str time_frame: Временной интервал 'M'-Минуты, 'D'-дни. Для остальных интервалов календарь не строится
+    :param int compression: Кол-во минут для минутного интервала
+    :param tuple sessions: Торговые сессии (начало, окончание) в минутах от начала дня
+    :param tuple holidays: Выходные дни биржи в будни
+    :return: Время открытия баров (numpy.datetime64[s]), номер сессии каждого бара
+    """
+    days = np.arange(np.datetime64(first_day, 'D'), np.datetime64(last_day, 'D') + 1)
+    days = days[np.is_busday(days, holidays=np.array(holidays, dtype='M8[D]'))]  # Торговые дни
+    if time_frame == 'D':  # Дневной интервал
+        return days.astype('M8[s]'), np.arange(len(days))
+    minutes = np.concatenate([np.arange(start, end) for start, end in sessions])  # Минуты сессий от начала дня
+    session = np.concatenate([np.full(end - start, i) for i, (start, end) in enumerate(sessions)])  # Номер сессии минуты
+    opens, first = np.unique(get_interval_open(minutes.astype('m8[m]') + np.datetime64('1970-01-01', 's'), 'M', compression), return_index=True)  # Бары
+    # интервала внутри дня и их сессии
+    opens = (opens - np.datetime64('1970-01-01', 's')).astype('m8[s]')
+    dt = (days.astype('M8[s]')[:, None] + opens[None, :]).ravel()
+    sessions_count = len(sessions)
+    return dt, (np.arange(len(days))[:, None] * sessions_count + session[first][None, :]).ravel()  # Номера сессий растут по дням
+
+
+def scan_bars(dt, time_frame='M', compression=1, sessions=None, holidays=(), min_gap=30):
+    """Проверка времени баров одним проходом по массивам
+
+    :param numpy.ndarray dt: Время открытия баров (numpy.datetime64[s]) в порядке строк хранилища
+    :param int min_gap: Минимальная длительность пропуска внутри сессии в минутах
+    :return: Пропуски [первый, последний пропущенный бар, кол-во баров], покрытие дней [дата, кол-во баров, кол-во баров по календарю, кол-во баров вне сессий],
+    строки повторов и нарушений порядка времени
+    """
+    dt = np.asarray(dt, dtype='M8[s]')
+    steps = dt[1:] - dt[:-1]  # Разница времени соседних строк
+    result = dict(duplicates=(np.flatnonzero(steps == np.timedelta64(0, 's')) + 1).tolist(),  # Строки с тем же временем, что и предыдущая
+                  disorders=(np.flatnonzero(steps < np.timedelta64(0, 's')) + 1).tolist(),  # Строки с временем раньше предыдущей
+                  gaps=[], coverage=[])
+    if not len(dt) or time_frame not in ('M', 'D') or sessions is None and time_frame == 'M':  # Если календаря нет
+        return result
+    bars = dt if not result['duplicates'] and not result['disorders'] else np.unique(dt)  # Время баров без повторов по порядку
+    expected, session = get_expected(bars[0], bars[-1], time_frame, compression, sessions, holidays)  # Бары по календарю
+    expected_mask = (expected >= bars[0]) & (expected <= bars[-1])  # Пропуски ищем только между первым и последним баром
+    expected, session = expected[expected_mask], session[expected_mask]
+    found = bars[np.minimum(np.searchsorted(bars, expected), len(bars) - 1)] == expected  # Бары календаря, которые есть в хранилище. Оба массива
+    # отсортированы, поэтому ищем двоичным поиском
+    inside = expected[np.minimum(np.searchsorted(expected, bars), max(len(expected) - 1, 0))] == bars if len(expected) else np.zeros(len(bars), dtype=bool)  # Бары
+    # хранилища, которые есть в календаре
+    days, expected_count = np.unique(expected.astype('M8[D]'), return_counts=True)  # Бары по календарю за день
+    bar_days = bars.astype('M8[D]')
+    all_days = np.union1d(days, bar_days)  # Дни календаря и дни с барами вне календаря (выходные)
+    day_index = np.searchsorted(all_days, bar_days)  # День каждого бара
+    count = np.bincount(day_index[inside], minlength=len(all_days))  # Бары в календаре за день
+    outside = np.bincount(day_index[~inside], minlength=len(all_days))  # Бары вне календаря за день
+    expected_days = np.zeros(len(all_days), dtype=np.int64)
+    expected_days[np.searchsorted(all_days, days)] = expected_count
+    result['coverage'] = [[str(day), int(c), int(e), int(o)] for day, c, e, o in zip(all_days, count, expected_days, outside)]
+    missing = ~found  # Пропущенные бары календаря
+    if not missing.any():  # Если пропусков нет
+        return result
+    step = 1 if time_frame == 'D' else compression  # Минуты или дни на бар
+    run = np.cumsum(np.append(True, (missing[1:] != missing[:-1]) | (session[1:] != session[:-1])))  # Номера отрезков одинаковых баров внутри сессии
+    starts = np.flatnonzero(np.append(True, run[1:] != run[:-1]))  # Первые бары отрезков
+    ends = np.append(starts[1:], len(run)) - 1  # Последние бары отрезков
+    gaps = missing[starts] & ((ends - starts + 1) * step >= (1 if time_frame == 'D' else min_gap))  # Отрезки пропусков не короче минимального
+    result['gaps'] = [[str(expected[i]), str(expected[j]), int(j - i + 1)] for i, j in zip(starts[gaps], ends[gaps])]
+    return result
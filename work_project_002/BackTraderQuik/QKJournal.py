@@ -0,0 +1,125 @@
+import os
+from threading import Lock
+import time
+from json import dumps, loads
+from json.decoder import JSONDecodeError
+
+from backtrader import Order
+
+
+class QKJournal:
+    """Журнал заявок, сделок и позиций брокера QUIK
+    Записи только добавляются в конец файла (по одной JSON строке). Запись на диск (fsync) выполняется пачками.
+    После сбоя состояние брокера восстанавливается из журнала без полного запроса позиций из QUIK
+    """
+    alive_statuses = (Order.Submitted, Order.Accepted, Order.Partial)  # Статусы активных заявок
+
+    def __init__(self, filename, sync_records=32, sync_interval=1.0):
+        """Инициализация
+
+        :param str filename: Имя файла журнала
+        :param int sync_records: Кол-во записей, после которого журнал сбрасывается на диск
+        :param float sync_interval: Время в секундах, после которого журнал сбрасывается на диск
+        """
+        self.filename = filename  # Имя файла журнала
+        self.sync_records = sync_records  # Кол-во записей между сбросами на диск
+        self.sync_interval = sync_interval  # Время между сбросами на диск
+        self.file = None  # Файл журнала открывается после восстановления состояния
+        self.not_synced = 0  # Кол-во записей, не сброшенных на диск
+        self.last_sync = time.monotonic()  # Время последнего сброса на диск
+        self.lock = Lock()  # В журнал пишут поток Cerebro и поток обработчиков событий QUIK
+
+    def load(self):
+        """Восстановление состояния из журнала
+
+        :return: Состояние брокера или None, если журнала нет
+        - orders - Последние записи активных заявок по номеру транзакции
+        - positions - Размер и цена позиций по названию тикера
+        - trade_nums - Множества номеров обработанных сделок по названию тикера
+        - last_ref - Последний номер транзакции
+        """
+        if not os.path.isfile(self.filename):  # Если журнала нет
+            return None  # то восстанавливать нечего
+        orders, positions, trade_nums, last_ref = {}, {}, {}, 0
+        with open(self.filename, encoding='utf-8') as f:  # Читаем журнал
+            for line in f:  # Пробегаемся по всем записям журнала
+                try:  # Последняя запись может быть записана не полностью при сбое
+                    record = loads(line)  # Разбираем запись
+                except JSONDecodeError:  # Если запись не полная
+                    break  # то дальше записей нет
+                kind = record['kind']  # Тип записи
+                if kind == 'order':  # Заявка
+                    orders[record['ref']] = record  # Запоминаем последнее состояние заявки
+                    last_ref = max(last_ref, record['ref'])  # Последний номер транзакции
+                elif kind == 'trade':  # Сделка
+                    trade_nums.setdefault(record['dataname'], set()).add(record['trade_num'])  # Номер сделки обработан
+                elif kind == 'position':  # Позиция
+                    positions[record['dataname']] = (record['size'], record['price'])  # Последняя позиция по тикеру
+        orders = {ref: order for ref, order in orders.items() if order['status'] in self.alive_statuses}  # Оставляем только активные заявки
+        return dict(orders=orders, positions=positions, trade_nums=trade_nums, last_ref=last_ref)
+
+    def open(self, state=None):
+        """Открытие журнала на запись. Журнал переписывается из состояния, чтобы он не рос бесконечно
+
+        :param dict state: Состояние брокера после восстановления и сверки с QUIK
+        """
+        tmp_filename = f'{self.filename}.tmp'  # Сначала пишем во временный файл
+        with open(tmp_filename, 'w', encoding='utf-8') as f:  # Открываем временный файл
+            if state:  # Если есть состояние
+                if state['last_ref']:  # Последний номер транзакции. Он может быть больше номеров активных заявок. Пишем первым, чтобы активная заявка с этим номером его перекрыла
+                    f.write(dumps(dict(kind='order', ref=state['last_ref'], status=Order.Completed)) + '\n')
+                for order in state['orders'].values():  # Активные заявки
+                    f.write(dumps(order) + '\n')
+                for dataname, nums in state['trade_nums'].items():  # Обработанные сделки
+                    for trade_num in nums:
+                        f.write(dumps(dict(kind='trade', dataname=dataname, trade_num=trade_num)) + '\n')
+                for dataname, (size, price) in state['positions'].items():  # Позиции
+                    f.write(dumps(dict(kind='position', dataname=dataname, size=size, price=price)) + '\n')
+            f.flush()
+            os.fsync(f.fileno())  # Сбрасываем на диск
+        os.replace(tmp_filename, self.filename)  # Заменяем журнал атомарно
+        self.file = open(self.filename, 'a', encoding='utf-8')  # Дальше только добавляем записи
+
+    def write(self, kind, **record):
+        """Добавление записи в журнал
+
+        :param str kind: Тип записи: order, trade, position
+        """
+        line = dumps(dict(kind=kind, **record)) + '\n'  # Запись журнала
+        with self.lock:  # Записи разных потоков не должны перемешиваться
+            if not self.file:  # Если журнал не открыт
+                return  # то записывать некуда
+            self.file.write(line)  # Добавляем запись в конец журнала
+            self.file.flush()  # Отдаем запись операционной системе
+            self.not_synced += 1  # Еще одна запись не сброшена на диск
+            if self.not_synced >= self.sync_records or time.monotonic() - self.last_sync >= self.sync_interval:  # Если записей накопилось много или прошло время
+                self.sync_file()  # то сбрасываем журнал на диск
+
+    def write_order(self, order, trans_id):
+        """Запись состояния заявки
+
+        :param Order order: Заявка
+        :param int trans_id: Номер транзакции заявки в QUIK
+        """
+        self.write('order', ref=trans_id, dataname=order.data._name, size=order.size, price=order.price,
+                   exectype=order.exectype, status=order.status, order_num=order.info.get('order_num'))
+
+    def sync(self):
+        """Сброс журнала на диск"""
+        with self.lock:
+            self.sync_file()
+
+    def sync_file(self):
+        """Сброс журнала на диск. Вызывается под блокировкой"""
+        if self.file and self.not_synced:  # Если есть что сбрасывать
+            os.fsync(self.file.fileno())  # Сбрасываем на диск
+        self.not_synced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        """Закрытие журнала"""
+        with self.lock:
+            if self.file:  # Если журнал открыт
+                self.sync_file()  # Сбрасываем оставшиеся записи на диск
+                self.file.close()
+                self.file = None
@@ -0,0 +1,116 @@
+import atexit
+import collections
+import logging
+from logging.handlers import RotatingFileHandler
+import sys
+import threading
+import time
+
+
+class QKLogHandler(logging.Handler):
+    """Асинхронный обработчик логов
+    Запись только кладется в кольцевую очередь без блокировок и форматирования. Форматирует и пишет записи фоновый поток
+    Если очередь заполнена, то запись отбрасывается, а не ждет. Кол-во отброшенных записей выводится в лог
+    Аргументы форматируются при записи, поэтому в лог нужно передавать значения, а не изменяемые объекты
+    """
+    def __init__(self, handlers, capacity=10000, interval=0.05):
+        """Инициализация
+
+        :param list handlers: Обработчики, которые пишут записи (консоль, файлы)
+        :param int capacity: Размер очереди записей
+        :param float interval: Период проверки очереди фоновым потоком в секундах
+        """
+        super(QKLogHandler, self).__init__()
+        self.handlers = handlers  # Обработчики записей
+        self.capacity = capacity  # Размер очереди записей
+        self.interval = interval  # Период проверки очереди
+        self.ring = collections.deque()  # Очередь записей. Добавление и извлечение атомарны
+        self.dropped = 0  # Кол-во отброшенных записей
+        self.reported = 0  # Кол-во отброшенных записей, о которых уже сообщили
+        self.stopping = False  # Фоновый поток нужно остановить
+        self.thread = threading.Thread(target=self.run, name='QKLogHandler', daemon=True)  # Фоновый поток записи
+        self.thread.start()
+
+    def handle(self, record):
+        """Постановка записи в очередь без блокировки обработчика"""
+        if not self.filter(record):  # Если запись не проходит фильтры
+            return False  # то ее не пишем
+        if len(self.ring) >= self.capacity:  # Если очередь заполнена
+            self.dropped += 1  # то запись отбрасываем
+            return False
+        self.ring.append(record)  # Ставим запись в очередь
+        return True
+
+    def emit(self, record):
+        self.handle(record)
+
+    def run(self):
+        """Фоновый поток записи"""
+        while True:
+            stopping = self.stopping  # Запоминаем до разбора очереди, чтобы записать все, что пришло до остановки
+            while self.ring:  # Пока в очереди есть записи
+                self.write(self.ring.popleft())  # Пишем первую запись
+            dropped = self.dropped  # Кол-во отброшенных записей
+            if dropped != self.reported:  # Если появились новые отброшенные записи
+                self.write(logging.makeLogRecord(dict(name=__name__, levelno=logging.WARNING, levelname='WARNING',
+                                                      msg='Очередь логов заполнена. Отброшено записей: %d, всего: %d', args=(dropped - self.reported, dropped))))
+                self.reported = dropped
+            if stopping:  # Если поток нужно остановить
+                break  # то выходим
+            time.sleep(self.interval)  # Ждем новых записей
+        for handler in self.handlers:  # Пробегаемся по всем обработчикам
+            handler.flush()  # Сбрасываем записи
+
+    def write(self, record):
+        """Форматирование и запись во все обработчики"""
+        for handler in self.handlers:  # Пробегаемся по всем обработчикам
+            if record.levelno >= handler.level:  # Если запись проходит по уровню
+                handler.handle(record)  # то форматируем и пишем ее
+
+    def close(self):
+        """Остановка фонового потока с записью оставшихся записей"""
+        if not self.stopping:  # Если поток еще не останавливали
+            self.stopping = True
+            self.thread.join()  # Ждем, пока будут записаны все записи
+            for handler in self.handlers:  # Пробегаемся по всем обработчикам
+                handler.close()
+        super(QKLogHandler, self).close()
+
+
+def start_logging(name='', level=logging.INFO, console=True, filename=None, max_bytes=10 * 1024 * 1024, backup_count=5, capacity=10000):
+    """Настройка асинхронного логирования. Повторный вызов заменяет настройку
+
+    :param str name: Имя логгера. По умолчанию корневой логгер для BackTraderQuik и торговых систем
+    :param int level: Уровень записей
+    :param bool console: Писать записи на консоль
+    :param str filename: Файл лога. Файлы меняются по размеру
+    :param int max_bytes: Размер файла лога в байтах, после которого начинается новый файл
+    :param int backup_count: Кол-во хранимых старых файлов лога
+    :param int capacity: Размер очереди записей
+    :return: Асинхронный обработчик логов
+    """
+    logger = logging.getLogger(name)  # Логгер
+    for handler in list(logger.handlers):  # Пробегаемся по всем обработчикам логгера
+        if isinstance(handler, QKLogHandler):  # Если это асинхронный обработчик прошлой настройки
+            logger.removeHandler(handler)  # то убираем его
+            handler.close()  # и останавливаем
+    handlers = []  # Обработчики, которые пишут записи
+    if console:  # Если пишем на консоль
+        console_handler = logging.StreamHandler(sys.stdout)  # то пишем так же, как print
+        console_handler.setFormatter(logging.Formatter('%(message)s'))
+        handlers.append(console_handler)
+    if filename:  # Если пишем в файл
+        file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')  # Файлы меняются по размеру
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        handlers.append(file_handler)
+    handler = QKLogHandler(handlers, capacity)  # Асинхронный обработчик
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    atexit.register(handler.close)  # При выходе записываем оставшиеся записи
+    return handler
+
+
+def start_default_logging():
+    """Вывод логов BackTraderQuik на консоль, если логирование не было настроено"""
+    if not logging.getLogger().handlers and not logging.getLogger('BackTraderQuik').handlers:  # Если обработчиков нет
+        start_logging('BackTraderQuik')  # то пишем на консоль, как раньше писали print
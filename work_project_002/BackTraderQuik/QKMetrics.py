@@ -0,0 +1,176 @@
+import bisect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sys
+from threading import Lock, Thread
+
+
+class QKMetrics:
+    """Реестр метрик работы торговой системы в текстовом формате Prometheus
+    Счетчики (counter), значения (gauge) и гистограммы (histogram) с метками. Значения могут вычисляться при запросе метрик
+    Метрики отдаются по HTTP из фонового потока: http://127.0.0.1:<порт>/metrics
+    """
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Границы корзин гистограмм в секундах
+
+    def __init__(self):
+        self.lock = Lock()  # Метрики меняются из основного потока и потока функций обратного вызова QUIK
+        self.types = {}  # Тип метрики по имени
+        self.helps = {}  # Описание метрики по имени
+        self.values = {}  # Значения по имени метрики и меткам: число или [кол-ва по корзинам, сумма, кол-во] для гистограмм
+        self.functions = {}  # Функции, вычисляющие значение при запросе метрик, по имени метрики и меткам
+        self.server = None  # HTTP сервер метрик
+
+    def describe(self, name, metric_type, help_text):
+        """Описание метрики
+
+        :param str name: Имя метрики
+        :param str metric_type: Тип метрики: 'counter', 'gauge', 'histogram'
+        :param str help_text: Описание метрики
+        """
+        self.types[name] = metric_type
+        self.helps[name] = help_text
+
+    def inc(self, name, value=1, **labels):
+        """Увеличение счетчика"""
+        key = (name, tuple(sorted(labels.items())))  # Ключ значения
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Установка значения"""
+        key = (name, tuple(sorted(labels.items())))  # Ключ значения
+        with self.lock:  # render копирует значения под блокировкой
+            self.values[key] = value
+
+    def set_function(self, name, function, **labels):
+        """Значение, которое вычисляется функцией при запросе метрик. None - значение не выводится"""
+        key = (name, tuple(sorted(labels.items())))  # Ключ функции
+        with self.lock:
+            self.functions[key] = function
+
+    def remove(self, name, **labels):
+        """Удаление значения или функции метрики"""
+        key = (name, tuple(sorted(labels.items())))  # Ключ значения
+        with self.lock:
+            self.values.pop(key, None)
+            self.functions.pop(key, None)
+
+    def observe(self, name, value, **labels):
+        """Добавление значения в гистограмму"""
+        key = (name, tuple(sorted(labels.items())))  # Ключ значения
+        with self.lock:
+            histogram = self.values.get(key)  # Гистограмма
+            if histogram is None:  # Если значений еще не было
+                histogram = self.values[key] = [[0] * len(self.buckets), 0.0, 0]  # Кол-ва по корзинам, сумма, кол-во
+            i = bisect.bisect_left(self.buckets, value)  # Первая корзина, в которую попадает значение
+            if i < len(self.buckets):  # Если значение не больше последней границы
+                histogram[0][i] += 1  # Накопленные кол-ва считаем при выводе
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        with self.lock:  # Копируем значения и функции, чтобы не держать блокировку при форматировании и вычислении функций
+            values = [(key, [list(value[0]), value[1], value[2]] if isinstance(value, list) else value) for key, value in self.values.items()]
+            functions = list(self.functions.items())
+        for key, function in functions:  # Пробегаемся по всем функциям
+            try:
+                value = function()  # Вычисляем значение
+            except Exception:  # Если значение вычислить не удалось (например, данные уже остановлены)
+                continue  # то его не выводим
+            if value is not None:  # Если значение есть
+                values.append((key, value))
+        lines = []  # Строки вывода
+        last_name = None  # Имя последней выведенной метрики
+        for (name, labels), value in sorted(values, key=lambda item: item[0]):  # Пробегаемся по всем значениям, сгруппированным по имени метрики
+            if name != last_name:  # Если началась новая метрика
+                if name in self.helps:  # Если у метрики есть описание
+                    lines.append(f'# HELP {name} {self.helps[name]}')
+                lines.append(f'# TYPE {name} {self.types.get(name, "untyped")}')
+                last_name = name
+            if isinstance(value, list):  # Для гистограмм
+                cumulative = 0  # Накопленное кол-во значений
+                for le, count in zip(self.buckets, value[0]):  # Пробегаемся по всем корзинам
+                    cumulative += count
+                    lines.append(f'{name}_bucket{self.format_labels(labels + (("le", le),))} {cumulative}')
+                lines.append(f'{name}_bucket{self.format_labels(labels + (("le", "+Inf"),))} {value[2]}')
+                lines.append(f'{name}_sum{self.format_labels(labels)} {value[1]}')
+                lines.append(f'{name}_count{self.format_labels(labels)} {value[2]}')
+            else:  # Для счетчиков и значений
+                lines.append(f'{name}{self.format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def start_server(self, port=8000, host='127.0.0.1'):
+        """Запуск HTTP сервера метрик в фоновом потоке. Повторный вызов ничего не делает"""
+        if self.server:  # Если сервер уже запущен
+            return self.server  # то второй не запускаем
+        metrics = self  # Реестр для обработчика запросов
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):  # Если запрошены не метрики
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # Запросы метрик не пишем в лог
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        Thread(target=self.server.serve_forever, name='QKMetricsServer', daemon=True).start()
+        return self.server
+
+    def stop_server(self):
+        """Остановка HTTP сервера метрик"""
+        if self.server:  # Если сервер запущен
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    # Функции
+
+    @staticmethod
+    def format_labels(labels):
+        """Метки в формате Prometheus"""
+        if not labels:  # Если меток нет
+            return ''
+        return '{' + ','.join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels) + '}'
+
+
+def get_memory_rss():
+    """Занимаемая процессом память в байтах или None, если узнать ее нельзя"""
+    try:
+        import psutil  # Если установлена библиотека psutil
+        return psutil.Process().memory_info().rss  # то берем память из нее (работает и в Windows)
+    except ImportError:
+        pass
+    if os.path.isfile('/proc/self/statm'):  # В Linux
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')  # Кол-во страниц в памяти * размер страницы
+    try:
+        import resource  # В остальных Unix
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)  # Пиковая память
+    except ImportError:
+        return None
+
+
+metrics = QKMetrics()  # Общий реестр метрик QuikPy, хранилища, данных и брокера
+metrics.describe('quik_request_seconds', 'histogram', 'Время запроса к QUIK')
+metrics.describe('quik_callbacks_total', 'counter', 'Кол-во функций обратного вызова QUIK')
+metrics.describe('quik_callback_lag_seconds', 'histogram', 'Задержка функции обратного вызова от QUIK до Python')
+metrics.describe('quik_callback_age_seconds', 'gauge', 'Время с последней функции обратного вызова QUIK')
+metrics.describe('quik_ping_seconds', 'histogram', 'Время ответа QUIK на Ping')
+metrics.describe('quik_ping_last_seconds', 'gauge', 'Время ответа QUIK на последний Ping')
+metrics.describe('qk_loop_seconds', 'histogram', 'Время итерации Cerebro')
+metrics.describe('qk_bars_total', 'counter', 'Кол-во баров, полученных торговой системой')
+metrics.describe('qk_last_bar_age_seconds', 'gauge', 'Время с получения последнего бара')
+metrics.describe('qk_new_bars_queue', 'gauge', 'Кол-во новых баров QUIK, не разобранных данными')
+metrics.describe('qk_active_orders', 'gauge', 'Кол-во активных заявок на бирже')
+metrics.describe('qk_broker_notifications_queue', 'gauge', 'Кол-во уведомлений брокера, не полученных торговой системой')
+metrics.describe('process_resident_memory_bytes', 'gauge', 'Занимаемая процессом память')
+metrics.set_function('process_resident_memory_bytes', get_memory_rss)
@@ -0,0 +1,162 @@
+import collections
+
+from backtrader import BrokerBase
+
+from BackTraderQuik import QKStore
+from BackTraderQuik.QKBroker import QKBroker
+
+
+class QKMultiBroker(BrokerBase):
+    """Брокер QUIK для нескольких счетов (фондовый, срочный, разные фирмы)
+    Заявки направляются на счет по тикеру или по явно указанному в заявке счету: buy(account='Имя счета')
+    Заявки всех счетов отправляются по очереди из потока Cerebro. Счета одного терминала к тому же делят один сокет запросов QuikPy под блокировкой
+    """
+    # Обсуждение решения: https://community.backtrader.com/topic/1165/does-backtrader-support-multiple-brokers
+
+    params = (
+        ('Accounts', {}),  # Счета. Словарь: Имя счета -> Словарь параметров брокера QKBroker (ClientCode, FirmId, TradeAccountId, LimitKind, CurrencyCode, IsFutures, ...). Счет на другом терминале задается параметрами Host, RequestsPort, CallbacksPort
+        ('Routes', {}),  # Привязка тикеров к счетам. Словарь: Название тикера -> Имя счета
+        ('DefaultAccount', None),  # Имя счета по умолчанию. Если не задано, то первый счет из списка
+    )
+
+    def __init__(self, **kwargs):
+        super(QKMultiBroker, self).__init__()
+        self.store = QKStore(**{name: kwargs[name] for name in QKStore.connection_params if name in kwargs})  # Хранилище QUIK. Общее для всех счетов. Остальные общие параметры - для брокеров счетов
+        self.notifs = collections.deque()  # Очередь уведомлений брокера о заявках по всем счетам
+        self.brokers = collections.OrderedDict()  # Брокеры по счетам
+        for name, account_params in self.p.Accounts.items():  # Пробегаемся по всем счетам
+            self.brokers[name] = QKBroker(**dict(kwargs, **account_params))  # Создаем брокера счета. Параметры счета важнее общих параметров
+        if not self.brokers:  # Если не задан ни один счет
+            raise ValueError('Не задан ни один счет в параметре Accounts')
+        self.default_account = self.p.DefaultAccount or next(iter(self.brokers))  # Имя счета по умолчанию
+        self.accounts = {}  # Кэш счетов по названию тикера
+
+    def start(self):
+        super(QKMultiBroker, self).start()
+        for broker in self.brokers.values():  # Пробегаемся по всем брокерам счетов
+            broker.start()  # Каждый брокер подтягивает свои позиции, свободные средства и баланс
+        ref_offset = max(broker.ref_offset for broker in self.brokers.values())  # Номера транзакций счетов продолжают самый длинный журнал
+        for broker in self.brokers.values():  # Номера заявок BackTrader общие, поэтому при одном смещении номера транзакций счетов не совпадают
+            broker.ref_offset = ref_offset
+        for store in {id(broker.store): broker.store for broker in self.brokers.values()}.values():  # Пробегаемся по хранилищам всех терминалов счетов
+            store.provider.OnTransReply = self.on_trans_reply  # Брокеры счетов одного терминала перезаписывают обработчики друг друга. Поэтому события разбираем сами
+            store.provider.OnTrade = self.on_trade  # и передаем брокеру нужного счета
+            store.provider.OnStopOrder = self.on_stop_order
+        self.startingcash = self.getcash()  # Стартовые свободные средства по всем счетам
+        self.startingvalue = self.getvalue()  # Стартовый баланс по всем счетам
+
+    def getcash(self):
+        """Свободные средства по всем счетам"""
+        return sum(broker.getcash() for broker in self.brokers.values())
+
+    def getvalue(self, datas=None):
+        """Стоимость позиций по всем счетам"""
+        return sum(broker.getvalue(datas) for broker in self.brokers.values())
+
+    def getposition(self, data):
+        """Позиция по тикеру на счете тикера"""
+        return self.get_account_broker(data).getposition(data)
+
+    def getcommissioninfo(self, data):
+        """Комиссия по тикеру на счете тикера"""
+        return self.get_account_broker(data).getcommissioninfo(data)
+
+    def buy(self, owner, data, size, price=None, plimit=None, exectype=None, valid=None, tradeid=0, oco=None, trailamount=None, trailpercent=None, parent=None, transmit=True, account=None, **kwargs):
+        """Заявка на покупку на счет тикера или на заданный счет"""
+        name = self.get_account_name(data, account, parent)  # Имя счета заявки
+        return self.brokers[name].buy(owner, data, size, price, plimit, exectype, valid, tradeid, oco, trailamount, trailpercent, parent, transmit, Account=name, **kwargs)
+
+    def sell(self, owner, data, size, price=None, plimit=None, exectype=None, valid=None, tradeid=0, oco=None, trailamount=None, trailpercent=None, parent=None, transmit=True, account=None, **kwargs):
+        """Заявка на продажу на счет тикера или на заданный счет"""
+        name = self.get_account_name(data, account, parent)  # Имя счета заявки
+        return self.brokers[name].sell(owner, data, size, price, plimit, exectype, valid, tradeid, oco, trailamount, trailpercent, parent, transmit, Account=name, **kwargs)
+
+    def cancel(self, order):
+        """Отмена заявки на счете, куда она была отправлена"""
+        name = order.info.get('Account', self.default_account)  # Имя счета заявки
+        return self.brokers[name].cancel(order)
+
+    def get_notification(self):
+        if not self.notifs:  # Если в списке уведомлений ничего нет
+            return None  # то ничего и возвращаем, выходим, дальше не продолжаем
+        return self.notifs.popleft()  # Удаляем и возвращаем крайний левый элемент списка уведомлений
+
+    def next(self):
+        for broker in self.brokers.values():  # Пробегаемся по всем брокерам счетов
+            while broker.notifs:  # Пока у брокера есть уведомления
+                notif = broker.notifs.popleft()  # Забираем уведомление брокера счета
+                if notif is not None:  # Пустые элементы брокеров счетов не переносим
+                    self.notifs.append(notif)  # Переносим уведомление в общую очередь
+        self.notifs.append(None)  # Добавляем в список уведомлений пустой элемент
+
+    def stop(self):
+        super(QKMultiBroker, self).stop()
+        for broker in self.brokers.values():  # Пробегаемся по всем брокерам счетов
+            broker.stop()  # Останавливаем брокера счета
+
+    # Функции
+
+    def get_account_name(self, data, account=None, parent=None):
+        """Имя счета для заявки
+
+        :param data: Данные тикера
+        :param str account: Явно заданное имя счета
+        :param parent: Родительская заявка. Дочерние заявки отправляются на счет родительской
+        :return: Имя счета
+        """
+        if account:  # Если счет задан явно
+            if account not in self.brokers:  # Если такого счета нет
+                raise KeyError(f'Счет {account} не найден')
+            return account  # то берем его
+        if parent is not None and 'Account' in parent.info:  # Если есть родительская заявка
+            return parent.info['Account']  # то берем ее счет
+        dataname = data._name  # Название тикера
+        if dataname not in self.accounts:  # Если счет тикера еще не определяли
+            self.accounts[dataname] = self.find_account_name(dataname)  # то определяем его и запоминаем
+        return self.accounts[dataname]
+
+    def find_account_name(self, dataname):
+        """Имя счета по названию тикера
+
+        :param str dataname: Название тикера
+        :return: Имя счета из привязки тикеров, счет по рынку тикера или счет по умолчанию
+        """
+        if dataname in self.p.Routes:  # Если тикер привязан к счету
+            return self.p.Routes[dataname]  # то берем этот счет
+        class_code, sec_code = self.store.data_name_to_class_sec_code(dataname)  # По названию тикера получаем код площадки и код тикера
+        if f'{class_code}.{sec_code}' in self.p.Routes:  # Если тикер привязан к счету с кодом площадки
+            return self.p.Routes[f'{class_code}.{sec_code}']  # то берем этот счет
+        is_futures = class_code == 'SPBFUT'  # Тикер срочного рынка
+        for name, broker in self.brokers.items():  # Пробегаемся по всем брокерам счетов
+            if broker.p.IsFutures == is_futures:  # Первый счет того же рынка, что и тикер
+                return name  # берем его
+        return self.default_account  # Если счет не нашли, то берем счет по умолчанию
+
+    def get_account_broker(self, data):
+        """Брокер счета тикера"""
+        return self.brokers[self.get_account_name(data)]
+
+    def on_trans_reply(self, data):
+        """Обработчик события ответа на транзакцию пользователя. Передаем брокеру счета, отправившему заявку"""
+        trans_id = int(data['data']['trans_id'])  # Номер транзакции заявки
+        for broker in self.brokers.values():  # Пробегаемся по всем брокерам счетов
+            if broker.get_ref(trans_id) in broker.orders or trans_id in broker.journal_orders:  # Если заявку отправлял этот брокер, в т.ч. до перезапуска
+                broker.on_trans_reply(data)  # то передаем ему событие
+                return  # Дальше не продолжаем
+
+    def on_stop_order(self, data):
+        """Обработчик события получения новой / изменения существующей стоп заявки. Передаем брокеру счета, отправившему заявку"""
+        trans_id = int(data['data'].get('trans_id') or 0)  # Номер транзакции стоп заявки
+        for broker in self.brokers.values():  # Пробегаемся по всем брокерам счетов
+            if trans_id and broker.get_ref(trans_id) in broker.brackets:  # Если стоп заявку отправлял этот брокер
+                broker.on_stop_order(data)  # то передаем ему событие
+                return  # Дальше не продолжаем
+
+    def on_trade(self, data):
+        """Обработчик события получения новой / изменения существующей сделки. Передаем брокеру счета сделки"""
+        account = data['data'].get('account', '')  # Торговый счет сделки
+        for broker in self.brokers.values():  # Пробегаемся по всем брокерам счетов
+            if broker.p.TradeAccountId == account:  # Если сделка по счету этого брокера
+                broker.on_trade(data)  # то передаем ему событие
+                return  # Дальше не продолжаем
+        self.brokers[self.default_account].on_trade(data)  # Если счет сделки не нашли, то передаем событие брокеру счета по умолчанию
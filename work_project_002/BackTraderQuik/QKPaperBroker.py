@@ -0,0 +1,177 @@
+import time
+
+from backtrader import Order
+from backtrader.brokers.bbroker import BackBroker
+
+from BackTraderQuik import QKStore
+
+
+class QKPaperBroker(BackBroker):
+    """Бумажный брокер QUIK. Заявки на биржу не отправляются, а исполняются локально по текущим котировкам из QUIK
+    Пока данные тикера не перешли в режим реального времени (LIVE), заявки исполняются по барам, как в BackBroker
+    Модель заявок, схемы комиссий и проскальзывания берутся из брокера BackTrader (BackBroker)
+    Время отправки, принятия и исполнения заявок пишется в те же поля заявки, что и у QKBroker (SubmitTime, AcceptTime, FillTime)
+    """
+    params = (
+        ('Quotes', 'BidAsk'),  # Котировки для исполнения: 'Last' - цена последней сделки, 'BidAsk' - лучшие цены спроса/предложения, 'Level2' - стакан
+        ('Latency', 0.0),  # Задержка исполнения заявки в секундах. Для сравнения с реальными задержками QKBroker
+    )
+
+    def __init__(self, **kwargs):
+        super(QKPaperBroker, self).__init__()
+        self.store = QKStore(**kwargs)  # Хранилище QUIK
+        self.quotes = {}  # Котировки по коду площадки и коду тикера: LAST, BID, OFFER
+        self.order_books = {}  # Стаканы по коду площадки и коду тикера
+        self.changed = set()  # Тикеры, по которым изменились параметры текущих торгов
+        self.subscribed = set()  # Тикеры, по которым заказаны котировки
+        self.depth = {}  # Кол-во, которое можно исполнить по стакану, по номеру заявки
+        self.spent = set()  # Тикеры, стакан которых забран частичным исполнением. Остаток заявки ждет следующего стакана
+
+    def start(self):
+        super(QKPaperBroker, self).start()
+        if self.p.Quotes == 'Level2' and self.p.filler is None:  # Если исполняем по стакану, и свое исполнение по объему не задано
+            self.p.filler = self.fill_order_book  # то исполняем только кол-во из стакана
+        self.store.provider.OnParam = self.on_param  # Изменение текущих параметров
+        self.store.provider.OnQuote = self.on_quote  # Изменение стакана котировок
+
+    def stop(self):
+        super(QKPaperBroker, self).stop()
+        for class_code, sec_code in self.subscribed:  # Пробегаемся по всем тикерам с заказанными котировками
+            if self.p.Quotes == 'Level2':  # Для стакана
+                self.store.unsubscribe('level2', class_code, sec_code)  # отменяем подписку на стакан
+            else:  # Для параметров текущих торгов
+                for param_name in ('LAST', 'BID', 'OFFER'):  # отменяем заказ всех параметров
+                    self.store.unsubscribe('param', class_code, sec_code, param_name)
+        self.store.provider.OnParam = self.store.provider.DefaultHandler  # Изменение текущих параметров
+        self.store.provider.OnQuote = self.store.provider.DefaultHandler  # Изменение стакана котировок
+
+    def submit(self, order, check=True):
+        """Отправка заявки. Запоминаем время отправки"""
+        order.addinfo(SubmitTime=time.time())  # Время отправки заявки
+        return super(QKPaperBroker, self).submit(order, check)
+
+    def submit_accept(self, order):
+        """Принятие заявки. Запоминаем время принятия"""
+        order.addinfo(AcceptTime=time.time())  # Время принятия заявки
+        super(QKPaperBroker, self).submit_accept(order)
+
+    def _execute(self, order, ago=None, price=None, cash=None, position=None, dtcoc=None):
+        """Исполнение заявки. Запоминаем время исполнения"""
+        if ago is not None and price is not None:  # Если исполнение настоящее, а не для проверки средств
+            order.addinfo(FillTime=time.time())  # Время исполнения заявки
+        return super(QKPaperBroker, self)._execute(order, ago, price, cash, position, dtcoc)
+
+    def _try_exec(self, order):
+        """Попытка исполнить заявку по текущим котировкам QUIK вместо цен бара"""
+        if order.data._laststatus != order.data.LIVE:  # Пока данные тикера не в режиме реального времени (история)
+            return super(QKPaperBroker, self)._try_exec(order)  # исполняем заявку по бару
+        self.subscribe(order.data)  # Заказываем котировки по тикеру заявки
+        if time.time() - order.info['SubmitTime'] < self.p.Latency:  # Если заявка еще "не дошла" до биржи
+            return  # то не исполняем ее
+        price = self.get_quote_price(order)  # Цена исполнения по котировкам
+        if price is None:  # Если котировок нет
+            return  # то не исполняем заявку
+        pcreated = order.created.price  # Цена заявки
+        plimit = order.created.pricelimit  # Лимитная цена заявки
+        # Котировку передаем как бар из одной цены (тик)
+        if order.exectype in (Order.Market, Order.Close):  # Рыночная заявка или заявка по цене закрытия
+            if order.isbuy():  # Проскальзывание как у рыночной заявки BackBroker. Котировка - и цена, и граница бара
+                price = self._slip_up(price, price, doslip=self.p.slip_open)
+            else:
+                price = self._slip_down(price, price, doslip=self.p.slip_open)
+            if price is not None:  # Если цена с проскальзыванием есть в баре (или slip_out=True)
+                self._execute(order, ago=0, price=price)  # Исполняем сразу по котировке
+        elif order.exectype == Order.Limit:  # Лимитная заявка
+            self._try_exec_limit(order, price, price, price, pcreated)
+        elif order.triggered and order.exectype in (Order.StopLimit, Order.StopTrailLimit):  # Сработавшая стоп лимитная заявка
+            self._try_exec_limit(order, price, price, price, plimit)
+        elif order.exectype in (Order.Stop, Order.StopTrail):  # Стоп заявка
+            self._try_exec_stop(order, price, price, price, pcreated, price)
+        elif order.exectype in (Order.StopLimit, Order.StopTrailLimit):  # Стоп лимитная заявка
+            self._try_exec_stoplimit(order, price, price, price, price, pcreated, plimit)
+
+    # Функции
+
+    def subscribe(self, data):
+        """Заказ котировок по тикеру"""
+        class_code, sec_code = self.store.data_name_to_class_sec_code(data._name)  # По названию тикера получаем код площадки и код тикера
+        if (class_code, sec_code) in self.subscribed:  # Если котировки уже заказаны
+            return  # то выходим, дальше не продолжаем
+        if self.p.Quotes == 'Level2':  # Для стакана
+            self.store.subscribe('level2', class_code, sec_code)  # подписываемся на стакан
+        else:  # Для параметров текущих торгов
+            for param_name in ('LAST', 'BID', 'OFFER'):  # заказываем цену последней сделки, лучшие цены спроса и предложения
+                self.store.subscribe('param', class_code, sec_code, param_name)
+        self.subscribed.add((class_code, sec_code))
+        self.changed.add((class_code, sec_code))  # Котировки нужно получить
+
+    def get_quote_price(self, order):
+        """Цена исполнения заявки по котировкам в BackTrader
+
+        :param Order order: Заявка
+        :return: Цена исполнения или None, если котировок нет
+        """
+        class_code, sec_code = self.store.data_name_to_class_sec_code(order.data._name)  # По названию тикера получаем код площадки и код тикера
+        if self.p.Quotes == 'Level2':  # Для стакана
+            price, lots = self.get_order_book_price(class_code, sec_code, order)  # Средняя цена и кол-во исполнения по стакану
+            self.depth[order.ref] = self.store.lots_to_size(class_code, sec_code, lots)  # Кол-во для исполнения по объему (fill_order_book)
+        else:  # Для параметров текущих торгов
+            quote = self.get_quote(class_code, sec_code)  # Котировки по тикеру
+            if self.p.Quotes == 'Last':  # Если исполняем по цене последней сделки
+                price = quote['LAST']
+            else:  # Если исполняем по лучшим ценам
+                price = quote['OFFER'] if order.isbuy() else quote['BID']  # Покупаем по цене предложения, продаем по цене спроса
+        if not price:  # Если цены нет (нулевая цена до начала торгов)
+            return None
+        return self.store.quik_to_bt_price(class_code, sec_code, price)  # Переводим цену из QUIK в BackTrader
+
+    def get_quote(self, class_code, sec_code):
+        """Котировки по тикеру. Из QUIK получаем только после их изменения"""
+        key = (class_code, sec_code)  # Ключ котировок
+        if key in self.changed or key not in self.quotes:  # Если параметры изменились или котировок еще нет
+            self.changed.discard(key)  # Изменения будем учитывать
+            self.quotes[key] = {param_name: float(self.store.market_request('GetParamEx', class_code, sec_code, param_name)['data']['param_value'] or 0)
+                                for param_name in ('LAST', 'BID', 'OFFER')}  # Получаем котировки из QUIK
+        return self.quotes[key]
+
+    def get_order_book_price(self, class_code, sec_code, order):
+        """Средняя цена и кол-во исполнения заявки по стакану в QUIK
+
+        :return: Средняя цена исполнения или None, если стакан пустой, кол-во в лотах, которое есть в стакане
+        """
+        key = (class_code, sec_code)  # Ключ стакана
+        if key in self.spent:  # Если весь стакан уже забран
+            return None, 0  # то ждем следующего
+        if key not in self.order_books:  # Если стакан еще не приходил по подписке
+            self.order_books[key] = self.store.market_request('GetQuoteLevel2', class_code, sec_code)['data']  # то получаем его из QUIK
+        order_book = self.order_books[key]  # Стакан
+        levels = (order_book.get('offer') or []) if order.isbuy() else list(reversed(order_book.get('bid') or []))  # Покупаем по предложениям от лучшей цены. Продаем по спросу от лучшей цены
+        lots = abs(self.store.size_to_lots(class_code, sec_code, order.executed.remsize or order.size))  # Кол-во к исполнению в лотах
+        amount = filled = 0  # Сумма и кол-во исполнения
+        for level in levels:  # Пробегаемся по уровням стакана
+            qty = min(float(level['quantity']), lots - filled)  # Кол-во, которое можно взять на уровне
+            amount += qty * float(level['price'])
+            filled += qty
+            if filled >= lots:  # Если заявка исполняется полностью
+                break  # то дальше уровни не смотрим
+        if filled < lots:  # Если стакана не хватает на всю заявку
+            self.spent.add(key)  # то забираем его весь
+        return amount / filled if filled else None, int(filled)  # Средняя цена исполнения. Стакан может исполнить заявку не полностью
+
+    def fill_order_book(self, order, price, ago):
+        """Исполнение по объему (filler BackBroker) по стакану. Исполняем кол-во, которое было в стакане при расчете цены, остаток заявки остается
+
+        :return: Кол-во к исполнению без знака
+        """
+        return min(self.depth.pop(order.ref, abs(order.executed.remsize)), abs(order.executed.remsize))  # По барам (история) заявка исполняется полностью
+
+    def on_param(self, data):
+        """Обработчик события изменения текущих параметров"""
+        self.changed.add((data['data']['class_code'], data['data']['sec_code']))  # Котировки тикера нужно получить заново
+
+    def on_quote(self, data):
+        """Обработчик события изменения стакана котировок"""
+        order_book = data['data']  # Стакан
+        key = (order_book['class_code'], order_book['sec_code'])  # Ключ стакана
+        self.order_books[key] = order_book  # Запоминаем последний стакан
+        self.spent.discard(key)  # По новому стакану можно исполнять
@@ -0,0 +1,149 @@
+import collections
+from datetime import datetime
+import time
+
+from pytz import timezone
+
+
+class QKRisk:
+    """Предторговые проверки заявок брокера QUIK
+    Проверка выполняется перед отправкой заявки на биржу. Все счетчики обновляются по мере отправки заявок и сделок,
+    поэтому проверка заявки занимает постоянное время и не зависит от кол-ва тикеров, заявок и сделок
+    Заявки, которые только уменьшают позицию, проверяются лишь по размеру и кол-ву заявок за минуту. Так закрытие позиции и стоп заявки не блокируются лимитами позиций и убытка
+    """
+    def __init__(self, max_order_size=None, max_position=None, max_notional=None, max_orders_per_minute=None, max_daily_loss=None):
+        """Инициализация. Лимиты в штуках и деньгах BackTrader. None - лимит не проверяется
+
+        :param float max_order_size: Максимальный размер заявки
+        :param float|dict max_position: Максимальная позиция по тикеру. Число для всех тикеров или словарь: Название тикера -> Лимит
+        :param float max_notional: Максимальная стоимость всех позиций по счету с учетом активных заявок
+        :param int max_orders_per_minute: Максимальное кол-во заявок за последнюю минуту
+        :param float max_daily_loss: Максимальный убыток по закрытым сделкам за день. После него можно только уменьшать позиции
+        """
+        self.max_order_size = max_order_size  # Максимальный размер заявки
+        self.max_position = max_position  # Максимальная позиция по тикеру
+        self.max_notional = max_notional  # Максимальная стоимость позиций
+        self.max_orders_per_minute = max_orders_per_minute  # Максимальное кол-во заявок за минуту
+        self.max_daily_loss = max_daily_loss  # Максимальный убыток за день
+        self.positions = collections.defaultdict(float)  # Позиции по названию тикера
+        self.prices = {}  # Средние цены позиций по названию тикера
+        self.pending_buy = collections.defaultdict(float)  # Неисполненный остаток активных заявок на покупку по названию тикера
+        self.pending_sell = collections.defaultdict(float)  # Неисполненный остаток активных заявок на продажу по названию тикера
+        self.pending_orders = {}  # Название тикера и неисполненный остаток со знаком по номеру транзакции активной заявки
+        self.notionals = collections.defaultdict(float)  # Стоимость позиций по названию тикера
+        self.notional = 0.0  # Стоимость всех позиций и неисполненных остатков активных заявок
+        self.order_times = collections.deque()  # Время отправки заявок за последнюю минуту
+        self.daily_pnl = 0.0  # Прибыль/убыток по закрытым сделкам за день
+        self.utc_offset = datetime.now(timezone('Europe/Moscow')).utcoffset().total_seconds()  # Смещение времени биржи от UTC. Переход на летнее время на бирже не используется
+        self.day = self.get_day()  # Текущий день на бирже
+
+    def check(self, dataname, size, price, mult=1):
+        """Проверка заявки перед отправкой на биржу
+
+        :param str dataname: Название тикера
+        :param float size: Размер заявки в штуках со знаком. Покупка > 0, продажа < 0
+        :param float price: Цена заявки или последняя цена для рыночной заявки
+        :param float mult: Множитель стоимости (для фьючерсов)
+        :return: Причина отклонения заявки или None, если заявку можно отправлять
+        """
+        if self.max_order_size is not None and abs(size) > self.max_order_size:  # Если превышен размер заявки
+            return f'Размер заявки {abs(size)} больше {self.max_order_size}'
+        if self.max_orders_per_minute is not None:  # Если задано максимальное кол-во заявок за минуту. Проверяем для всех заявок
+            now = time.monotonic()  # Текущее время
+            while self.order_times and now - self.order_times[0] >= 60:  # Убираем заявки старше минуты. Каждая заявка убирается один раз
+                self.order_times.popleft()
+            if len(self.order_times) >= self.max_orders_per_minute:  # Если заявок за минуту слишком много
+                return f'Заявок за минуту больше {self.max_orders_per_minute}'
+        position = self.positions[dataname]  # Текущая позиция
+        worst = position + self.pending_buy[dataname] + size if size > 0 else position - self.pending_sell[dataname] + size  # Позиция после исполнения всех активных заявок в ту же сторону
+        if abs(worst) <= abs(position) and worst * position >= 0:  # Если заявка только уменьшает позицию
+            return None  # то остальные лимиты не проверяем
+        if self.max_position is not None:  # Если задана максимальная позиция
+            max_position = self.max_position.get(dataname) if isinstance(self.max_position, dict) else self.max_position  # Лимит по тикеру
+            if max_position is not None and abs(worst) > max_position:  # Если позиция будет больше лимита
+                return f'Позиция {worst} по тикеру {dataname} больше {max_position}'
+        if self.max_notional is not None and price:  # Если задана максимальная стоимость позиций и известна цена
+            notional = self.notional + (abs(size) * price * mult)  # Стоимость позиций после исполнения заявки
+            if notional > self.max_notional:  # Если стоимость будет больше лимита
+                return f'Стоимость позиций {notional:.2f} больше {self.max_notional}'
+        if self.max_daily_loss is not None:  # Если задан максимальный убыток за день
+            self.check_day()  # Убыток считаем с начала дня
+            if -self.daily_pnl >= self.max_daily_loss:  # Если убыток достиг лимита
+                return f'Убыток за день {-self.daily_pnl:.2f} достиг {self.max_daily_loss}'
+        return None  # Все проверки пройдены
+
+    def on_submit(self, ref, dataname, size, price, mult=1):
+        """Заявка отправлена на биржу"""
+        if self.max_orders_per_minute is not None:  # Если считаем заявки за минуту
+            self.order_times.append(time.monotonic())  # то запоминаем время отправки
+        notional = abs(size) * (price or self.prices.get(dataname, 0)) * mult  # Стоимость заявки
+        self.pending_orders[ref] = [dataname, size, notional]  # Остаток заявки и стоимость остатка
+        self.add_pending(dataname, size > 0, abs(size))
+        self.notional += notional
+
+    def on_fill(self, ref, dataname, size, price, mult=1):
+        """Сделка по заявке
+
+        :param int ref: Номер транзакции заявки. None - заявка выставлена не из торговой системы
+        :param str dataname: Название тикера
+        :param float size: Кол-во в штуках со знаком
+        :param float price: Цена сделки
+        :param float mult: Множитель стоимости (для фьючерсов)
+        """
+        pending_order = self.pending_orders.get(ref)  # Активная заявка
+        if pending_order:  # Если заявка есть в активных
+            filled = size if abs(size) < abs(pending_order[1]) else pending_order[1]  # Исполнение не больше остатка заявки
+            pending_notional = pending_order[2] * filled / pending_order[1] if pending_order[1] else 0  # Стоимость исполненной части остатка
+            pending_order[1] -= filled  # Уменьшаем остаток заявки
+            pending_order[2] -= pending_notional
+            self.add_pending(dataname, filled > 0, -abs(filled))
+            self.notional -= pending_notional
+        position = self.positions[dataname]  # Позиция до сделки
+        avg_price = self.prices.get(dataname, price)  # Средняя цена позиции до сделки
+        if position * size < 0:  # Если сделка закрывает позицию (полностью или частично)
+            closed = -size if abs(size) <= abs(position) else position  # Закрытое кол-во со знаком позиции
+            self.check_day()  # Прибыль/убыток считаем с начала дня
+            self.daily_pnl += closed * (price - avg_price) * mult  # Прибыль/убыток по закрытой части
+        new_position = position + size  # Позиция после сделки
+        if new_position == 0:  # Если позиция закрыта
+            self.prices.pop(dataname, None)
+        elif position * new_position <= 0:  # Если позиция открыта или перевернута
+            self.prices[dataname] = price  # то средняя цена - цена сделки
+        elif abs(new_position) > abs(position):  # Если позиция увеличена
+            self.prices[dataname] = (avg_price * position + price * size) / new_position  # то пересчитываем среднюю цену
+        self.set_position(dataname, new_position, mult)
+
+    def on_close(self, ref):
+        """Заявка больше не активна (исполнена, снята, отклонена). Освобождаем неисполненный остаток"""
+        pending_order = self.pending_orders.pop(ref, None)  # Активная заявка
+        if pending_order:  # Если заявка была активной
+            dataname, size, notional = pending_order
+            self.add_pending(dataname, size > 0, -abs(size))
+            self.notional -= notional
+
+    def set_position(self, dataname, size, mult=1, price=None):
+        """Установка позиции по тикеру (при запуске брокера и после сделок)"""
+        if price is not None:  # Если задана средняя цена позиции
+            self.prices[dataname] = price
+        self.positions[dataname] = size
+        notional = abs(size) * self.prices.get(dataname, 0) * mult  # Стоимость позиции
+        self.notional += notional - self.notionals[dataname]  # Меняем стоимость всех позиций на изменение стоимости позиции
+        self.notionals[dataname] = notional
+
+    # Функции
+
+    def add_pending(self, dataname, is_buy, size):
+        """Изменение неисполненного остатка активных заявок по тикеру в штуках без знака"""
+        pending = self.pending_buy if is_buy else self.pending_sell  # Остатки заявок на покупку или продажу
+        pending[dataname] = max(pending[dataname] + size, 0)
+
+    def get_day(self):
+        """Текущий день на бирже"""
+        return int((time.time() + self.utc_offset) // 86400)
+
+    def check_day(self):
+        """Сброс дневного убытка при смене дня"""
+        day = self.get_day()  # Текущий день на бирже
+        if day != self.day:  # Если наступил новый день
+            self.day = day
+            self.daily_pnl = 0.0  # то убыток считаем заново
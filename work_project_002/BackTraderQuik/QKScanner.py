@@ -0,0 +1,194 @@
+from operator import itemgetter
+
+import numpy as np
+
+from backtrader import Strategy
+
+
+class QKScanner(Strategy):
+    """Торговая система-сканер многих тикеров в одном процессе
+    Индикаторы BackTrader пересчитываются по всем тикерам на каждой итерации, даже если новый бар пришел по одному тикеру.
+    Сканер вместо них считает индикаторы по массивам тикеров (BatchEMA, BatchRSI, ...) и только по тикерам с новыми барами.
+    Бары всех тикеров, пришедшие к итерации Cerebro, обрабатываются одним вызовом next_batch
+    Предел масштабирования - сам Cerebro: на каждой итерации он в Python продвигает все данные, поэтому задержка растет линейно с кол-вом тикеров
+    (на замене QUIK 0.2-0.3 мс на тикер с двумя интервалами, bench_scanner.py). Сотни тикеров лучше делить между процессами
+    """
+    def __init__(self):
+        self.lens = np.zeros(len(self.datas), dtype=np.int64)  # Кол-во баров данных на прошлой итерации
+        self.live = np.zeros(len(self.datas), dtype=bool)  # Данные в режиме получения новых баров (LIVE)
+        self.data_indexes = {id(data): i for i, data in enumerate(self.datas)}  # Номера данных
+        self.line_buffers = {}  # Линии всех данных по названию линии. Массивы объектов выбираются по номерам данных без getattr
+
+    def prenext(self):
+        self.next()  # Тикеры без истории не задерживают сканирование остальных
+
+    def next(self):
+        lens = np.fromiter(map(len, self.datas), np.int64, len(self.datas))  # Кол-во баров данных
+        updated = np.flatnonzero(lens > self.lens)  # Номера данных с новыми барами
+        self.lens = lens
+        if len(updated):  # Если есть новые бары
+            self.next_batch(updated)  # то обрабатываем их вместе
+
+    def next_batch(self, updated):
+        """Новые бары по данным. Переопределяется в торговой системе
+
+        :param numpy.ndarray updated: Номера данных, по которым пришли новые бары
+        """
+        pass
+
+    def notify_data(self, data, status, *args, **kwargs):
+        """Режим получения баров по каждым данным"""
+        self.live[self.data_indexes[id(data)]] = status == data.LIVE
+
+    # Функции
+
+    def get_lines(self, indexes, *names):
+        """Значения линий текущих баров данных
+
+        :param numpy.ndarray indexes: Номера данных
+        :param str names: Названия линий: 'open', 'high', 'low', 'close', 'volume'
+        :return: Массивы значений по каждой линии
+        """
+        return [np.fromiter(map(self.current, self.get_line_buffers(name)[indexes]), float, len(indexes)) for name in names]
+
+    current = itemgetter(0)  # Значение линии на текущем баре
+
+    def get_line_buffers(self, name):
+        """Линии всех данных по названию линии. Собираются один раз, т.к. линии данных не меняются"""
+        buffers = self.line_buffers.get(name)
+        if buffers is None:  # Если линии еще не собирали
+            buffers = self.line_buffers[name] = np.empty(len(self.datas), dtype=object)  # Массив объектов, а не значений линий
+            for i, data in enumerate(self.datas):
+                buffers[i] = getattr(data.lines, name)
+        return buffers
+
+
+class BatchEMA:
+    """Экспоненциальная средняя по массиву тикеров. Первое значение - простая средняя за период, как в BackTrader"""
+    def __init__(self, n, period, alpha=None):
+        """Инициализация
+
+        :param int n: Кол-во тикеров
+        :param int period: Период
+        :param float alpha: Коэффициент сглаживания. По умолчанию 2 / (период + 1). Для средней Уайлдера (SMMA) 1 / период
+        """
+        self.period = period  # Период
+        self.alpha = 2.0 / (period + 1) if alpha is None else alpha  # Коэффициент сглаживания
+        self.counts = np.zeros(n, dtype=np.int64)  # Кол-во значений
+        self.sums = np.zeros(n)  # Сумма первых значений для простой средней
+        self.values = np.full(n, np.nan)  # Текущие значения. NaN - значения еще нет
+        self.previous = np.full(n, np.nan)  # Значения на прошлом баре
+
+    def update(self, rows, x):
+        """Новые значения по тикерам. NaN пропускаются
+
+        :param numpy.ndarray rows: Номера тикеров
+        :param numpy.ndarray x: Значения
+        :return: Значения средней по тикерам
+        """
+        self.previous[rows] = self.values[rows]
+        all_rows = rows  # Значения возвращаем по всем тикерам
+        valid = ~np.isnan(x)  # Значения, которые учитываем
+        rows, x = rows[valid], x[valid]
+        counts = self.counts[rows] + 1  # Кол-во значений с новым
+        self.counts[rows] = counts
+        seed = counts <= self.period  # Средняя еще набирается
+        self.sums[rows[seed]] += x[seed]
+        ready = counts == self.period  # Первое значение средней
+        self.values[rows[ready]] = self.sums[rows[ready]] / self.period
+        going = counts > self.period  # Средняя уже считается
+        values = self.values[rows[going]]
+        self.values[rows[going]] = values + self.alpha * (x[going] - values)
+        return self.values[all_rows]
+
+
+class BatchWindow:
+    """Значение за скользящее окно по массиву тикеров: простая средняя, максимум, минимум"""
+    def __init__(self, n, period, func=np.mean):
+        """Инициализация
+
+        :param int n: Кол-во тикеров
+        :param int period: Период
+        :param func: Функция окна по строкам массива: numpy.mean, numpy.max, numpy.min
+        """
+        self.period = period  # Период
+        self.func = func  # Функция окна
+        self.buffer = np.zeros((n, period))  # Кольцевой буфер значений
+        self.counts = np.zeros(n, dtype=np.int64)  # Кол-во значений
+        self.values = np.full(n, np.nan)  # Текущие значения. NaN - окно еще не заполнено
+        self.previous = np.full(n, np.nan)  # Значения на прошлом баре
+
+    def update(self, rows, x):
+        """Новые значения по тикерам. NaN пропускаются"""
+        self.previous[rows] = self.values[rows]
+        all_rows = rows  # Значения возвращаем по всем тикерам
+        valid = ~np.isnan(x)  # Значения, которые учитываем
+        rows, x = rows[valid], x[valid]
+        self.buffer[rows, self.counts[rows] % self.period] = x  # Новое значение заменяет самое старое
+        self.counts[rows] += 1
+        ready = rows[self.counts[rows] >= self.period]  # Тикеры с заполненным окном
+        self.values[ready] = self.func(self.buffer[ready], axis=1)
+        return self.values[all_rows]
+
+
+class BatchMACD:
+    """MACD по массиву тикеров: разность быстрой и медленной средних и сигнальная линия"""
+    def __init__(self, n, period_me1=12, period_me2=26, period_signal=9):
+        self.me1 = BatchEMA(n, period_me1)  # Быстрая средняя
+        self.me2 = BatchEMA(n, period_me2)  # Медленная средняя
+        self.macd = np.full(n, np.nan)  # Линия MACD
+        self.macd_previous = np.full(n, np.nan)  # Линия MACD на прошлом баре
+        self.signal = BatchEMA(n, period_signal)  # Сигнальная линия
+
+    def update(self, rows, close):
+        """Новые цены закрытия по тикерам
+
+        :return: Линия MACD и сигнальная линия по тикерам
+        """
+        self.macd_previous[rows] = self.macd[rows]
+        self.macd[rows] = self.me1.update(rows, close) - self.me2.update(rows, close)
+        return self.macd[rows], self.signal.update(rows, self.macd[rows])
+
+
+class BatchRSI:
+    """RSI по массиву тикеров со средними Уайлдера, как в BackTrader"""
+    def __init__(self, n, period=14):
+        self.close = np.full(n, np.nan)  # Цена закрытия прошлого бара
+        self.up = BatchEMA(n, period, 1.0 / period)  # Средний рост
+        self.down = BatchEMA(n, period, 1.0 / period)  # Среднее падение
+        self.values = np.full(n, np.nan)  # Текущие значения
+
+    def update(self, rows, close):
+        """Новые цены закрытия по тикерам
+
+        :return: RSI по тикерам
+        """
+        change = close - self.close[rows]  # Изменение цены. NaN на первом баре
+        self.close[rows] = close
+        up = self.up.update(rows, np.where(np.isnan(change), np.nan, np.maximum(change, 0.0)))
+        down = self.down.update(rows, np.where(np.isnan(change), np.nan, np.maximum(-change, 0.0)))
+        with np.errstate(divide='ignore', invalid='ignore'):  # Без падений цена RSI = 100
+            self.values[rows] = np.where(down == 0, 100.0, 100.0 - 100.0 / (1.0 + up / down))
+        return self.values[rows]
+
+
+class BatchStochastic:
+    """Медленный Stochastic по массиву тикеров, как Stochastic в BackTrader"""
+    def __init__(self, n, period=14, period_dfast=3, period_dslow=3):
+        self.highest = BatchWindow(n, period, np.max)  # Максимум за период
+        self.lowest = BatchWindow(n, period, np.min)  # Минимум за период
+        self.percK = BatchWindow(n, period_dfast)  # Линия %K
+        self.percD = BatchWindow(n, period_dslow)  # Линия %D
+
+    def update(self, rows, high, low, close):
+        """Новые бары по тикерам
+
+        :return: Линии %K и %D по тикерам
+        """
+        highest = self.highest.update(rows, high)
+        lowest = self.lowest.update(rows, low)
+        with np.errstate(divide='ignore', invalid='ignore'):  # Если максимум равен минимуму, то значение 0, как safediv в BackTrader
+            k = np.where(highest > lowest, 100.0 * (close - lowest) / (highest - lowest), 0.0)
+        k[np.isnan(highest)] = np.nan  # Пока окно не заполнено, значения нет
+        perc_k = self.percK.update(rows, k)
+        return perc_k, self.percD.update(rows, perc_k)
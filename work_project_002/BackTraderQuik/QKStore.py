@@ -1,5 +1,8 @@
 import collections
 from datetime import datetime
+import logging
+import threading
+import time
 from pytz import timezone
 
 from backtrader.metabase import MetaParams
@@ -8,29 +11,43 @@ from backtrader import Order
 from backtrader.position import Position
 
 from QuikPy import QuikPy
+from BackTraderQuik.QKLogger import start_default_logging
+from BackTraderQuik.QKMetrics import metrics
 
+logger = logging.getLogger(__name__)  # Лог хранилища
+
+
+class MetaQKStore(MetaParams):
+    """Метакласс хранилищ QUIK. Для каждого терминала QUIK (адреса и портов подключения) создается одно хранилище"""
+    connection_params = ('Host', 'RequestsPort', 'CallbacksPort')  # Параметры подключения к терминалу
 
-class MetaSingleton(MetaParams):
-    """Метакласс для создания Singleton классов"""
     def __init__(cls, *args, **kwargs):
         """Инициализация класса"""
-        super(MetaSingleton, cls).__init__(*args, **kwargs)
-        cls._singleton = None  # Экземпляра класса еще нет
+        super(MetaQKStore, cls).__init__(*args, **kwargs)
+        cls._stores = {}  # Экземпляров класса еще нет
 
     def __call__(cls, *args, **kwargs):
         """Вызов класса"""
-        if not cls._singleton:  # Если класса нет в экземплярах класса
-            cls._singleton = super(MetaSingleton, cls).__call__(*args, **kwargs)  # то создаем зкземпляр класса
-        return cls._singleton  # Возвращаем экземпляр класса
+        defaults = cls.params._getkwargsdefault()  # Значения параметров по умолчанию
+        key = tuple(kwargs.get(name, defaults[name]) for name in cls.connection_params)  # Ключ терминала
+        if key not in cls._stores:  # Если для терминала нет экземпляра класса
+            cls._stores[key] = super(MetaQKStore, cls).__call__(*args, **kwargs)  # то создаем зкземпляр класса
+        return cls._stores[key]  # Возвращаем экземпляр класса терминала
 
 
-class QKStore(with_metaclass(MetaSingleton, object)):
-    """Хранилище QUIK"""
+class QKStore(with_metaclass(MetaQKStore, object)):
+    """Хранилище QUIK. Одно на каждый терминал QUIK. Для работы с несколькими терминалами используйте пул QKStorePool"""
     params = (
         ('Host', '127.0.0.1'),  # Адрес/IP компьютера с QUIK
         ('RequestsPort', 34130),  # Номер порта для запросов и ответов
         ('CallbacksPort', 34131),  # Номер порта для получения событий
         ('StopSteps', 10),  # Размер в минимальных шагах цены инструмента для исполнения стоп заявок
+        ('UnsubscribeDelay', 5.0),  # Задержка отмены подписки в секундах. Если подписка снова понадобится, то она не отменяется
+        ('MetricsPort', None),  # Порт HTTP сервера метрик в формате Prometheus на 127.0.0.1. None - сервер не запускается
+        ('PingInterval', None),  # Период проверки связи с QUIK (Ping) в секундах. None - связь не проверяется
+        ('PingTimeout', 5.0),  # Время ответа на Ping в секундах, после которого связь с QUIK считается зависшей
+        ('StallTimeouts', {}),  # Допустимое время без событий в секундах по имени события QUIK. Например, {'NewCandle': 120, 'OnAllTrade': 60}
+        ('AutoReconnect', False),  # Переподключаться к QUIK и восстанавливать подписки при зависании связи
     )
 
     BrokerCls = None  # Класс брокера будет задан из брокера
@@ -50,33 +67,72 @@ class QKStore(with_metaclass(MetaSingleton, object)):
 
     def __init__(self):
         super(QKStore, self).__init__()
+        start_default_logging()  # Если логирование не настроено, то пишем лог на консоль
         self.notifs = collections.deque()  # Уведомления хранилища
         self.provider = QuikPy(host=self.p.Host, requests_port=self.p.RequestsPort, callbacks_port=self.p.CallbacksPort)  # Вызываем конструктор QuikPy с адресом хоста и портами
         self.symbols = {}  # Информация о тикерах
-        self.new_bars = []  # Новые бары по всем подпискам на тикеры из QUIK
+        self.bar_queues = {}  # Очереди новых баров получателей по коду площадки, коду тикера и интервалу
+        self.quik_date_time_now = None  # Текущие дата и время QUIK на итерации Cerebro
         self.connected = True  # Считаем, что изначально QUIK подключен к серверу брокера
         self.class_codes = self.provider.GetClassesList()['data']  # Список классов. В некоторых таблицах тикер указывается без кода класса
-        self.subscribed_symbols = []  # Список подписанных тикеров/интервалов
+        self.subscriptions = {}  # Кол-во ссылок на подписку по ключу: ('candles', Код площадки, Код тикера, Интервал), ('level2', Код площадки, Код тикера, None), ('param', Код площадки, Код тикера, Параметр)
+        self.unsubscriptions = {}  # Время отмены подписок, на которые больше нет ссылок, по ключу подписки
+        self.subscriptions_lock = threading.RLock()  # Подписки меняет поток Cerebro, а восстанавливает поток обработчиков событий QUIK
+        self.tick_queues = {}  # Очереди обезличенных сделок получателей по коду площадки и коду тикера
+        self.last_loop_time = None  # Время последней итерации Cerebro
+        self.brokers = 0  # Кол-во запущенных брокеров счетов этого терминала
+        self.pool = None  # Пул хранилищ QKStorePool, в который входит терминал. Запросы рыночных данных пул распределяет по своим терминалам
+        self.ping_latencies = collections.deque(maxlen=1000)  # Время ответа на последние Ping в секундах
+        self.stalled = set()  # События, о зависании которых уже сообщили
+        self.watchdog_thread = None  # Поток проверки связи с QUIK
+        self.watchdog_stop = threading.Event()  # Поток проверки связи нужно остановить
+        self.provider.metrics = metrics  # QuikPy собирает время запросов и задержки функций обратного вызова
+        metrics.set_function('qk_new_bars_queue', lambda: sum(len(bars) for queues in list(self.bar_queues.values()) for bars in queues),
+                             terminal=self.get_terminal_name())  # Кол-во новых баров, не разобранных данными
 
     def start(self):
         self.provider.OnConnected = self.on_connected  # Соединение терминала с сервером QUIK
         self.provider.OnDisconnected = self.on_disconnected  # Отключение терминала от сервера QUIK
-        self.provider.OnNewCandle = lambda data: self.new_bars.append(data['data'])  # Обработчик новых баров по подписке из QUIK
+        self.provider.OnNewCandle = self.on_new_candle  # Обработчик новых баров по подписке из QUIK
+        self.provider.OnAllTrade = self.on_all_trade  # Обработчик новых обезличенных сделок из QUIK
+        if self.p.MetricsPort:  # Если нужно отдавать метрики
+            metrics.start_server(self.p.MetricsPort)  # то запускаем HTTP сервер метрик
+        if self.p.PingInterval and not self.watchdog_thread:  # Если нужно проверять связь с QUIK, и проверка еще не запущена
+            self.watchdog_stop.clear()
+            self.watchdog_thread = threading.Thread(target=self.watchdog, name='QKWatchdog', daemon=True)  # Поток проверки связи
+            self.watchdog_thread.start()
 
     def put_notification(self, msg, *args, **kwargs):
         self.notifs.append((msg, args, kwargs))
 
     def get_notifications(self):
         """Выдача уведомлений хранилища"""
+        self.unsubscribe_expired()  # Cerebro запрашивает уведомления на каждой итерации. Отменяем подписки, задержка которых прошла
+        self.quik_date_time_now = None  # На новой итерации время QUIK запрашиваем заново
+        now = time.perf_counter()  # Время текущей итерации Cerebro
+        if self.last_loop_time is not None:  # Если итерация не первая
+            metrics.observe('qk_loop_seconds', now - self.last_loop_time)  # то записываем время итерации
+        self.last_loop_time = now
         self.notifs.append(None)
         return [notif for notif in iter(self.notifs.popleft, None)]
 
     def stop(self):
+        if self.watchdog_thread:  # Если связь с QUIK проверялась
+            self.watchdog_stop.set()  # то останавливаем проверку
+            self.watchdog_thread.join()
+            self.watchdog_thread = None
+        self.unsubscribe_expired(True)  # Отменяем все подписки без ссылок, не дожидаясь задержки
         self.provider.OnNewCandle = self.provider.DefaultHandler  # Возвращаем обработчик по умолчанию
+        self.provider.OnAllTrade = self.provider.DefaultHandler  # Возвращаем обработчик по умолчанию
         self.provider.CloseConnectionAndThread()  # Закрываем соединение для запросов и поток обработки функций обратного вызова
+        metrics.stop_server()  # Останавливаем HTTP сервер метрик, если он был запущен
 
     # Функции
 
+    def get_terminal_name(self):
+        """Адрес и порт запросов терминала QUIK для лога и метрик"""
+        return f'{self.p.Host}:{self.p.RequestsPort}'
+
     def get_symbol_info(self, class_code, sec_code, reload=False):
         """Получение информации тикера
 
@@ -88,11 +144,21 @@ class QKStore(with_metaclass(MetaSingleton, object)):
         if reload or (class_code, sec_code) not in self.symbols:  # Если нужно получить информацию из QUIK или нет информации о тикере в справочнике
             symbol_info = self.provider.GetSecurityInfo(class_code, sec_code)  # Получаем информацию о тикере из QUIK
             if 'data' not in symbol_info:  # Если ответ не пришел (возникла ошибка). Например, для опциона
-                print(f'Информация о {self.class_sec_code_to_data_name(class_code, sec_code)} не найдена')
+                logger.warning('Информация о %s не найдена', self.class_sec_code_to_data_name(class_code, sec_code))
                 return None  # то возвращаем пустое значение
             self.symbols[(class_code, sec_code)] = symbol_info['data']  # Заносим информацию о тикере в справочник
         return self.symbols[(class_code, sec_code)]  # Возвращаем значение из справочника
 
+    def market_request(self, name, *args):
+        """Запрос рыночных данных (GetParamEx, GetQuoteLevel2, GetCandlesFromDataSource, ...). Если терминал в пуле, то к следующему терминалу пула
+
+        :param str name: Имя функции QuikPy
+        :return: Ответ QUIK
+        """
+        if self.pool is not None:  # Если терминал в пуле
+            return self.pool.market_request(name, *args)  # то запрос отправляет пул
+        return getattr(self.provider, name)(*args)
+
     def data_name_to_class_sec_code(self, dataname):
         """Код площадки и код тикера из названия тикера (с кодом площадки или без него)
 
@@ -184,27 +250,246 @@ class QKStore(with_metaclass(MetaSingleton, object)):
                 return price / lot_size  # то цену делим на лот
         return price  # В остальных случаях цена не изменяется
 
+    def subscribe(self, kind, class_code, sec_code, arg=None):
+        """Подписка с подсчетом ссылок. В QUIK отправляется только первая подписка
+
+        :param str kind: Тип подписки: 'candles' - бары, 'level2' - стакан, 'param' - параметр текущих торгов
+        :param str class_code: Код площадки
+        :param str sec_code: Код тикера
+        :param arg: Интервал для баров, название параметра для параметров текущих торгов
+        """
+        key = (kind, class_code, sec_code, arg)  # Ключ подписки
+        with self.subscriptions_lock:
+            count = self.subscriptions.get(key, 0)  # Кол-во ссылок на подписку
+            self.subscriptions[key] = count + 1  # Добавляем ссылку
+            if self.unsubscriptions.pop(key, None) is not None:  # Если подписка ждала отмены
+                return  # то она еще действует в QUIK
+            if count == 0:  # Если это первая ссылка
+                self.subscribe_in_quik(key)  # то подписываемся в QUIK
+
+    def unsubscribe(self, kind, class_code, sec_code, arg=None):
+        """Отмена ссылки на подписку. Подписка в QUIK отменяется с задержкой после отмены последней ссылки"""
+        key = (kind, class_code, sec_code, arg)  # Ключ подписки
+        with self.subscriptions_lock:
+            count = self.subscriptions.get(key, 0)  # Кол-во ссылок на подписку
+            if count == 0:  # Если подписки нет
+                return  # то отменять нечего
+            if count > 1:  # Если на подписку есть еще ссылки
+                self.subscriptions[key] = count - 1  # то только убираем ссылку
+                return
+            del self.subscriptions[key]  # Ссылок больше нет
+            self.unsubscriptions[key] = time.monotonic() + self.p.UnsubscribeDelay  # Отменяем подписку позже
+            if self.p.UnsubscribeDelay <= 0:  # Если задержки нет
+                self.unsubscribe_expired()  # то отменяем сразу
+
+    def is_subscribed(self, kind, class_code, sec_code, arg=None):
+        """Есть ли ссылки на подписку"""
+        return (kind, class_code, sec_code, arg) in self.subscriptions
+
+    def unsubscribe_expired(self, force=False):
+        """Отмена в QUIK подписок без ссылок, задержка которых прошла
+
+        :param bool force: Отменить все подписки без ссылок
+        """
+        if not self.unsubscriptions:  # Если отменять нечего
+            return  # то выходим, дальше не продолжаем
+        with self.subscriptions_lock:
+            now = time.monotonic()  # Текущее время
+            for key, unsubscribe_time in list(self.unsubscriptions.items()):  # Пробегаемся по всем подпискам, ждущим отмены
+                if force or unsubscribe_time <= now:  # Если время отмены наступило
+                    del self.unsubscriptions[key]
+                    self.unsubscribe_in_quik(key)  # то отменяем подписку в QUIK
+
+    def subscribe_in_quik(self, key):
+        """Подписка в QUIK по ключу подписки"""
+        kind, class_code, sec_code, arg = key
+        if kind == 'candles':  # Бары
+            if not self.provider.IsSubscribed(class_code, sec_code, arg)['data']:  # Если не было подписки на тикер/интервал
+                self.provider.SubscribeToCandles(class_code, sec_code, arg)  # то подписываемся на новые бары
+        elif kind == 'level2':  # Стакан
+            self.provider.SubscribeLevel2Quotes(class_code, sec_code)
+        elif kind == 'param':  # Параметр текущих торгов
+            self.provider.ParamRequest(class_code, sec_code, arg)
+
+    def unsubscribe_in_quik(self, key):
+        """Отмена подписки в QUIK по ключу подписки"""
+        kind, class_code, sec_code, arg = key
+        if kind == 'candles':  # Бары
+            self.provider.UnsubscribeFromCandles(class_code, sec_code, arg)
+        elif kind == 'level2':  # Стакан
+            self.provider.UnsubscribeLevel2Quotes(class_code, sec_code)
+        elif kind == 'param':  # Параметр текущих торгов
+            self.provider.CancelParamRequest(class_code, sec_code, arg)
+
+    def subscribe_bars(self, class_code, sec_code, interval):
+        """Подписка на новые бары тикера. Каждый получатель разбирает только свою очередь, не просматривая бары других тикеров
+
+        :param str class_code: Код площадки
+        :param str sec_code: Код тикера
+        :param int interval: Интервал в минутах
+        :return: Очередь новых баров получателя. None в очереди - метка переподключения к QUIK
+        """
+        bars = collections.deque()  # У каждого получателя своя очередь
+        self.bar_queues.setdefault((class_code, sec_code, interval), []).append(bars)
+        self.subscribe('candles', class_code, sec_code, interval)  # Хранилище подпишется в QUIK, если подписки еще нет
+        return bars
+
+    def unsubscribe_bars(self, class_code, sec_code, interval, bars):
+        """Отмена подписки на новые бары тикера
+
+        :param str class_code: Код площадки
+        :param str sec_code: Код тикера
+        :param int interval: Интервал в минутах
+        :param collections.deque bars: Очередь получателя
+        """
+        queues = self.bar_queues.get((class_code, sec_code, interval), [])  # Очереди получателей по подписке
+        if bars in queues:  # Если очередь получателя есть
+            queues.remove(bars)  # то убираем ее
+        if not queues:  # Если получателей больше нет
+            self.bar_queues.pop((class_code, sec_code, interval), None)  # то бары подписки больше не раскладываем
+        self.unsubscribe('candles', class_code, sec_code, interval)  # Хранилище отменит подписку в QUIK, если она больше никому не нужна
+
+    def on_new_candle(self, data):
+        """Обработка нового бара по подписке из QUIK"""
+        bar = data['data']  # Новый бар
+        for bars in self.bar_queues.get((bar['class'], bar['sec'], int(bar['interval'])), ()):  # Пробегаемся по всем очередям получателей баров подписки
+            bars.append(bar)  # Добавляем бар в очередь
+
+    def get_quik_date_time_now(self):
+        """Текущие дата и время на сервере QUIK. Запрашиваются один раз за итерацию Cerebro для всех данных"""
+        if self.quik_date_time_now is None:  # Если на этой итерации время еще не запрашивали
+            d = self.provider.GetInfoParam('TRADEDATE')['data']  # Дата на сервере в виде строки dd.mm.yyyy. Может прийти неверная дата
+            t = self.provider.GetInfoParam('SERVERTIME')['data']  # Время на сервере в виде строки hh:mi:ss
+            try:  # Проверяем, можно ли привести полученные строки в дату и время
+                self.quik_date_time_now = datetime.strptime(f'{d} {t}', '%d.%m.%Y %H:%M:%S')  # Переводим строки в дату и время
+            except ValueError:  # Если нельзя привести полученные строки в дату и время
+                return datetime.now(self.MarketTimeZone).replace(tzinfo=None)  # То время МСК получаем из локального времени. Его не запоминаем
+        return self.quik_date_time_now
+
+    def subscribe_ticks(self, class_code, sec_code):
+        """Подписка на обезличенные сделки тикера. QUIK присылает все сделки без подписки, хранилище только раскладывает их по очередям
+
+        :param str class_code: Код площадки
+        :param str sec_code: Код тикера
+        :return: Очередь новых обезличенных сделок получателя
+        """
+        ticks = collections.deque()  # У каждого получателя своя очередь
+        self.tick_queues.setdefault((class_code, sec_code), []).append(ticks)
+        return ticks
+
+    def unsubscribe_ticks(self, class_code, sec_code, ticks):
+        """Отмена подписки на обезличенные сделки тикера
+
+        :param str class_code: Код площадки
+        :param str sec_code: Код тикера
+        :param collections.deque ticks: Очередь получателя
+        """
+        queues = self.tick_queues.get((class_code, sec_code), [])  # Очереди получателей по тикеру
+        if ticks in queues:  # Если очередь получателя есть
+            queues.remove(ticks)  # то убираем ее
+        if not queues:  # Если получателей больше нет
+            self.tick_queues.pop((class_code, sec_code), None)  # то сделки тикера больше не раскладываем
+
+    def on_all_trade(self, data):
+        """Обработка новой обезличенной сделки из QUIK"""
+        tick = data['data']  # Обезличенная сделка
+        for ticks in self.tick_queues.get((tick['class_code'], tick['sec_code']), ()):  # Пробегаемся по всем очередям получателей сделок тикера
+            ticks.append(tick)  # Добавляем сделку в очередь
+
+    def watchdog(self):
+        """Поток проверки связи с QUIK. Измеряет время ответа на Ping и время без событий по потокам событий"""
+        start_time = time.monotonic()  # События отсчитываем от начала проверки
+        while not self.watchdog_stop.wait(self.p.PingInterval):  # Пока проверку не остановили, проверяем связь с заданным периодом
+            latency = self.ping()  # Время ответа на Ping или None, если ответа нет
+            if latency is None:  # Если связь с QUIK зависла
+                self.put_notification('QUIK_PING_TIMEOUT', self.p.PingTimeout)  # Уведомляем торговую систему
+                logger.warning('QUIK не ответил на Ping за %s с', self.p.PingTimeout)
+                if self.p.AutoReconnect:  # Если нужно переподключиться
+                    self.reconnect()  # то переподключаемся к QUIK
+                continue  # События проверим после восстановления связи
+            self.ping_latencies.append(latency)
+            metrics.observe('quik_ping_seconds', latency)  # Время ответа на Ping для мониторинга
+            metrics.set('quik_ping_last_seconds', latency)
+            now = time.monotonic()  # Текущее время
+            for cmd, timeout in self.p.StallTimeouts.items():  # Пробегаемся по всем проверяемым событиям
+                age = now - self.provider.callback_times.get(cmd, start_time)  # Время без события
+                metrics.set('quik_callback_age_seconds', age, cmd=cmd)
+                if age > timeout and self.connected and cmd not in self.stalled:  # Если события давно не было, хотя QUIK подключен к серверу брокера
+                    self.stalled.add(cmd)  # Сообщаем о зависании один раз
+                    self.put_notification('QUIK_STREAM_STALL', cmd, age)  # Уведомляем торговую систему
+                    logger.warning('Нет события %s от QUIK %.0f с', cmd, age)
+                elif age <= timeout and cmd in self.stalled:  # Если события снова приходят
+                    self.stalled.discard(cmd)
+                    self.put_notification('QUIK_STREAM_RESUMED', cmd)  # Уведомляем торговую систему
+                    logger.info('События %s от QUIK снова приходят', cmd)
+
+    def ping(self):
+        """Время ответа QUIK на Ping в секундах или None, если QUIK не ответил за заданное время или ответил ошибкой"""
+        result = {}  # Результат Ping из отдельного потока
+        provider = self.provider  # Проверяем текущее подключение
+
+        def do_ping():
+            start_time = time.perf_counter()
+            try:
+                if provider.Ping()['data'] == 'Pong':  # Если QUIK правильно ответил
+                    result['latency'] = time.perf_counter() - start_time  # то запоминаем время ответа
+            except Exception:  # Если соединение закрыто или ответ не разобран
+                pass  # то ответа нет
+
+        thread = threading.Thread(target=do_ping, name='QKPing', daemon=True)  # Зависший запрос не должен останавливать проверку
+        thread.start()
+        thread.join(self.p.PingTimeout)  # Ждем ответ не дольше заданного времени
+        return result.get('latency')
+
+    def reconnect(self):
+        """Переподключение к QUIK с переносом обработчиков событий и восстановлением подписок"""
+        old_provider = self.provider  # Текущее подключение
+        try:
+            provider = QuikPy(host=self.p.Host, requests_port=self.p.RequestsPort, callbacks_port=self.p.CallbacksPort)  # Новое подключение
+        except OSError as e:  # Если QUIK недоступен
+            logger.warning('Не удалось переподключиться к QUIK: %s', e)  # то попробуем при следующей проверке
+            return
+        for name, handler in vars(old_provider).items():  # Пробегаемся по всем атрибутам старого подключения
+            if name.startswith('On'):  # Переносим обработчики событий
+                setattr(provider, name, provider.DefaultHandler if handler == old_provider.DefaultHandler else handler)  # Обработчик по умолчанию берем у нового подключения
+        provider.callback_times = dict(old_provider.callback_times)  # Время событий продолжаем отсчитывать
+        provider.metrics = old_provider.metrics
+        self.provider = provider  # Дальше работаем с новым подключением
+        try:
+            old_provider.CloseConnectionAndThread()  # Закрываем старое подключение. Зависшие запросы получат ошибку
+        except OSError:
+            pass
+        logger.info('Переподключение к QUIK выполнено')
+        self.put_notification('QUIK_RECONNECTED')  # Уведомляем торговую систему
+        self.on_connected(None)  # Проверяем и восстанавливаем подписки
+
     def on_connected(self, data):
         """Обработка событий подключения к QUIK"""
         dt = datetime.now(self.MarketTimeZone)  # Берем текущее время на бирже из локального
-        print(f'{dt.strftime("%d.%m.%Y %H:%M")}: QUIK Подключен')
+        logger.info('%s: QUIK Подключен', dt.strftime('%d.%m.%Y %H:%M'))
         self.connected = True  # QUIK подключен к серверу брокера
-        print(f'Проверка подписки тикеров ({len(self.subscribed_symbols)})')
-        for subscribed_symbol in self.subscribed_symbols:  # Пробегаемся по всем подписанным тикерам
-            class_code = subscribed_symbol['class']  # Код площадки
-            sec_code = subscribed_symbol['sec']  # Код тикера
-            interval = subscribed_symbol['interval']  # Временной интервал
-            print(f'{self.class_sec_code_to_data_name(class_code, sec_code)} на интервале {interval}', end=' ')
-            if not self.provider.IsSubscribed(class_code, sec_code, interval)['data']:  # Если нет подписки на тикер/интервал
-                self.provider.SubscribeToCandles(class_code, sec_code, interval)  # то переподписываемся
-                print('нет подписки. Отправлен запрос на новую подписку')
-            else:  # Если подписка была, то переподписываться не нужно
-                print('есть подписка')
+        for queues in list(self.bar_queues.values()):  # Пробегаемся по всем получателям баров по подписке
+            for bars in queues:
+                bars.append(None)  # Метка переподключения. По ней данные догрузят бары, закрывшиеся без связи
+        with self.subscriptions_lock:  # Пока восстанавливаем подписки, они не меняются
+            keys = list(self.subscriptions) + list(self.unsubscriptions)  # Подписки со ссылками и ждущие отмены действуют в QUIK
+            logger.info('Проверка подписок (%d)', len(keys))
+            for key in keys:  # Пробегаемся по всем подпискам
+                kind, class_code, sec_code, arg = key
+                subscription = f'{self.class_sec_code_to_data_name(class_code, sec_code)} {kind} {arg if arg is not None else ""}'  # Подписка для лога
+                if kind == 'candles' and self.provider.IsSubscribed(class_code, sec_code, arg)['data']:  # Если подписка на бары была
+                    logger.info('%s есть подписка', subscription)  # то переподписываться не нужно
+                    continue
+                if kind == 'level2' and self.provider.IsSubscribedLevel2Quotes(class_code, sec_code)['data']:  # Если подписка на стакан была
+                    logger.info('%s есть подписка', subscription)  # то переподписываться не нужно
+                    continue
+                self.subscribe_in_quik(key)  # Переподписываемся
+                logger.info('%s отправлен запрос на подписку', subscription)
 
     def on_disconnected(self, data):
         """Обработка событий отключения от QUIK"""
         if not self.connected:  # Если QUIK отключен от сервера брокера
             return  # то не нужно дублировать сообщение, выходим, дальше не продолжаем
         dt = datetime.now(self.MarketTimeZone)  # Берем текущее время на бирже из локального
-        print(f'{dt.strftime("%d.%m.%Y %H:%M")}: QUIK Отключен')
+        logger.info('%s: QUIK Отключен', dt.strftime('%d.%m.%Y %H:%M'))
         self.connected = False  # QUIK отключен от сервера брокера
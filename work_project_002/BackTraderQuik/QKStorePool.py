@@ -0,0 +1,74 @@
+import collections
+import itertools
+
+from BackTraderQuik import QKStore
+from BackTraderQuik.QKStore import MetaQKStore
+
+
+class QKStorePool:
+    """Пул хранилищ QUIK нескольких терминалов в одном процессе
+    Данные тикеров распределяются по подключенным терминалам с наименьшим кол-вом данных, запросы рыночных данных - по очереди
+    Брокер счета и его заявки закрепляются за терминалом, в котором открыт счет
+    """
+    def __init__(self, terminals, accounts=None):
+        """Инициализация
+
+        :param dict terminals: Терминалы. Словарь: Имя терминала -> Словарь параметров хранилища QKStore (Host, RequestsPort, CallbacksPort, ...)
+        :param dict accounts: Закрепление счетов за терминалами. Словарь: Счет (TradeAccountId) -> Имя терминала. Остальные счета - на первом терминале
+        """
+        if not terminals:  # Если не задан ни один терминал
+            raise ValueError('Не задан ни один терминал в параметре terminals')
+        self.terminals = terminals  # Параметры хранилищ по имени терминала
+        self.stores = collections.OrderedDict((name, QKStore(**params)) for name, params in terminals.items())  # Хранилища по имени терминала
+        for store in self.stores.values():  # Пробегаемся по всем хранилищам
+            store.pool = self  # Запросы рыночных данных от данных тикеров и брокеров хранилища (QKStore.market_request) отправляет пул
+        self.accounts = accounts or {}  # Терминалы по счету
+        for account, name in self.accounts.items():  # Пробегаемся по всем закрепленным счетам
+            if name not in self.stores:  # Если терминала счета нет
+                raise KeyError(f'Терминал {name} счета {account} не найден')
+        self.data_counts = {name: 0 for name in self.stores}  # Кол-во данных по имени терминала
+        self.market_names = itertools.cycle(self.stores)  # Очередь терминалов для запросов рыночных данных
+
+    def getdata(self, terminal=None, **kwargs):
+        """Данные тикера на заданном терминале или на подключенном терминале с наименьшим кол-вом данных"""
+        if terminal is None:  # Если терминал не задан
+            names = [name for name, store in self.stores.items() if store.connected] or list(self.stores)  # Подключенные терминалы. Если таких нет, то все
+            terminal = min(names, key=lambda name: self.data_counts[name])  # Терминал с наименьшим кол-вом данных
+        self.data_counts[terminal] += 1
+        return QKStore.getdata(**kwargs, **self.get_connection_params(terminal))
+
+    def getbroker(self, **kwargs):
+        """Брокер на терминале счета"""
+        terminal = self.get_account_terminal(kwargs.get('TradeAccountId'))  # Терминал счета брокера
+        return QKStore.getbroker(**kwargs, **self.get_connection_params(terminal))
+
+    def get_account_terminal(self, account):
+        """Имя терминала счета. Торговые запросы счета идут только через него"""
+        return self.accounts.get(account, next(iter(self.stores)))
+
+    def get_trading_store(self, account):
+        """Хранилище терминала счета"""
+        return self.stores[self.get_account_terminal(account)]
+
+    def get_market_store(self):
+        """Хранилище для запроса рыночных данных. Подключенные терминалы берутся по очереди"""
+        for _ in range(len(self.stores)):  # Пробуем каждый терминал не больше одного раза
+            store = self.stores[next(self.market_names)]  # Следующий терминал по очереди
+            if store.connected:  # Если терминал подключен к серверу брокера
+                return store  # то запрос отправляем на него
+        return self.stores[next(self.market_names)]  # Если подключенных терминалов нет, то берем следующий
+
+    def market_request(self, name, *args):
+        """Запрос рыночных данных (GetParamEx, GetQuoteLevel2, GetCandlesFromDataSource, ...) к следующему терминалу
+
+        :param str name: Имя функции QuikPy
+        :return: Ответ QUIK
+        """
+        return getattr(self.get_market_store().provider, name)(*args)
+
+    # Функции
+
+    def get_connection_params(self, terminal):
+        """Параметры подключения к терминалу"""
+        params = self.terminals[terminal]  # Параметры хранилища терминала
+        return {name: params[name] for name in MetaQKStore.connection_params if name in params}
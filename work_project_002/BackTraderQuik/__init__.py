@@ -1,3 +1,14 @@
 from .QKStore import *
 from .QKData import *  # Также подключает данные в хранилище
 from .QKBroker import *  # Также подключает брокера в хранилище
+from .QKMultiBroker import *  # Брокер для нескольких счетов
+from .QKPaperBroker import *  # Бумажный брокер по котировкам QUIK
+from .QKCheckpoint import *  # Контрольная точка торговой системы
+from .QKLogger import *  # Асинхронное логирование
+from .QKMetrics import *  # Метрики в формате Prometheus
+from .QKStorePool import *  # Пул хранилищ нескольких терминалов QUIK
+from .QKScanner import *  # Сканер многих тикеров
+from .QKBarStore import *  # Хранилище баров в двоичных файлах по колонкам
+from .QKDownloader import *  # Конвейерная загрузка истории многих тикеров
+from .QKContinuous import *  # Непрерывный фьючерс из хранилищ контрактов
+from .QKIntegrity import *  # Индекс целостности хранилища баров
@@ -0,0 +1,38 @@
+import os
+import socket
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # Папка проекта
+for path in (root, os.path.join(root, 'backtrader')):  # Проект и библиотека BackTrader из проекта
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from QuikPy.QuikStandIn import QuikStandIn  # Локальная замена QUIK
+from BackTraderQuik.QKStore import QKStore  # Хранилище QUIK
+
+
+def get_free_port():
+    """Свободный порт. Порты запросов и функций обратного вызова берутся отдельно"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def stand_in():
+    """Замена QUIK на свободных портах. Параметры подключения к ней в stand_in.connection
+
+    Хранилище QUIK на этих портах после проверки закрывается и удаляется, чтобы проверки не зависели друг от друга
+    """
+    quik = QuikStandIn(requests_port=get_free_port(), callbacks_port=get_free_port(), history=100)
+    quik.add_security('SPBFUT', 'SiZ3', min_price_step=1, scale=0, price=90000.0)
+    quik.connection = dict(RequestsPort=quik.requests_port, CallbacksPort=quik.callbacks_port)
+    quik.start()
+    yield quik
+    key = ('127.0.0.1', quik.requests_port, quik.callbacks_port)  # Ключ хранилища терминала
+    store = QKStore._stores.pop(key, None)
+    if store:  # Если хранилище создавалось
+        store.provider.CloseConnectionAndThread()  # то закрываем подключение к замене QUIK
+    quik.stop()
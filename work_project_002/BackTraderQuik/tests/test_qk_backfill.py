@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+import threading
+import time
+
+import backtrader as bt
+
+from BackTraderQuik.QKStore import QKStore  # Хранилище QUIK
+
+
+def get_server_time():
+    """Время сервера QUIK внутри торговой сессии буднего дня. Оно отстает от локального, как в замене QUIK"""
+    dt = (datetime.utcnow() + timedelta(hours=3) - timedelta(days=1)).replace(hour=12, minute=0, second=0, microsecond=0)
+    while dt.weekday() >= 5:  # Выходные пропускаем
+        dt -= timedelta(days=1)
+    return dt
+
+
+class BackfillStrategy(bt.Strategy):
+    """Бары и статус данных на каждом баре"""
+    params = (('bars', None),)  # Дата и время открытия бара, статус данных
+
+    def __init__(self):
+        self.status = None  # Последний статус данных
+
+    def notify_data(self, data, status, *args, **kwargs):
+        self.status = data._getstatusname(status)
+
+    def next(self):
+        self.p.bars.append((self.data.datetime.datetime(0), self.status))
+
+
+def test_reconnect(stand_in):
+    """Бары, закрывшиеся без связи, догружаются после переподключения по порядку со статусом DELAYED. Затем данные снова LIVE"""
+    stand_in.server_time = get_server_time()
+    bars = []
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(BackfillStrategy, bars=bars)
+    store = QKStore(**stand_in.connection)
+    cerebro.adddata(store.getdata(dataname='SPBFUT.SiZ3', timeframe=bt.TimeFrame.Minutes, compression=1, LiveBars=True, **stand_in.connection))
+
+    def wait_bars(count):
+        """Ожидание кол-ва обработанных баров"""
+        end = time.monotonic() + 10
+        while len(bars) < count and time.monotonic() < end:
+            time.sleep(0.01)
+        return len(bars)
+
+    def pusher():
+        try:
+            while not stand_in.subscriptions:  # Ждем подписку на новые бары
+                time.sleep(0.01)
+            history = len(bars)
+            stand_in.push_candles(1)  # Новый бар переводит данные в режим LIVE
+            wait_bars(history + 1)
+            stand_in.push_candles(1)
+            wait_bars(history + 2)
+            stand_in.push_candles(3, send=False)  # Связи нет. Бары только попадают в историю QUIK
+            stand_in.send_callback('OnConnected', '')  # Связь восстановлена
+            wait_bars(history + 5)
+            stand_in.push_candles(1)  # Новый бар по подписке
+            wait_bars(history + 6)
+        finally:
+            cerebro.runstop()
+
+    thread = threading.Thread(target=pusher, daemon=True)
+    thread.start()
+    cerebro.run()
+    thread.join()
+    live = bars[-6:]  # Бары по подписке и догруженные бары
+    assert [dt for dt, _ in live] == [live[0][0] + timedelta(minutes=i) for i in range(6)]  # Все бары по порядку без пропусков
+    assert [status for _, status in live] == ['LIVE', 'LIVE', 'DELAYED', 'DELAYED', 'DELAYED', 'LIVE']
+    assert stand_in.requests['get_candles_from_data_source'] == 2  # История и догрузка
+
+
+def test_session_gap(stand_in):
+    """Пропуск вне торговой сессии (ночь, выходные) не догружается"""
+    data = QKStore(**stand_in.connection).getdata(dataname='SPBFUT.SiZ3', timeframe=bt.TimeFrame.Minutes, compression=1, **stand_in.connection)
+    data.lastBarDt = datetime(2023, 11, 3, 23, 49)  # Последний бар пятницы
+    assert data.backfill(datetime(2023, 11, 6, 8, 50)) == 0  # Первый бар понедельника
+    data.lastBarDt = datetime(2023, 11, 6, 13, 59)  # Последний бар перед клирингом
+    assert data.backfill(datetime(2023, 11, 6, 14, 5)) == 0  # Первый бар после клиринга
+    assert 'get_candles_from_data_source' not in stand_in.requests  # QUIK не запрашивали
+    data.lastBarDt = datetime(2023, 11, 6, 10, 0)  # Пропуск внутри сессии
+    data.backfill(datetime(2023, 11, 6, 10, 5))
+    assert stand_in.requests['get_candles_from_data_source'] == 1
@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+
+from BackTraderQuik.QKBarStore import QKBarStore  # Хранилище баров
+
+
+def get_bars(count, start=0, shift=0.0):
+    """Минутные бары с ценами по номеру бара
+
+    :param int count: Кол-во баров
+    :param int start: Номер первого бара
+    :param float shift: Сдвиг цен
+    """
+    i = np.arange(start, start + count)
+    close = 100.0 + i + shift
+    return dict(datetime=np.datetime64('2023-11-01T10:00', 's') + i.astype('m8[m]'), open=close - 0.5, high=close + 1, low=close - 1, close=close, volume=(i + 1) * 10.0)
+
+
+def upsert(store, bars):
+    """Добавление/замена баров из словаря колонок"""
+    return store.upsert(bars['datetime'], bars['open'], bars['high'], bars['low'], bars['close'], bars['volume'])
+
+
+def read(store):
+    """Колонки хранилища в памяти"""
+    return {name: np.array(column) for name, column in store.read().items()}
+
+
+def test_tail_change(tmp_path):
+    """Бар посреди пересечения изменился. Перезаписывается только хвост с него, новые бары добавляются"""
+    store = QKBarStore(str(tmp_path / 'bars'))
+    assert upsert(store, get_bars(10)) == 10
+    new = get_bars(8, 5)  # Бары 5-12. Бары 5-9 уже есть
+    new['close'][2] += 1  # Бар 7 изменился
+    assert upsert(store, new) == 6  # Бары 7-12
+    assert upsert(store, new) == 0  # Повторно ничего не меняется
+    expected = get_bars(13)
+    expected['close'][7] += 1
+    bars = read(store)
+    for name, _ in QKBarStore.columns:
+        assert (bars[name] == expected[name]).all()
+
+
+def test_crash_truncation(tmp_path):
+    """Строки, дописанные в колонки без фиксации (сбой при записи), отбрасываются при открытии"""
+    path = str(tmp_path / 'bars')
+    store = QKBarStore(path)
+    upsert(store, get_bars(5))
+    for name, _ in QKBarStore.columns:  # Сбой после записи колонок до фиксации кол-ва строк
+        with open(store.get_column_file(name), 'ab') as f:
+            f.write(b'\0' * 24)
+    store = QKBarStore(path)
+    assert len(store) == 5
+    for name, dtype in QKBarStore.columns:
+        assert os.path.getsize(store.get_column_file(name)) == 5 * np.dtype(dtype).itemsize
+    assert upsert(store, get_bars(3, 5)) == 3
+    assert (read(store)['close'] == get_bars(8)['close']).all()
+
+
+def test_import_csv(tmp_path):
+    """Загрузка текстового файла 04_Bars.py"""
+    file_name = str(tmp_path / 'bars.txt')
+    with open(file_name, 'w', encoding='utf-8') as f:
+        f.write('datetime\topen\thigh\tlow\tclose\tvolume\n'
+                '01.11.2023 10:01\t100.5\t102.0\t100.0\t101.0\t20\n'
+                '01.11.2023 10:00\t99.5\t101.0\t99.0\t100.0\t10\n')  # Бары не по порядку
+    store = QKBarStore(str(tmp_path / 'bars'))
+    assert store.import_csv(file_name) == 2
+    bars = read(store)
+    assert (bars['datetime'] == np.array(['2023-11-01T10:00', '2023-11-01T10:01'], dtype='M8[s]')).all()
+    assert (bars['close'] == [100.0, 101.0]).all()
+    assert (bars['volume'] == [10.0, 20.0]).all()
+
+
+def test_export_csv(tmp_path):
+    """Если хранилище только дополнялось, то в выгрузку дописываются новые строки. Иначе файл переписывается"""
+    store = QKBarStore(str(tmp_path / 'bars'))
+    file_name, full_name = str(tmp_path / 'bars.txt'), str(tmp_path / 'full.txt')
+
+    def check():
+        """Выгрузка совпадает с выгрузкой заново"""
+        if os.path.isfile(full_name):
+            os.remove(full_name)
+        store.export_csv(full_name)
+        with open(file_name, encoding='utf-8') as f, open(full_name, encoding='utf-8') as full:
+            assert f.read() == full.read()
+
+    upsert(store, get_bars(5))
+    assert store.export_csv(file_name) == 5
+    assert store.export_csv(file_name) == 0  # Новых строк нет
+    upsert(store, get_bars(3, 5))
+    assert store.export_csv(file_name) == 3  # Дописываются только новые строки
+    check()
+    upsert(store, get_bars(2, 3, shift=0.25))  # Выгруженные строки перезаписаны
+    assert store.export_csv(file_name) == 8  # Файл переписывается
+    check()
+    with open(file_name, 'a', encoding='utf-8') as f:  # Файл изменили после выгрузки
+        f.write('\n')
+    upsert(store, get_bars(1, 8))
+    assert store.export_csv(file_name) == 9
+    check()
+    assert QKBarStore(store.path).exports[file_name][0] == 9  # Выгрузка запоминается в файле описания
@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import pandas as pd
+import backtrader as bt
+
+from BackTraderQuik.QKBroker import QKBroker  # Брокер QUIK
+
+
+def get_data():
+    """Данные тикера с одним баром. Заявкам нужны название тикера и дата/время"""
+    df = pd.DataFrame({'open': [90000.0], 'high': [90000.0], 'low': [90000.0], 'close': [90000.0], 'volume': [1], 'openinterest': [0]},
+                      index=[datetime(2023, 11, 1, 10)])
+    data = bt.feeds.PandasData(dataname=df, name='SPBFUT.SiZ3')
+    data.setenvironment(bt.Cerebro())  # Календарь и часовой пояс данные берут из Cerebro
+    data._start()
+    data.next()
+    return data
+
+
+def test_filled_before_reply(stand_in):
+    """Родительская заявка bracket исполнилась (OnTrade) до ответа на транзакцию (OnTransReply).
+    Дочерние заявки уже поставлены при исполнении. Заявка остается исполненной, стоп заявка в QUIK не ставится
+    """
+    stand_in.exchange_latency = 60  # Ответы на транзакции подаем сами
+    broker = QKBroker(use_positions=False, NativeBrackets=True, **stand_in.connection)
+    broker.start()
+    data = get_data()
+    parent = broker.buy(None, data, 1, price=90000.0, exectype=bt.Order.Limit, transmit=False)
+    broker.sell(None, data, 1, price=89000.0, exectype=bt.Order.Stop, parent=parent, transmit=False)
+    broker.sell(None, data, 1, price=91000.0, exectype=bt.Order.Limit, parent=parent, transmit=True)
+    assert len(stand_in.transactions) == 1  # Родительская заявка
+    broker.on_trade({'data': {'trade_num': 1, 'order_num': 1, 'class_code': 'SPBFUT', 'sec_code': 'SiZ3', 'qty': 1, 'price': 90000.0, 'flags': 0}})
+    assert parent.status == bt.Order.Completed
+    assert len(stand_in.transactions) == 3  # Дочерние заявки поставлены при исполнении родительской
+    broker.on_trans_reply({'data': {'trans_id': broker.get_trans_id(parent.ref), 'order_num': 1, 'status': 3, 'result_msg': 'Заявка зарегистрирована'}})
+    assert parent.status == bt.Order.Completed
+    assert len(stand_in.transactions) == 3
+    assert not parent.info.get('NativeBracket')
+    broker.stop()
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+import backtrader as bt
+
+from BackTraderQuik.QKCheckpoint import QKCheckpoint  # Контрольная точка торговой системы
+from BackTraderQuik.QKStore import QKStore  # Хранилище QUIK
+
+
+class CheckpointStrategy(bt.Strategy):
+    """Значения индикатора по барам большего интервала. Может остановиться посреди бара большего интервала"""
+    params = (
+        ('values', None),  # Значения по дате и времени бара: OHLCV и индикатор
+        ('stop_after', None),  # Кол-во баров, после которого останавливаемся внутри бара большего интервала. None - не останавливаемся
+    )
+
+    def __init__(self):
+        self.sma = bt.indicators.SMA(self.datas[1], period=3)
+
+    def next(self):
+        data = self.datas[1]
+        self.p.values[data.datetime[0]] = (data.open[0], data.high[0], data.low[0], data.close[0], data.volume[0], self.sma[0])
+        dt = self.datas[0].datetime.datetime(0)
+        if self.p.stop_after and len(self.datas[0]) >= self.p.stop_after and (dt.hour * 60 + dt.minute) % 240 == 60:  # Внутри бара 4 часа
+            self.env.runstop()
+
+
+def run(stand_in, values, checkpoint=None, stop_after=None):
+    """Прогон истории M15 с барами M240, которые строятся из нее"""
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(CheckpointStrategy, values=values, stop_after=stop_after)
+    if checkpoint:
+        cerebro.addanalyzer(QKCheckpoint, FileName=checkpoint)
+    store = QKStore(**stand_in.connection)
+    data = store.getdata(dataname='SPBFUT.SiZ3', timeframe=bt.TimeFrame.Minutes, compression=15, Checkpoint=checkpoint, **stand_in.connection)
+    cerebro.adddata(data)
+    cerebro.adddata(store.getdata(dataname='SPBFUT.SiZ3', timeframe=bt.TimeFrame.Minutes, compression=240, BaseData=data, **stand_in.connection))
+    cerebro.run()
+    del QKStore._stores[('127.0.0.1', stand_in.requests_port, stand_in.callbacks_port)]  # Хранилище закрыто. Следующий прогон - как новый запуск
+
+
+def test_derived_bar(stand_in, tmp_path):
+    """Торговая система останавливается посреди бара M240 и восстанавливается из контрольной точки.
+    Бары M240 и индикатор по ним совпадают с прогоном всей истории
+    """
+    stand_in.history = 200
+    stand_in.server_time = (datetime.utcnow() + timedelta(hours=3)).replace(second=0, microsecond=0)  # История до текущего времени МСК. По нему данные считают, сколько баров загрузить после контрольной точки
+    checkpoint = str(tmp_path / 'checkpoint.pkl')
+    full = {}
+    run(stand_in, full)
+    restored = {}
+    run(stand_in, restored, checkpoint, stop_after=100)
+    stop_dt = max(restored)  # Последний бар M240 до остановки
+    run(stand_in, restored, checkpoint)
+    assert max(restored) > stop_dt  # После восстановления были бары M240
+    assert restored == full
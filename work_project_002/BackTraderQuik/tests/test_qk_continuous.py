@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+
+from BackTraderQuik.QKBarStore import QKBarStore  # Хранилище баров
+from BackTraderQuik.QKContinuous import QKContinuous, get_roll  # Непрерывный фьючерс
+
+
+def get_bars(first, last, close, volume):
+    """Дневные бары контракта по рабочим дням
+
+    :param str first: Первый день
+    :param str last: Последний день
+    :param float close: Цена закрытия
+    :param volume: Объем. Число или функция дня
+    """
+    days = np.arange(np.datetime64(first, 'D'), np.datetime64(last, 'D') + 1)
+    days = days[np.is_busday(days)]
+    dt = days.astype('M8[s]') + np.timedelta64(10, 'h')
+    volumes = np.array([volume(day) if callable(volume) else volume for day in days], dtype=float)
+    closes = np.full(len(days), float(close))
+    return dict(datetime=dt, open=closes, high=closes + 1, low=closes - 1, close=closes.copy(), volume=volumes)
+
+
+def get_store(tmp_path, sec_code, bars):
+    """Хранилище контракта с папкой в формате QKBarStore.get_path"""
+    store = QKBarStore(QKBarStore.get_path(f'{tmp_path}{os.sep}', 'SPBFUT', sec_code, 'D', 1))
+    store.upsert(bars['datetime'], bars['open'], bars['high'], bars['low'], bars['close'], bars['volume'])
+    return store
+
+
+def current_bars():
+    """Декабрьский контракт. Объем падает с 1 декабря"""
+    return get_bars('2023-09-01', '2023-12-15', 100, lambda day: 1000 if day < np.datetime64('2023-12-01') else 100)
+
+
+def following_bars(cross=True):
+    """Мартовский контракт. Объем растет с 5 декабря, если cross, иначе всегда меньше объема декабрьского"""
+    return get_bars('2023-11-01', '2024-03-15', 110, lambda day: 2000 if cross and day >= np.datetime64('2023-12-05') else 10)
+
+
+def test_volume_roll():
+    """Переход на следующий день после дня, когда объем следующего контракта стал больше"""
+    start = current_bars()['datetime'][0]
+    roll_dt, gap, ratio = get_roll(current_bars(), following_bars(), start)
+    assert roll_dt == np.datetime64('2023-12-06T10:00', 's')
+    assert gap == 10.0 and ratio == 1.1
+    following = following_bars()
+    following = {name: column[following['datetime'] < np.datetime64('2023-12-05')] for name, column in following.items()}  # Следующий контракт до пересечения объемов
+    assert get_roll(current_bars(), following, start)[0] is None  # Пока текущий контракт торгуется, переходить рано
+
+
+def test_expiry_roll():
+    """Если объемы не пересеклись, то переход за days торговых дней до последнего дня текущего контракта"""
+    start = current_bars()['datetime'][0]
+    assert get_roll(current_bars(), following_bars(False), start)[0] == np.datetime64('2023-12-11T10:00', 's')
+    assert get_roll(current_bars(), following_bars(), start, 'date')[0] == np.datetime64('2023-12-11T10:00', 's')  # По дате объемы не важны
+    assert get_roll(current_bars(), following_bars(), start, days=10)[0] == np.datetime64('2023-12-04T10:00', 's')  # Раньше пересечения объемов
+
+
+def test_adjust(tmp_path):
+    """Цены прошлого контракта корректируются на разницу или отношение цен при переходе"""
+    stores = [get_store(tmp_path, 'VBZ3', current_bars()), get_store(tmp_path, 'VBH4', following_bars())]
+    roll_dt = np.datetime64('2023-12-06T10:00', 's')
+    for adjust, before in (('add', 110.0), ('ratio', 110.0), (None, 100.0)):
+        continuous = QKContinuous(str(tmp_path / f'VB_{adjust}'), adjust=adjust)
+        continuous.update(stores)
+        columns = continuous.read()
+        assert len(columns['datetime']) == np.searchsorted(current_bars()['datetime'], roll_dt) + len(following_bars()['datetime']) - np.searchsorted(following_bars()['datetime'], roll_dt)
+        assert np.allclose(columns['close'][columns['datetime'] < roll_dt], before)
+        assert np.all(columns['close'][columns['datetime'] >= roll_dt] == 110.0)
+    continuous = QKContinuous(str(tmp_path / 'VB_ratio'), adjust='ratio')
+    assert np.allclose(continuous.read()['high'][0], 101 * 1.1)  # Отношение применяется ко всем ценам
+
+
+def test_update(tmp_path):
+    """Новый контракт пересчитывает только хвост. Перезапись прошлых баров контракта тоже пересчитывает переходы"""
+    path = str(tmp_path / 'VB')
+    current = get_store(tmp_path, 'VBZ3', current_bars())
+    continuous = QKContinuous(path)
+    assert continuous.update([current]) == (1, len(current))
+    following = get_store(tmp_path, 'VBH4', following_bars())
+    rolls, written = continuous.update([current, following])
+    assert rolls == 1  # Пересчитан только переход на новый контракт
+    assert written == len(continuous)  # Отрезок единственного прошлого контракта зависит от нового, поэтому хранилище пишется заново
+    assert QKContinuous(path).update([current, following]) == (0, 0)  # Таблица переходов читается из файла, ничего не менялось
+
+    bars = get_bars('2024-02-01', '2024-06-14', 120, lambda day: 5000 if day >= np.datetime64('2024-03-05') else 1)
+    rows = np.searchsorted(continuous.read()['datetime'], np.datetime64('2023-12-06T10:00', 's'))  # Бары до перехода на мартовский контракт
+    continuous = QKContinuous(path)
+    latest = get_store(tmp_path, 'VBM4', bars)
+    rolls, written = continuous.update([current, following, latest])
+    assert rolls == 1
+    assert written == len(continuous) - rows  # Переписывается только хвост с отрезка мартовского контракта
+    assert continuous.read()['close'][-1] == 120.0
+    assert continuous.read()['close'][0] == 120.0  # Обе разницы цен при переходах
+
+    bars = following_bars()
+    bars['close'][bars['datetime'] < np.datetime64('2023-12-06')] = 115.0  # Перезапись баров до перехода. Кол-во и последний бар не меняются
+    following.upsert(bars['datetime'], bars['open'], bars['high'], bars['low'], bars['close'], bars['volume'])
+    rolls, _ = continuous.update([current, following, latest])
+    assert rolls == 2  # Переходы с измененного контракта
+    assert continuous.read()['close'][0] == 125.0  # Разница цен при переходе на мартовский контракт изменилась
@@ -0,0 +1,98 @@
+import time
+
+import numpy as np
+
+from QuikPy import QuikPy  # Подключение к QUIK
+from BackTraderQuik.QKBarStore import QKBarStore  # Хранилище баров
+from BackTraderQuik.QKDownloader import QKDownloader  # Конвейерная загрузка истории
+
+
+class RecordingSocket:
+    """Соединение для запросов, которое запоминает полученные фрагменты"""
+    def __init__(self, connection):
+        self.connection = connection  # Соединение QuikPy
+        self.fragments = []  # Полученные фрагменты
+
+    def sendall(self, data):
+        self.connection.sendall(data)
+
+    def recv(self, size):
+        fragment = self.connection.recv(size)
+        self.fragments.append(fragment)
+        return fragment
+
+    def close(self):
+        self.connection.close()
+
+
+def get_provider(stand_in):
+    """Подключение к замене QUIK с записью фрагментов ответов"""
+    provider = QuikPy(requests_port=stand_in.requests_port, callbacks_port=stand_in.callbacks_port)
+    provider.socket_requests = RecordingSocket(provider.socket_requests)
+    return provider
+
+
+def get_request(i, sec_code, interval=1):
+    """Запрос баров, как в QuikPy.GetCandlesFromDataSource"""
+    return {'data': f'SPBFUT|{sec_code}|{interval}|0', 'id': str(i), 'cmd': 'get_candles_from_data_source', 't': ''}
+
+
+def test_split_responses(stand_in):
+    """Ответы приходят частями в нескольких фрагментах. Конвейер собирает их по порядку запросов"""
+    stand_in.add_security('SPBFUT', 'RIZ3', price=110000.0)
+    provider = get_provider(stand_in)
+    try:
+        expected = [provider.GetCandlesFromDataSource('SPBFUT', sec_code, interval, 0)['data'] for sec_code, interval in (('SiZ3', 1), ('RIZ3', 1), ('SiZ3', 5))]
+        provider.buffer_size = 100  # Ответ не помещается во фрагмент
+        provider.socket_requests.fragments.clear()
+        responses = []
+        provider.process_requests([get_request(0, 'SiZ3'), get_request(1, 'RIZ3'), get_request(2, 'SiZ3', 5)], lambda request, response: responses.append((request['id'], response)), 2)
+        assert [response['id'] for _, response in responses] == ['0', '1', '2']
+        assert [response['data'] for _, response in responses] == expected
+        assert len(provider.socket_requests.fragments) > 10 * len(responses)  # Каждый ответ пришел многими фрагментами
+        assert provider.GetCandlesFromDataSource('SPBFUT', 'SiZ3', 1, 0)['data'] == expected[0]  # После конвейера соединение свободно
+    finally:
+        provider.CloseConnectionAndThread()
+
+
+def test_several_responses(stand_in):
+    """Несколько ответов приходят одним фрагментом"""
+    provider = get_provider(stand_in)
+    try:
+        responses = []
+
+        def handler(request, response):
+            if not responses:  # Пока обрабатываем первый ответ, замена QUIK отвечает на остальные запросы
+                time.sleep(0.2)
+            responses.append((request['id'], response['id'], response['data']))
+
+        provider.process_requests(({'data': 'Ping', 'id': str(i), 'cmd': 'ping', 't': ''} for i in range(8)), handler, 8)
+        assert responses == [(str(i), str(i), 'Pong') for i in range(8)]
+        assert any(fragment.count(b'\n') > 1 for fragment in provider.socket_requests.fragments)
+    finally:
+        provider.CloseConnectionAndThread()
+
+
+def test_pipeline(stand_in, tmp_path):
+    """Конвейер с пулом процессов разбора записывает те же бары, что и загрузка по очереди (workers=0)"""
+    stand_in.add_security('SPBFUT', 'RIZ3', price=110000.0)
+    stand_in.add_security('SPBFUT', 'BRZ3', price=80.0)
+    stand_in.history = 2000
+    provider = QuikPy(requests_port=stand_in.requests_port, callbacks_port=stand_in.callbacks_port)
+    try:
+        stores = {}  # Бары хранилищ по кол-ву процессов разбора
+        for workers in (0, 2):
+            datapath = str(tmp_path / f'workers{workers}') + '/'
+            downloader = QKDownloader(provider, datapath, in_flight=3, workers=workers, pending=1, progress=None)
+            downloader.add('SPBFUT', ('SiZ3', 'RIZ3', 'BRZ3'), 'M', 5)
+            downloader.add_from_m1('SPBFUT', ('SiZ3', 'RIZ3'), time_frames=(('M', 15, True), ('D', 1, True)))
+            stats = downloader.run()
+            assert stats['done'] == 5 and not stats['errors']
+            stores[workers] = {(sec_code, tf): {name: np.array(column) for name, column in QKBarStore(f'{datapath}SPBFUT.{sec_code}_{tf}').read().items()}
+                               for sec_code in ('SiZ3', 'RIZ3', 'BRZ3') for tf in ('M1', 'M5', 'M15', 'D1')}
+        for key, bars in stores[0].items():
+            for name, _ in QKBarStore.columns:
+                assert (bars[name] == stores[2][key][name]).all()
+        assert len(stores[2][('RIZ3', 'M15')]['datetime'])
+    finally:
+        provider.CloseConnectionAndThread()
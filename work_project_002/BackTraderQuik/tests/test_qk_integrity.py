@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+
+from BackTraderQuik.QKBarStore import QKBarStore  # Хранилище баров
+from BackTraderQuik.QKIntegrity import QKIntegrity, SESSIONS, get_expected, scan_bars  # Индекс целостности
+
+
+def get_day(day, skip=()):
+    """Минутные бары срочного рынка за день по календарю сессий
+
+    :param str day: День
+    :param skip: Пропущенные отрезки (первый, последний пропущенный бар) в виде строк ЧЧ:ММ
+    """
+    dt, _ = get_expected(day, day, 'M', 1, SESSIONS['SPBFUT'])
+    for first, last in skip:  # Пробегаемся по всем пропущенным отрезкам
+        dt = dt[(dt < np.datetime64(f'{day}T{first}', 's')) | (dt > np.datetime64(f'{day}T{last}', 's'))]
+    return dt
+
+
+def append(store, dt):
+    """Дописывание баров в конец хранилища без сортировки, как при записи другой программой"""
+    os.makedirs(store.path, exist_ok=True)
+    for name, dtype in QKBarStore.columns:  # Пробегаемся по всем колонкам
+        with open(store.get_column_file(name), 'ab') as f:
+            (np.asarray(dt, dtype='M8[s]') if name == 'datetime' else np.full(len(dt), 100.0)).astype(dtype).tofile(f)
+    store.commit(store.rows + len(dt))
+
+
+def full_scan(store):
+    """Индекс целостности, построенный заново"""
+    integrity = QKIntegrity(store)
+    integrity.index_file += '.full'  # Сохраненный индекс не читаем
+    return integrity.update()
+
+
+def test_scan_bars():
+    """Пропуски не короче min_gap внутри сессии, покрытие дней, повторы и нарушения порядка"""
+    dt = get_day('2023-11-01', (('11:00', '11:39'), ('12:00', '12:04')))  # Пропуск 40 минут и 5 минут без сделок
+    result = scan_bars(dt, 'M', 1, SESSIONS['SPBFUT'])
+    assert result['gaps'] == [['2023-11-01T11:00:00', '2023-11-01T11:39:00', 40]]
+    expected = len(get_day('2023-11-01'))
+    assert result['coverage'] == [['2023-11-01', expected - 45, expected, 0]]
+    assert not result['duplicates'] and not result['disorders']
+    dt = np.concatenate((dt[:3], dt[2:3], dt[:1], dt[3:], [np.datetime64('2023-11-04T10:00', 's')]))  # Повтор, нарушение порядка и бар в субботу
+    result = scan_bars(dt, 'M', 1, SESSIONS['SPBFUT'])
+    assert result['duplicates'] == [3] and result['disorders'] == [4]
+    assert result['coverage'][-1] == ['2023-11-04', 0, 0, 1]
+    assert result['gaps'][0] == ['2023-11-01T11:00:00', '2023-11-01T11:39:00', 40]
+
+
+def test_update(tmp_path):
+    """Дополнение хранилища пересчитывает индекс с последнего дня так же, как полный пересчет"""
+    store = QKBarStore(QKBarStore.get_path(f'{tmp_path}{os.sep}', 'SPBFUT', 'SiZ3', 'M', 1))
+    integrity = QKIntegrity(store)
+    append(store, get_day('2023-11-01')[:300])  # Не полный день
+    assert integrity.update()['gaps'] == []
+    append(store, np.concatenate((get_day('2023-11-01')[300:], get_day('2023-11-02', (('15:00', '15:59'),)))))
+    index = integrity.update()
+    assert index == full_scan(store)
+    assert integrity.get_missing() == [(np.datetime64('2023-11-02T15:00', 's'), np.datetime64('2023-11-02T15:59', 's'))]
+    assert integrity.get_missing(np.datetime64('2023-11-02T16:00', 's')) == []
+    assert integrity.is_valid()
+
+
+def test_update_disorders(tmp_path):
+    """Если в проверенных строках время не по порядку, то индекс пересчитывается полностью"""
+    store = QKBarStore(QKBarStore.get_path(f'{tmp_path}{os.sep}', 'SPBFUT', 'SiZ3', 'M', 1))
+    integrity = QKIntegrity(store)
+    append(store, np.concatenate((get_day('2023-11-02'), get_day('2023-11-01'))))  # Дни не по порядку
+    assert integrity.update()['disorders'] == [len(get_day('2023-11-02'))]
+    append(store, get_day('2023-11-03', (('10:00', '10:59'),)))
+    index = integrity.update()
+    assert index == full_scan(store)
+    assert not integrity.is_valid()
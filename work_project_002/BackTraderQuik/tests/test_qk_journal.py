@@ -0,0 +1,48 @@
+from backtrader import Order
+
+from BackTraderQuik.QKBroker import QKBroker  # Брокер QUIK
+from BackTraderQuik.QKJournal import QKJournal  # Журнал брокера
+
+
+def test_restore_and_cancel(stand_in, tmp_path):
+    """Заявка из журнала снимается после перезапуска. Снятие записывается в журнал, номер транзакции не теряется"""
+    filename = str(tmp_path / 'broker.jnl')
+    journal = QKJournal(filename)  # Журнал до перезапуска
+    journal.open()
+    journal.write('order', ref=7, dataname='SPBFUT.SiZ3', size=1, price=90000.0, exectype=Order.Limit, status=Order.Accepted, order_num=None)
+    journal.close()
+
+    broker = QKBroker(use_positions=False, Journal=filename, **stand_in.connection)
+    broker.start()
+    assert list(broker.journal_orders) == [7]  # Заявка восстановлена
+    assert broker.get_trans_id(1) == 8  # Номера транзакций новых заявок продолжают журнал
+    broker.on_trans_reply({'data': {'trans_id': 7, 'order_num': 1, 'status': 3, 'result_msg': 'Заявка снята'}})
+    assert not broker.journal_orders
+    broker.stop()
+
+    state = QKJournal(filename).load()  # Журнал после снятия заявки
+    assert not state['orders']
+    assert state['last_ref'] == 7
+
+
+
+def test_last_ref(tmp_path):
+    """Последний номер транзакции сохраняется при переписывании журнала, даже если он больше номеров активных заявок"""
+    filename = str(tmp_path / 'broker.jnl')
+    journal = QKJournal(filename)
+    journal.open()
+    journal.write('order', ref=3, dataname='SPBFUT.SiZ3', size=1, price=90000.0, exectype=Order.Limit, status=Order.Accepted, order_num=None)
+    journal.write('order', ref=5, dataname='SPBFUT.SiZ3', size=1, price=None, exectype=Order.Market, status=Order.Completed, order_num=2)
+    journal.close()
+    for _ in range(2):  # Журнал переписывается при каждом запуске брокера
+        state = QKJournal(filename).load()
+        assert list(state['orders']) == [3]
+        assert state['last_ref'] == 5
+        journal = QKJournal(filename)
+        journal.open(state)
+        journal.close()
+    state['last_ref'] = 3  # Последняя заявка еще активна
+    journal = QKJournal(filename)
+    journal.open(state)
+    journal.close()
+    assert list(QKJournal(filename).load()['orders']) == [3]
@@ -0,0 +1,85 @@
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from BackTraderQuik.QKMetrics import QKMetrics  # Реестр метрик
+
+
+chkrender = '''\
+# HELP qk_bars_total Bars
+# TYPE qk_bars_total counter
+qk_bars_total{dataname="TQBR.SBER"} 3
+# HELP qk_label Label
+# TYPE qk_label gauge
+qk_label{ticker="a\\\\b\\"c"} 1
+# HELP qk_loop_seconds Loop
+# TYPE qk_loop_seconds histogram
+qk_loop_seconds_bucket{le="0.0005"} 0
+qk_loop_seconds_bucket{le="0.001"} 0
+qk_loop_seconds_bucket{le="0.0025"} 1
+qk_loop_seconds_bucket{le="0.005"} 1
+qk_loop_seconds_bucket{le="0.01"} 1
+qk_loop_seconds_bucket{le="0.025"} 1
+qk_loop_seconds_bucket{le="0.05"} 1
+qk_loop_seconds_bucket{le="0.1"} 1
+qk_loop_seconds_bucket{le="0.25"} 1
+qk_loop_seconds_bucket{le="0.5"} 1
+qk_loop_seconds_bucket{le="1.0"} 2
+qk_loop_seconds_bucket{le="2.5"} 2
+qk_loop_seconds_bucket{le="5.0"} 2
+qk_loop_seconds_bucket{le="10.0"} 2
+qk_loop_seconds_bucket{le="+Inf"} 3
+qk_loop_seconds_sum 21.002
+qk_loop_seconds_count 3
+# TYPE qk_queue untyped
+qk_queue 7
+'''
+
+
+def getmetrics():
+    """Реестр со всеми типами метрик"""
+    metrics = QKMetrics()
+    metrics.describe('qk_bars_total', 'counter', 'Bars')
+    metrics.describe('qk_loop_seconds', 'histogram', 'Loop')
+    metrics.describe('qk_label', 'gauge', 'Label')
+
+    metrics.inc('qk_bars_total', dataname='TQBR.SBER')
+    metrics.inc('qk_bars_total', 2, dataname='TQBR.SBER')
+    for value in (0.002, 1.0, 20.0):  # Последнее значение больше всех границ корзин
+        metrics.observe('qk_loop_seconds', value)
+
+    metrics.set_function('qk_queue', lambda: 7)  # Без описания: untyped
+    metrics.set_function('qk_none', lambda: None)  # Не выводится
+    metrics.set_function('qk_error', lambda: 1 / 0)  # Не выводится
+    metrics.set('qk_label', 1, ticker='a\\b"c')
+    return metrics
+
+
+def test_render():
+    """Вывод метрик в текстовом формате Prometheus"""
+    metrics = getmetrics()
+    assert metrics.render() == chkrender
+
+
+def test_server():
+    """Метрики по HTTP. Сервер запускается один раз"""
+    metrics = getmetrics()
+    server = metrics.start_server(port=0)  # Свободный порт
+    try:
+        assert metrics.start_server(port=0) is server  # Второй сервер не запускается
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+        for path in ('/metrics', '/', '/metrics?x=1'):
+            with urlopen(url + path, timeout=10) as response:
+                assert response.status == 200
+                assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+                body = response.read().decode('utf-8')
+            assert body == chkrender
+        try:
+            urlopen(url + '/other', timeout=10)
+        except HTTPError as e:
+            assert e.code == 404
+        else:
+            assert False
+    finally:
+        metrics.stop_server()
+    assert metrics.server is None
+
@@ -0,0 +1,33 @@
+from backtrader import Order
+
+from BackTraderQuik.QKJournal import QKJournal  # Журнал брокера
+from BackTraderQuik.QKMultiBroker import QKMultiBroker  # Брокер QUIK для нескольких счетов
+
+
+def test_journal_orders(stand_in, tmp_path):
+    """Ответ по заявке, выставленной до перезапуска, передается брокеру счета, в журнале которого она есть"""
+    accounts = {}  # Счета со своими журналами
+    for name, ref in (('Stocks', 7), ('Futures', 9)):
+        filename = str(tmp_path / f'{name}.jnl')
+        journal = QKJournal(filename)
+        journal.open()
+        journal.write('order', ref=ref, dataname='SPBFUT.SiZ3', size=1, price=90000.0, exectype=Order.Limit, status=Order.Accepted, order_num=None)
+        journal.close()
+        accounts[name] = dict(TradeAccountId=name, Journal=filename)
+    broker = QKMultiBroker(Accounts=accounts, use_positions=False, **stand_in.connection)
+    broker.start()
+    broker.on_trans_reply({'data': {'trans_id': 9, 'order_num': 1, 'status': 3, 'result_msg': 'Заявка снята'}})
+    assert list(broker.brokers['Stocks'].journal_orders) == [7]
+    assert not broker.brokers['Futures'].journal_orders
+    broker.stop()
+    assert not QKJournal(accounts['Futures']['Journal']).load()['orders']
+
+
+def test_stop(stand_in):
+    """Остановка брокера одного счета не отключает запросы в QUIK брокерам остальных счетов терминала"""
+    broker = QKMultiBroker(Accounts={'Stocks': dict(TradeAccountId='Stocks'), 'Futures': dict(TradeAccountId='Futures')}, use_positions=False, **stand_in.connection)
+    broker.start()
+    broker.brokers['Stocks'].stop()
+    assert broker.store.BrokerCls
+    broker.brokers['Futures'].stop()
+    assert not broker.store.BrokerCls
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import pandas as pd
+import backtrader as bt
+
+from BackTraderQuik.QKPaperBroker import QKPaperBroker  # Бумажный брокер QUIK
+
+
+def get_data():
+    """Данные тикера с двумя барами. Встаем на первый бар"""
+    df = pd.DataFrame({'open': [90000.0, 90200.0], 'high': [90100.0, 90300.0], 'low': [89900.0, 90100.0], 'close': [90050.0, 90250.0], 'volume': [1, 1], 'openinterest': [0, 0]},
+                      index=[datetime(2023, 11, 1, 10), datetime(2023, 11, 1, 10, 1)])
+    data = bt.feeds.PandasData(dataname=df, name='SPBFUT.SiZ3')
+    data.setenvironment(bt.Cerebro())  # Календарь и часовой пояс данные берут из Cerebro
+    data._start()
+    data.next()
+    return data
+
+
+def get_order_book(*offers):
+    """Стакан по подписке с заданными предложениями (цена, кол-во в лотах)"""
+    return {'data': {'class_code': 'SPBFUT', 'sec_code': 'SiZ3', 'bid': [], 'offer': [{'price': str(price), 'quantity': str(qty)} for price, qty in offers]}}
+
+
+def test_history(stand_in):
+    """Пока данные не в режиме реального времени, заявка исполняется по бару. Котировки из QUIK не запрашиваются"""
+    broker = QKPaperBroker(**stand_in.connection)
+    broker.setcash(1000000)  # На фьючерс без гарантийного обеспечения хватает
+    broker.start()
+    data = get_data()
+    order = broker.buy(None, data, 1)
+    data.next()  # Рыночная заявка исполняется на следующем баре
+    broker.next()
+    assert order.status == bt.Order.Completed
+    assert order.executed.price == 90200.0  # Цена открытия бара
+    assert not stand_in.requests.get('getParamEx') and not stand_in.requests.get('Subscribe_Level_II_Quotes')
+    broker.stop()
+
+
+def test_level2_partial(stand_in):
+    """По стакану исполняется только кол-во, которое в нем есть. Остаток заявки ждет следующего стакана"""
+    broker = QKPaperBroker(Quotes='Level2', **stand_in.connection)
+    broker.setcash(1000000)  # На фьючерс без гарантийного обеспечения хватает
+    broker.start()
+    data = get_data()
+    data._laststatus = data.LIVE  # Данные в режиме реального времени
+    broker.subscribed.add(('SPBFUT', 'SiZ3'))  # Стакан приходит по подписке
+    broker.on_quote(get_order_book((90010, 2), (90020, 1)))
+    order = broker.buy(None, data, 5)
+    broker.next()
+    assert order.status == bt.Order.Partial
+    assert order.executed.size == 3
+    assert abs(order.executed.price - (2 * 90010 + 90020) / 3) < 1e-6
+    broker.next()  # Тот же стакан второй раз не забираем
+    assert order.executed.size == 3
+    broker.on_quote(get_order_book((90030, 4)))
+    broker.next()
+    assert order.status == bt.Order.Completed
+    assert order.executed.size == 5
+    broker.subscribed.clear()  # Подписки не было
+    broker.stop()
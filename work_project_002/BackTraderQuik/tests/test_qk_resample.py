@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from BackTraderQuik.QKBarStore import get_interval_open, resample_bars  # Границы интервалов и сборка баров
+
+datapath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Data')  # Бары из QUIK в папке Data проекта
+dataname = 'SPBFUT.VBZ3'
+chkframes = (('M5', 'M', 5), ('M15', 'M', 15), ('M30', 'M', 30), ('M60', 'M', 60), ('M120', 'M', 120), ('M240', 'M', 240), ('D1', 'D', 1))  # Бары того же фьючерса, собранные самим QUIK
+
+
+def getbars(name):
+    """Бары интервала из файла"""
+    df = pd.read_csv(os.path.join(datapath, f'{dataname}_{name}.txt'), sep='\t')
+    dt = pd.to_datetime(df.datetime, format='%d.%m.%Y %H:%M').values
+    return dict(datetime=dt.astype('M8[s]'), open=df.open.values, high=df.high.values, low=df.low.values, close=df.close.values,
+                volume=df.volume.values.astype(np.float64))
+
+
+def test_boundaries():
+    """Каждый бар QUIK открывается на границе своего интервала"""
+    for name, timeframe, compression in chkframes:
+        bars = getbars(name)
+        opens = get_interval_open(bars['datetime'], timeframe, compression)
+        assert (opens == bars['datetime']).all()
+
+
+def test_resample():
+    """Бары, собранные из M1, совпадают с барами QUIK
+    В выгруженной истории M1 нет части минут, которые были у QUIK при сборке баров. Поэтому собранный бар лежит внутри бара QUIK,
+    а при равных объемах (в M1 есть все сделки) бары совпадают
+    """
+    m1 = getbars('M1')
+    for name, timeframe, compression in chkframes[:-1]:  # В D1 нет полного дня
+        bars = getbars(name)
+        res = resample_bars(m1, timeframe, compression)
+        common = np.intersect1d(res['datetime'][1:-1], bars['datetime'])  # Первый и последний собранные бары могут быть неполными
+        ri = np.searchsorted(res['datetime'], common)
+        qi = np.searchsorted(bars['datetime'], common)
+        assert len(common)
+        assert (res['high'][ri] <= bars['high'][qi]).all()
+        assert (res['low'][ri] >= bars['low'][qi]).all()
+        assert (res['volume'][ri] <= bars['volume'][qi]).all()
+        full = res['volume'][ri] == bars['volume'][qi]  # В M1 есть все сделки бара
+        assert full.any()
+        for line in ('open', 'high', 'low', 'close'):
+            assert (res[line][ri][full] == bars[line][qi][full]).all()
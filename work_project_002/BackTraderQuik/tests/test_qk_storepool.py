@@ -0,0 +1,27 @@
+from QuikPy.QuikStandIn import QuikStandIn  # Локальная замена QUIK
+from BackTraderQuik.QKStore import QKStore  # Хранилище QUIK
+from BackTraderQuik.QKStorePool import QKStorePool  # Пул хранилищ нескольких терминалов QUIK
+
+from conftest import get_free_port
+
+
+def test_market_request(stand_in):
+    """Запросы рыночных данных хранилища из пула идут к терминалам пула по очереди. Отключенный терминал пропускается"""
+    reserve = QuikStandIn(requests_port=get_free_port(), callbacks_port=get_free_port(), history=100)  # Второй терминал
+    reserve.add_security('SPBFUT', 'SiZ3', min_price_step=1, scale=0, price=90000.0)
+    reserve.start()
+    try:
+        pool = QKStorePool({'main': stand_in.connection, 'reserve': dict(RequestsPort=reserve.requests_port, CallbacksPort=reserve.callbacks_port)})
+        store = pool.stores['main']
+        for _ in range(4):  # Запросы хранилища основного терминала
+            store.market_request('GetParamEx', 'SPBFUT', 'SiZ3', 'LAST')
+        assert stand_in.requests['getParamEx'] == reserve.requests['getParamEx'] == 2
+        pool.stores['reserve'].connected = False  # Резервный терминал отключился от сервера брокера
+        store.market_request('GetParamEx', 'SPBFUT', 'SiZ3', 'LAST')
+        store.market_request('GetParamEx', 'SPBFUT', 'SiZ3', 'LAST')
+        assert stand_in.requests['getParamEx'] == 4 and reserve.requests['getParamEx'] == 2
+    finally:
+        store = QKStore._stores.pop(('127.0.0.1', reserve.requests_port, reserve.callbacks_port), None)
+        if store:  # Если хранилище резервного терминала создавалось
+            store.provider.CloseConnectionAndThread()  # то закрываем подключение к замене QUIK
+        reserve.stop()
@@ -1,7 +1,9 @@
 from socket import socket, AF_INET, SOCK_STREAM  # Обращаться к LUA скриптам QuikSharp будем через соединения
-from threading import current_thread, Thread  # Результат работы функций обратного вызова будем получать в отдельном потоке
+from threading import current_thread, Thread, Lock  # Результат работы функций обратного вызова будем получать в отдельном потоке
 from json import loads  # Принимать данные в QUIK будем через JSON
+from collections import deque  # Очередь запросов конвейера без ответа
 from json.decoder import JSONDecodeError  # Ошибка декодирования JSON
+import time  # Время запросов и задержки функций обратного вызова для метрик
 
 
 # class Singleton(type):
@@ -54,6 +56,11 @@ class QuikPy:
                 except JSONDecodeError:  # Если разобрать не смогли (пришла не вся строка)
                     fragments.append(data)  # то, что не разобрали ставим в список фрагментов
                     break  # т.к. неполной может быть только последняя строка, то выходим из разбора функций обратного выходва
+                self.callback_times[data['cmd']] = time.monotonic()  # Время последней функции обратного вызова по ее имени. Для проверки зависания потоков событий
+                if self.metrics:  # Если собираем метрики
+                    self.metrics.inc('quik_callbacks_total', cmd=data['cmd'])  # Кол-во функций обратного вызова
+                    if isinstance(data.get('t'), (int, float)) and data['t'] > 0:  # Если QuikSharp передал время функции обратного вызова в мс
+                        self.metrics.observe('quik_callback_lag_seconds', time.time() - data['t'] / 1000, cmd=data['cmd'])  # Задержка от QUIK до Python
 
                 # Разбираем функцию обратного вызова QUIK LUA
                 if data['cmd'] == 'OnFirm':  # 1. Новая фирма
@@ -114,17 +121,71 @@ class QuikPy:
         """Отправляем запрос в QUIK, получаем ответ из QUIK"""
         # Issue 13. В QUIK некорректно отображаются русские буквы UTF8
         raw_data = f'{request}\r\n'.replace("'", '"').encode('cp1251')  # Переводим в кодировку Windows 1251
-        self.socket_requests.sendall(raw_data)  # Отправляем запрос в QUIK
-        fragments = []  # Гораздо быстрее получать ответ в виде списка фрагментов
-        while True:  # Пока фрагменты есть в буфере
-            fragment = self.socket_requests.recv(self.buffer_size)  # Читаем фрагмент из буфера
-            fragments.append(fragment.decode('cp1251'))  # Переводим фрагмент в Windows кодировку 1251, добавляем в список
-            if len(fragment) < self.buffer_size:  # Если в принятом фрагменте данных меньше чем размер буфера
-                data = ''.join(fragments)  # Собираем список фрагментов в строку
-                try:  # Бывает ситуация, когда данных приходит меньше, но это еще не конец данных
-                    return loads(data)  # Попробуем вернуть ответ в формате JSON в Windows кодировке 1251
-                except JSONDecodeError:  # Если это еще не конец данных
-                    pass  # то ждем фрагментов в буфере дальше
+        if self.metrics:  # Если собираем метрики
+            start_time = time.perf_counter()  # Время начала запроса
+            try:
+                return self.process_request_data(raw_data)
+            finally:
+                self.metrics.observe('quik_request_seconds', time.perf_counter() - start_time, cmd=request['cmd'])  # Время запроса с ожиданием блокировки
+        return self.process_request_data(raw_data)
+
+    def process_request_data(self, raw_data):
+        """Отправляем подготовленный запрос в QUIK, получаем ответ из QUIK"""
+        with self.requests_lock:  # Запросы могут идти из разных потоков (основного и обработки функций обратного вызова). Ответ должен прийти на свой запрос
+            self.socket_requests.sendall(raw_data)  # Отправляем запрос в QUIK
+            fragments = []  # Гораздо быстрее получать ответ в виде списка фрагментов
+            while True:  # Пока фрагменты есть в буфере
+                fragment = self.socket_requests.recv(self.buffer_size)  # Читаем фрагмент из буфера
+                fragments.append(fragment.decode('cp1251'))  # Переводим фрагмент в Windows кодировку 1251, добавляем в список
+                if len(fragment) < self.buffer_size:  # Если в принятом фрагменте данных меньше чем размер буфера
+                    data = ''.join(fragments)  # Собираем список фрагментов в строку
+                    try:  # Бывает ситуация, когда данных приходит меньше, но это еще не конец данных
+                        return loads(data)  # Попробуем вернуть ответ в формате JSON в Windows кодировке 1251
+                    except JSONDecodeError:  # Если это еще не конец данных
+                        pass  # то ждем фрагментов в буфере дальше
+
+    def process_requests(self, requests, handler, in_flight=4, decode=True):
+        """Конвейер запросов. В QUIK отправляется до in_flight запросов, не дожидаясь ответов. Пока QUIK готовит ответ на один запрос,
+        передаются и обрабатываются ответы на прошлые. QuikSharp отвечает строками в порядке запросов
+        Соединение занято до последнего ответа, поэтому запросы из других потоков ждут окончания конвейера
+
+        :param requests: Запросы (итератор). Следующий запрос берется, когда освобождается место в конвейере
+        :param handler: Обработчик ответа handler(request, response). Вызывается в текущем потоке. Если он ждет, то ждет и конвейер
+        :param int in_flight: Максимальное кол-во отправленных запросов без ответа
+        :param bool decode: Разбирать ответы JSON. False - обработчик получает строку ответа, чтобы разобрать ее в другом потоке/процессе
+        """
+        requests = iter(requests)  # Запросы берем по мере освобождения конвейера
+        sent = deque()  # Отправленные запросы без ответа и время их отправки
+        fragments = []  # Фрагменты ответа, который еще не пришел полностью
+        with self.requests_lock:  # Ответы не должны перемешаться с ответами на запросы из других потоков
+            while True:
+                while len(sent) < in_flight:  # Пока есть место в конвейере
+                    request = next(requests, None)  # Следующий запрос
+                    if request is None:  # Если запросов больше нет
+                        break  # то ждем ответов на отправленные
+                    self.socket_requests.sendall(f'{request}\r\n'.replace("'", '"').encode('cp1251'))
+                    sent.append((request, time.perf_counter()))
+                if not sent:  # Если ответы на все запросы получены
+                    return
+                while True:  # Пока строка ответа не пришла полностью
+                    fragment = self.socket_requests.recv(self.buffer_size)  # Читаем фрагмент из буфера
+                    if not fragment:  # Если соединение закрыто
+                        raise ConnectionError('Соединение с QUIK закрыто до получения ответов')
+                    end = fragment.find(b'\n')  # Конец строки ответа
+                    if end < 0:  # Если ответ еще не закончился
+                        fragments.append(fragment)
+                        continue
+                    fragments.append(fragment[:end])
+                    rest = fragment[end + 1:]  # В этом фрагменте могут быть начала следующих ответов
+                    lines = [b''.join(fragments)] + rest.split(b'\n')  # Полные ответы и начало следующего
+                    fragments = [lines.pop()]  # Начало ответа, который еще не пришел полностью
+                    break
+                for line in lines:  # Пробегаемся по всем полученным ответам
+                    request, start_time = sent.popleft()
+                    if self.metrics:  # Если собираем метрики
+                        self.metrics.observe('quik_request_seconds', time.perf_counter() - start_time, cmd=request['cmd'])  # Время от отправки до ответа
+                    response = line.decode('cp1251')  # Переводим ответ из Windows кодировки 1251
+                    handler(request, loads(response) if decode else response)
 
     # Инициализация и вход
 
@@ -164,6 +225,9 @@ class QuikPy:
         self.Host = host  # IP адрес или название хоста
         self.RequestsPort = requests_port  # Порт для отправки запросов и получения ответов
         self.CallbacksPort = callbacks_port  # Порт для функций обратного вызова
+        self.requests_lock = Lock()  # Блокировка соединения для запросов на время запроса/ответа
+        self.callback_times = {}  # Время последней функции обратного вызова по ее имени
+        self.metrics = None  # Реестр метрик с методами inc и observe (например, из BackTraderQuik). None - метрики не собираются
         self.socket_requests = socket(AF_INET, SOCK_STREAM)  # Создаем соединение для запросов
         self.socket_requests.connect((self.Host, self.RequestsPort))  # Открываем соединение для запросов
 
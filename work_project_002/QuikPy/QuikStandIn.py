@@ -0,0 +1,280 @@
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR  # QuikPy подключается к LUA скриптам QuikSharp через соединения
+from threading import Thread, Lock  # Соединения обслуживаются в отдельных потоках
+from json import loads, dumps  # Запросы и функции обратного вызова передаются в JSON
+from datetime import datetime, timedelta
+import random
+import time
+
+
+class QuikStandIn:
+    """Локальная замена терминала QUIK с LUA скриптами QuikSharp для проверок и замеров без терминала и брокера
+    Принимает запросы QuikPy по тому же протоколу (строки JSON в кодировке Windows 1251) и отправляет функции обратного вызова
+    История баров строится случайным блужданием цены. Новые бары по подпискам отправляются вызовом push_candles
+    Время сервера начинается с текущего времени МСК и сдвигается при каждой отправке новых баров
+    """
+    def __init__(self, host='127.0.0.1', requests_port=34130, callbacks_port=34131, history=500, latency=0.0, exchange_latency=0.005, seed=0, aggregate=False):
+        """Инициализация
+
+        :param str host: IP адрес, на котором принимаются соединения
+        :param int requests_port: Порт для запросов и ответов
+        :param int callbacks_port: Порт для функций обратного вызова
+        :param int history: Кол-во баров истории по каждому тикеру и интервалу
+        :param float latency: Задержка ответа на каждый запрос в секундах (имитация терминала)
+        :param float exchange_latency: Задержка ответа на транзакцию в секундах (имитация биржи)
+        :param int seed: Начальное значение случайных цен. Одинаковое значение дает одинаковую историю
+        :param bool aggregate: Бары всех интервалов строятся из минутных баров, как в QUIK. False - у каждого интервала своя история
+        """
+        self.host = host  # IP адрес
+        self.requests_port = requests_port  # Порт для запросов
+        self.callbacks_port = callbacks_port  # Порт для функций обратного вызова
+        self.history = history  # Кол-во баров истории
+        self.latency = latency  # Задержка ответа на запрос
+        self.exchange_latency = exchange_latency  # Задержка ответа на транзакцию
+        self.seed = seed  # Начальное значение случайных цен
+        self.aggregate = aggregate  # Бары интервалов строятся из минутных баров
+        self.sent = {}  # Последний отправленный бар подписок на интервалы, которые строятся из минутных баров
+        self.securities = {}  # Информация о тикерах по коду площадки и коду тикера
+        self.candles = {}  # Бары по коду площадки, коду тикера и интервалу
+        self.subscriptions = set()  # Подписки на бары: код площадки, код тикера, интервал
+        # Время сервера МСК (UTC+3) отстает от локального на сутки. Пока данные получают историю, они сверяются с локальным временем,
+        # поэтому первый бар по подписке считается последним баром прошлой сессии и переводит данные в режим реальной торговли.
+        # Дальше данные берут время из QUIK, а оно сдвигается вместе с новыми барами (push_candles)
+        self.server_time = (datetime.utcnow() + timedelta(hours=3) - timedelta(days=1)).replace(second=0, microsecond=0)
+        self.transactions = []  # Полученные транзакции и время их получения (time.perf_counter)
+        self.requests = {}  # Кол-во запросов по команде
+        self.order_num = 0  # Последний номер заявки на бирже
+        self.orders = {}  # Номера транзакций по номеру заявки на бирже
+        self.callbacks = []  # Соединения для функций обратного вызова
+        self.callbacks_lock = Lock()  # Блокировка отправки функций обратного вызова из разных потоков
+        self.sockets = []  # Слушающие соединения
+        self.running = False  # Замена QUIK работает
+
+    def add_security(self, class_code, sec_code, lot_size=1, min_price_step=0.01, scale=2, price=100.0):
+        """Добавление тикера
+
+        :param str class_code: Код площадки
+        :param str sec_code: Код тикера
+        :param int lot_size: Размер лота
+        :param float min_price_step: Минимальный шаг цены
+        :param int scale: Кол-во значащих цифр после запятой
+        :param float price: Начальная цена истории
+        """
+        self.securities[(class_code, sec_code)] = {'class_code': class_code, 'sec_code': sec_code, 'lot_size': lot_size,
+                                                   'min_price_step': min_price_step, 'scale': scale, 'price': price}
+
+    def start(self):
+        """Запуск приема соединений QuikPy"""
+        self.running = True
+        for port, target in ((self.requests_port, self.serve_requests), (self.callbacks_port, self.serve_callbacks)):  # Для запросов и функций обратного вызова
+            listener = socket(AF_INET, SOCK_STREAM)  # Слушающее соединение
+            listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)  # Порт можно занять сразу после прошлого запуска
+            listener.bind((self.host, port))
+            listener.listen()
+            self.sockets.append(listener)
+            Thread(target=self.accept, args=(listener, target), name=f'QuikStandIn{port}', daemon=True).start()
+        return self
+
+    def stop(self):
+        """Остановка. Соединения QuikPy закрываются"""
+        self.running = False
+        for connection in self.sockets + self.callbacks:  # Пробегаемся по всем соединениям
+            try:
+                connection.close()
+            except OSError:
+                pass
+        self.sockets = []
+        self.callbacks = []
+
+    def push_candles(self, minutes=1, send=True):
+        """Сдвиг времени сервера и отправка закрывшихся баров по всем подпискам
+
+        :param int minutes: Сдвиг времени в минутах
+        :param bool send: Отправлять бары по подписке. False - бары только попадают в историю (имитация потери связи)
+        :return: Кол-во закрывшихся баров
+        """
+        self.server_time += timedelta(minutes=minutes)
+        count = 0  # Кол-во закрывшихся баров
+        for class_code, sec_code, interval in sorted(self.subscriptions):  # Пробегаемся по всем подпискам
+            source = 1 if self.aggregate else interval  # Интервал, бары которого появляются
+            bars = self.get_candles(class_code, sec_code, source)  # Бары тикера
+            last_open = self.get_bar_open(source) - timedelta(minutes=source)  # Последний закрывшийся бар интервала
+            dt_open = self.get_bar_datetime(bars[-1]) + timedelta(minutes=source)  # Следующий бар
+            new_bars = []  # Закрывшиеся бары
+            while dt_open <= last_open:  # Пока есть закрывшиеся бары
+                new_bars.append(self.new_bar(bars[-1] if not new_bars else new_bars[-1], dt_open))
+                dt_open += timedelta(minutes=source)
+            bars.extend(new_bars)
+            if source != interval:  # Если подписка на интервал, который строится из минутных баров
+                last_sent = self.sent.get((class_code, sec_code, interval))  # Последний отправленный бар подписки
+                last_open = self.get_bar_open(interval) - timedelta(minutes=interval)  # Последний закрывшийся бар интервала
+                new_bars = [bar for bar in self.get_aggregated_candles(bars, interval) if
+                            (last_sent is None or self.get_bar_datetime(bar) > last_sent) and self.get_bar_datetime(bar) <= last_open]
+                if new_bars:  # Если бары интервала закрылись
+                    self.sent[(class_code, sec_code, interval)] = self.get_bar_datetime(new_bars[-1])
+            for bar in new_bars:  # Пробегаемся по всем закрывшимся барам
+                if send:  # Если бары отправляем
+                    self.send_callback('NewCandle', dict(bar, **{'class': class_code, 'sec': sec_code, 'interval': interval}))
+                count += 1
+        return count
+
+    def send_callback(self, cmd, data):
+        """Отправка функции обратного вызова всем подключенным QuikPy"""
+        raw_data = (dumps({'cmd': cmd, 'data': data, 't': time.time() * 1000}, ensure_ascii=False) + '\n').encode('cp1251')  # Время отправки в мс, как в QuikSharp
+        with self.callbacks_lock:
+            for connection in list(self.callbacks):  # Пробегаемся по всем соединениям
+                try:
+                    connection.sendall(raw_data)
+                except OSError:  # Если соединение закрыто
+                    self.callbacks.remove(connection)  # то больше в него не отправляем
+
+    # Функции
+
+    def accept(self, listener, target):
+        """Прием соединений"""
+        while self.running:
+            try:
+                connection, _ = listener.accept()
+            except OSError:  # Слушающее соединение закрыто
+                break
+            Thread(target=target, args=(connection,), daemon=True).start()
+
+    def serve_callbacks(self, connection):
+        """Соединение для функций обратного вызова. Функции отправляются из send_callback"""
+        with self.callbacks_lock:
+            self.callbacks.append(connection)
+
+    def serve_requests(self, connection):
+        """Соединение для запросов. На каждую строку запроса отправляется строка ответа"""
+        try:
+            for line in connection.makefile('rb'):  # Пробегаемся по всем строкам запросов
+                request = loads(line.decode('cp1251'))  # QuikPy передает запрос в виде строки словаря с двойными кавычками
+                self.requests[request['cmd']] = self.requests.get(request['cmd'], 0) + 1
+                if self.latency:  # Если задана задержка ответа
+                    time.sleep(self.latency)
+                response = {'cmd': request['cmd'], 'data': self.handle(request['cmd'], request['data']), 'id': request['id'], 't': time.time() * 1000}
+                connection.sendall((dumps(response, ensure_ascii=False) + '\n').encode('cp1251'))
+        except (OSError, ValueError):  # Соединение закрыто
+            pass
+
+    def handle(self, cmd, data):
+        """Ответ на запрос"""
+        args = data.split('|') if isinstance(data, str) else []  # Параметры запроса через разделитель
+        if cmd == 'ping':
+            return 'Pong'
+        if cmd == 'getClassesList':
+            return ','.join(sorted({class_code for class_code, _ in self.securities})) + ','
+        if cmd == 'getSecurityClass':
+            return next((class_code for class_code, sec_code in self.securities if sec_code == args[1]), '')
+        if cmd == 'getSecurityInfo':
+            security = self.securities.get((args[0], args[1]))
+            return {key: value for key, value in security.items() if key != 'price'} if security else None
+        if cmd == 'getInfoParam':
+            return self.server_time.strftime('%d.%m.%Y') if args[0] == 'TRADEDATE' else self.server_time.strftime('%H:%M:%S') if args[0] == 'SERVERTIME' else ''
+        if cmd == 'get_candles_from_data_source':
+            bars = self.get_candles(args[0], args[1], int(args[2]))
+            count = int(args[3])
+            return bars[-count:] if count else bars
+        if cmd == 'subscribe_to_candles':
+            self.subscriptions.add((args[0], args[1], int(args[2])))
+            return True
+        if cmd == 'unsubscribe_from_candles':
+            self.subscriptions.discard((args[0], args[1], int(args[2])))
+            return True
+        if cmd == 'is_subscribed':
+            return (args[0], args[1], int(args[2])) in self.subscriptions
+        if cmd == 'getParamEx':
+            bars = self.candles.get(next((key for key in self.candles if key[:2] == (args[0], args[1])), None))
+            return {'param_value': str(bars[-1]['close'] if bars else self.securities.get((args[0], args[1]), {}).get('price', 0))}
+        if cmd == 'getMoneyLimits':
+            return []
+        if cmd in ('getFuturesLimit', 'getFuturesClientLimits'):
+            return {'cbplimit': 1000000, 'varmargin': 0, 'accruedint': 0, 'cbplused': 0}
+        if cmd == 'getOrder_by_Number':
+            order_num = int(data)  # Номер заявки передается без разделителей
+            return {'order_num': order_num, 'trans_id': self.orders.get(order_num, 0)} if order_num in self.orders else order_num
+        if cmd == 'sendTransaction':
+            return self.on_transaction(data)
+        return ''
+
+    def on_transaction(self, transaction):
+        """Транзакция. Отвечаем регистрацией заявки. Рыночная заявка сразу исполняется по цене последнего бара"""
+        self.transactions.append((time.perf_counter(), transaction))  # Время получения для замеров задержки
+        self.order_num += 1
+        order_num = self.order_num  # Номер заявки на бирже
+        trans_id = int(transaction['TRANS_ID'])  # Номер транзакции
+        self.orders[order_num] = trans_id
+        Thread(target=self.reply_transaction, args=(transaction, trans_id, order_num), daemon=True).start()  # Ответ не задерживает обработку запросов
+        return True
+
+    def reply_transaction(self, transaction, trans_id, order_num):
+        """Ответ на транзакцию и сделка по рыночной заявке"""
+        time.sleep(self.exchange_latency)  # Ответ приходит с биржи, когда брокер уже получил результат отправки транзакции
+        self.send_callback('OnTransReply', {'trans_id': trans_id, 'order_num': order_num, 'status': 3, 'result_msg': 'Заявка зарегистрирована'})
+        if transaction.get('ACTION') == 'NEW_ORDER' and transaction.get('TYPE') == 'M':  # Если рыночная заявка
+            class_code, sec_code = transaction['CLASSCODE'], transaction['SECCODE']
+            bars = self.candles.get(next((key for key in self.candles if key[:2] == (class_code, sec_code)), None))
+            price = bars[-1]['close'] if bars else self.securities[(class_code, sec_code)]['price']  # Цена последнего бара
+            self.send_callback('OnTrade', {'trade_num': order_num, 'order_num': order_num, 'class_code': class_code, 'sec_code': sec_code,
+                                           'qty': int(transaction['QUANTITY']), 'price': price, 'flags': 4 if transaction['OPERATION'] == 'S' else 0})
+
+    def get_candles(self, class_code, sec_code, interval):
+        """Бары тикера. История строится при первом запросе"""
+        if self.aggregate and interval > 1:  # Если интервалы строятся из минутных баров
+            return self.get_aggregated_candles(self.get_candles(class_code, sec_code, 1), interval)
+        key = (class_code, sec_code, interval)
+        if key not in self.candles:  # Если истории еще нет
+            security = self.securities[(class_code, sec_code)]
+            rnd = random.Random(f'{self.seed}{class_code}{sec_code}{interval}')  # История тикера не зависит от порядка запросов
+            bar = {'close': security['price']}  # Бар, от закрытия которого строится следующий
+            dt_open = self.get_bar_open(interval)  # Открытие формируемого бара. Его в истории нет
+            bars = []
+            for i in range(self.history, 0, -1):  # Закрытые бары до текущего времени сервера
+                bar = self.new_bar(bar, dt_open - timedelta(minutes=interval * i), rnd)
+                bars.append(bar)
+            self.candles[key] = bars
+        return self.candles[key]
+
+    @staticmethod
+    def get_aggregated_candles(bars, interval):
+        """Бары интервала из минутных баров. Внутри дня границы считаются от начала дня, дни - по календарю, недели - с понедельника"""
+        aggregated = []  # Бары интервала
+        for bar in bars:  # Пробегаемся по всем минутным барам
+            dt = bar['datetime']
+            dt_open = datetime(dt['year'], dt['month'], dt['day'])  # Начало дня
+            if interval < 1440:  # Внутри дня
+                dt_open += timedelta(minutes=(dt['hour'] * 60 + dt['min']) // interval * interval)
+            elif interval == 10080:  # Неделя
+                dt_open -= timedelta(days=dt_open.weekday())
+            elif interval == 23200:  # Месяц
+                dt_open = dt_open.replace(day=1)
+            dt_json = {'year': dt_open.year, 'month': dt_open.month, 'day': dt_open.day, 'hour': dt_open.hour, 'min': dt_open.minute, 'sec': 0, 'ms': 0, 'week_day': dt_open.isoweekday() % 7}
+            last = aggregated[-1] if aggregated else None  # Формируемый бар
+            if last is None or last['datetime'] != dt_json:  # Если минутный бар открывает новый бар интервала
+                aggregated.append(dict(bar, datetime=dt_json))
+            else:  # Если минутный бар входит в формируемый бар
+                last['high'] = max(last['high'], bar['high'])
+                last['low'] = min(last['low'], bar['low'])
+                last['close'] = bar['close']
+                last['volume'] += bar['volume']
+        return aggregated
+
+    @staticmethod
+    def get_bar_datetime(bar):
+        """Дата и время открытия бара"""
+        dt = bar['datetime']
+        return datetime(dt['year'], dt['month'], dt['day'], dt['hour'], dt['min'])
+
+    def get_bar_open(self, interval):
+        """Открытие бара интервала, в который входит время сервера. Границы считаются от начала дня, как в QUIK"""
+        day = self.server_time.replace(hour=0, minute=0)  # Начало дня
+        return day + timedelta(minutes=(self.server_time.hour * 60 + self.server_time.minute) // interval * interval)
+
+    def new_bar(self, last_bar, dt, rnd=random):
+        """Следующий бар случайного блуждания цены"""
+        scale = 2  # Цены округляем до копеек
+        open_ = last_bar['close']
+        close = round(open_ * (1 + rnd.gauss(0, 0.002)), scale)
+        high = round(max(open_, close) * (1 + abs(rnd.gauss(0, 0.001))), scale)
+        low = round(min(open_, close) * (1 - abs(rnd.gauss(0, 0.001))), scale)
+        return {'open': open_, 'high': high, 'low': low, 'close': close, 'volume': rnd.randint(1, 1000),
+                'datetime': {'year': dt.year, 'month': dt.month, 'day': dt.day, 'hour': dt.hour, 'min': dt.minute, 'sec': 0, 'ms': 0, 'week_day': dt.isoweekday() % 7}}
@@ -21,10 +21,19 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+import array
 import datetime
 import collections
+import gc
 import itertools
 import multiprocessing
+import multiprocessing.util
+import os
+
+try:
+    from multiprocessing import shared_memory  # Python >= 3.8
+except ImportError:
+    shared_memory = None
 
 try:  # For new Python versions
     collectionsAbc = collections.abc  # collections.Iterable -> collections.abc.Iterable
@@ -57,6 +66,65 @@ class OptReturn(object):
             setattr(self, k, v)
 
 
+# State of an optimization worker process, set once by the pool initializer
+_optcerebro = None
+_optshm = None
+
+
+def _optinit(cerebro, shmname, sizes):
+    '''
+    Pool initializer for optimization worker processes. The cerebro arrives
+    once per worker and the preloaded datas (if any) are mapped from shared
+    memory instead of being pickled
+    '''
+    global _optcerebro, _optshm
+    _optcerebro = cerebro
+    if shmname is None:
+        return
+
+    _optshm = shared_memory.SharedMemory(name=shmname)
+    buf = _optshm.buf[:8 * sum(sizes)].cast('d').toreadonly()
+    offset = 0
+    for line, size in zip(cerebro._optlines(), sizes):
+        view = buf[offset:offset + size]
+        offset += size
+        if cerebro.p.optreturn:
+            line.array = view  # only read during the run, no copy needed
+        else:
+            # full strategies go back to the main process with their datas
+            line.array = array.array(str('d'))
+            line.array.frombytes(view.cast(str('B')))
+
+    # the mapping can only be closed once the lines no longer use it
+    multiprocessing.util.Finalize(None, _optclose, exitpriority=10)
+
+
+def _optclose():
+    '''Releases the datas of an optimization worker process at exit'''
+    global _optcerebro, _optshm
+    for line in _optcerebro._optlines():
+        line.array = array.array(str('d'))  # drop the views of the mapping
+
+    _optcerebro = None
+    gc.collect()
+    _optshm.close()
+    _optshm = None
+
+
+def _optrun(stratidx):
+    '''
+    Runs a single combination of strategies in an optimization worker
+    process. Only the indices in the optimization lists travel per task
+    '''
+    cerebro = _optcerebro
+    iterstrat = [strats[i] for strats, i in zip(cerebro.strats, stratidx)]
+    if cerebro.p.optdatas and cerebro._dopreload and cerebro._dorunonce:
+        for data in cerebro.datas:
+            data.home()  # datas were preloaded once, rewind for the next run
+
+    return cerebro(iterstrat)
+
+
 class Cerebro(with_metaclass(MetaParams, object)):
     '''Params:
 
@@ -86,6 +154,9 @@ class Cerebro(with_metaclass(MetaParams, object)):
 
          How many cores to use simultaneously for optimization
 
+         Each worker process receives the ``cerebro`` only once. Each task
+         carries only the indices of a combination of parameters
+
       - ``stdstats`` (default: ``True``)
 
         If True default Observers will be added: Broker (Cash and Value),
@@ -196,6 +267,10 @@ class Cerebro(with_metaclass(MetaParams, object)):
         The tests show an approximate ``20%`` speed-up moving from a sample
         execution in ``83`` seconds to ``66``
 
+        The preloaded lines are placed once in shared memory (Python >= 3.8)
+        and mapped by all worker processes, instead of being copied to each of
+        them
+
       - ``optreturn`` (default: ``True``)
 
         If ``True`` the optimization results will not be full ``Strategy``
@@ -214,6 +289,13 @@ class Cerebro(with_metaclass(MetaParams, object)):
         with ``optdatas`` the total gain increases to a total speed-up of
         ``32%`` in an optimization run.
 
+      - ``optchunksize`` (default: ``None``)
+
+        How many combinations of parameters are sent at once to a worker
+        process during optimization. ``None`` splits the combinations in
+        about 4 chunks per worker process, like ``multiprocessing.Pool.map``
+        does. Results are still returned in the order of the combinations
+
       - ``oldsync`` (default: ``False``)
 
         Starting with release 1.9.0.99 the synchronization of multiple datas
@@ -282,6 +364,7 @@ class Cerebro(with_metaclass(MetaParams, object)):
         ('exactbars', False),
         ('optdatas', True),
         ('optreturn', True),
+        ('optchunksize', None),
         ('objcache', False),
         ('live', False),
         ('writer', False),
@@ -1022,6 +1105,10 @@ class Cerebro(with_metaclass(MetaParams, object)):
             del(rv['runstrats'])
         return rv
 
+    def _optlines(self):
+        '''Line buffers of the datas, shared with optimization workers'''
+        return [line for data in self.datas for line in data.lines]
+
     def runstop(self):
         '''If invoked from inside a strategy or anywhere else, including other
         threads the execution will stop as soon as possible.'''
@@ -1124,6 +1211,10 @@ class Cerebro(with_metaclass(MetaParams, object)):
         if not self.strats:  # Datas are present, add a strategy
             self.addstrategy(Strategy)
 
+        if self._dooptimize:
+            # lists can be counted and indexed in the worker processes
+            self.strats = [list(strats) for strats in self.strats]
+
         iterstrats = itertools.product(*self.strats)
         if not self._dooptimize or self.p.maxcpus == 1:
             # If no optimmization is wished ... or 1 core is to be used
@@ -1135,7 +1226,8 @@ class Cerebro(with_metaclass(MetaParams, object)):
                     for cb in self.optcbs:
                         cb(runstrat)  # callback receives finished strategy
         else:
-            if self.p.optdatas and self._dopreload and self._dorunonce:
+            predata = self.p.optdatas and self._dopreload and self._dorunonce
+            if predata:
                 for data in self.datas:
                     data.reset()
                     if self._exactbars < 1:  # datas can be full length
@@ -1144,15 +1236,62 @@ class Cerebro(with_metaclass(MetaParams, object)):
                     if self._dopreload:
                         data.preload()
 
-            pool = multiprocessing.Pool(self.p.maxcpus or None)
-            for r in pool.imap(self, iterstrats):
-                self.runstrats.append(r)
-                for cb in self.optcbs:
-                    cb(r)  # callback receives finished strategy
-
-            pool.close()
-
-            if self.p.optdatas and self._dopreload and self._dorunonce:
+            lines, sizes, shm = [], [], None
+            if predata and shared_memory is not None:
+                # the preloaded lines are shared with the workers
+                lines = self._optlines()
+                sizes = [len(line.array) for line in lines]
+                shm = shared_memory.SharedMemory(create=True,
+                                                 size=max(8 * sum(sizes), 8))
+                buf = shm.buf[:8 * sum(sizes)].cast('d')
+                offset = 0
+                for line, size in zip(lines, sizes):
+                    buf[offset:offset + size] = line.array
+                    offset += size
+                buf.release()
+
+            # the workers get the cerebro once with the initializer (pickled
+            # or forked) and without the arrays which are in shared memory
+            arrays = [line.array for line in lines]
+            for line in lines:
+                line.array = array.array(str('d'))
+
+            maxcpus = self.p.maxcpus or os.cpu_count() or 1
+            try:
+                pool = multiprocessing.Pool(
+                    maxcpus, initializer=_optinit,
+                    initargs=(self, shm and shm.name, sizes))
+            finally:
+                for line, arr in zip(lines, arrays):
+                    line.array = arr
+
+            chunksize = self.p.optchunksize
+            if not chunksize:  # like multiprocessing.Pool.map
+                ntasks = 1
+                for strats in self.strats:
+                    ntasks *= len(strats)
+                chunksize, extra = divmod(ntasks, maxcpus * 4)
+                chunksize += bool(extra)
+
+            stratidxs = itertools.product(
+                *[range(len(strats)) for strats in self.strats])
+            try:
+                for r in pool.imap(_optrun, stratidxs, max(chunksize, 1)):
+                    self.runstrats.append(r)
+                    for cb in self.optcbs:
+                        cb(r)  # callback receives finished strategy
+
+                pool.close()
+            except BaseException:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+                if shm is not None:
+                    shm.close()
+                    shm.unlink()
+
+            if predata:
                 for data in self.datas:
                     data.stop()
 
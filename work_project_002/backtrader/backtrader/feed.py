@@ -23,9 +23,12 @@ from __future__ import (absolute_import, division, print_function,
 
 import collections
 import datetime
+import glob
+import hashlib
 import inspect
 import io
 import os.path
+import tempfile
 
 import backtrader as bt
 from backtrader import (date2num, num2date, time2num, TimeFrame, dataseries,
@@ -436,12 +439,64 @@ class AbstractDataBase(with_metaclass(MetaAbstractDataBase,
         return True
 
     def preload(self):
-        while self.load():
-            pass
+        if not self._bulkloadable() or not self._preloadbulk():
+            while self.load():
+                pass
 
         self._last()
         self.home()
 
+    def _preloadbulk(self):
+        '''Can be overriden by subclasses which can deliver all bars at once
+        as columns. They pass them to ``_bulkload`` and return ``True``.
+
+        Returning ``False`` loads the bars one by one with ``load``'''
+        return False
+
+    def _bulkloadable(self, filtered=False):
+        '''Returns ``True`` if appending whole columns to the lines gives the
+        same result as loading bar by bar: no filters and no stacked bars, no
+        input timezone to apply to each bar and unbounded line buffers
+
+        If ``filtered`` is ``True`` the columns have already gone through the
+        filters and timezone conversion and only the buffers are checked'''
+        if not filtered and (self._filters or self._barstack or
+                             self._barstash or self._tzinput):
+            return False
+
+        return all(line.mode == line.UnBounded and not line.bindings
+                   for line in self.lines)
+
+    def _bulkload(self, columns):
+        '''Appends whole columns of bars to the lines in a single operation
+        per line, as ``load`` would do bar by bar
+
+        ``columns`` maps line aliases to sequences of floats, ``datetime``
+        holding date numbers (see ``date2num_array``). Lines without a column
+        are filled with ``NaN``. Bars before ``fromdate`` are discarded and
+        loading stops at the first bar after ``todate``
+
+        Returns the number of appended bars
+        '''
+        import numpy as np  # keep the import very local
+
+        dt = np.asarray(columns['datetime'], dtype=np.float64)
+        past = np.flatnonzero(dt > self.todate)
+        end = past[0] if len(past) else len(dt)
+        mask = dt[:end] >= self.fromdate
+        size = int(np.count_nonzero(mask))
+
+        for lalias, line in zip(self.getlinealiases(), self.lines):
+            col = columns.get(lalias)
+            if col is None:
+                values = np.full(size, float('NaN'))
+            else:
+                values = np.asarray(col[:end], dtype=np.float64)[mask]
+
+            line.array.frombytes(np.ascontiguousarray(values).data.cast('B'))
+
+        return size
+
     def _last(self, datamaster=None):
         # Last chance for filters to deliver something
         ret = 0
@@ -659,10 +714,26 @@ class CSVDataBase(with_metaclass(MetaCSVDataBase, DataBase)):
 
     The return value of ``_loadline`` (True/False) will be the return value
     of ``_load`` which has been overriden by this base class
+
+    Params:
+
+      - ``cache`` (default: ``False``)
+
+        If ``True`` the preloaded lines (after ``fromdate``/``todate``,
+        timezone conversion and filters such as ``SessionFilter``) are saved
+        to a binary sidecar file next to the data file. Later preloads with
+        the same file and parameters map the sidecar and skip parsing. A
+        string is taken as the directory for the sidecars
+
+        The sidecar is keyed by the modification time and size of the file,
+        the parameters of the data and the class and parameters of its
+        filters. Files passed as objects and parameters which cannot be
+        keyed (objects other than numbers, strings, dates, timezones and
+        callables) disable the cache
     '''
 
     f = None
-    params = (('headers', True), ('separator', ','),)
+    params = (('headers', True), ('separator', ','), ('cache', False),)
 
     def start(self):
         super(CSVDataBase, self).start()
@@ -686,16 +757,98 @@ class CSVDataBase(with_metaclass(MetaCSVDataBase, DataBase)):
             self.f = None
 
     def preload(self):
-        while self.load():
-            pass
-
-        self._last()
-        self.home()
+        cachename = self._cachename()
+        if cachename is None or not self._loadcache(cachename):
+            super(CSVDataBase, self).preload()
+            if cachename is not None:
+                self._savecache(cachename)
 
         # preloaded - no need to keep the object around - breaks multip in 3.x
         self.f.close()
         self.f = None
 
+    def _cachename(self):
+        '''Returns the name of the sidecar for the current file and
+        parameters or ``None`` if the cache is not in use'''
+        if not self.p.cache or not isinstance(self.p.dataname, string_types):
+            return None
+
+        try:
+            # two feed classes with equal params may parse the file differently
+            key = [type(self).__module__ + '.' + type(self).__qualname__]
+            key.extend((k, _cachekey(v)) for k, v in self.p._getkwargs().items()
+                       if k not in ('name', 'cache'))
+            for ff, fargs, fkwargs in self._filters:
+                if isinstance(ff, SimpleFilterWrapper):
+                    ff, fargs, fkwargs = ff.ffilter, ff.args, ff.kwargs
+
+                fparams = ff.p._getkwargs() if hasattr(ff, 'p') else {}
+                key.append((_cachekey(ff if inspect.isfunction(ff)
+                                      else type(ff)),
+                            _cachekey(list(fparams.items())),
+                            _cachekey(list(fargs)),
+                            _cachekey(sorted(fkwargs.items()))))
+        except TypeError:
+            return None  # some parameter cannot be keyed
+
+        stat = os.stat(self.p.dataname)
+        pkey = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+        skey = '%x-%x' % (stat.st_mtime_ns, stat.st_size)
+
+        dirname, basename = os.path.split(os.path.abspath(self.p.dataname))
+        if isinstance(self.p.cache, string_types):
+            dirname = self.p.cache
+
+        return os.path.join(dirname, '%s.%s.%s.npy' % (basename, pkey, skey))
+
+    def _loadcache(self, cachename):
+        '''Appends the lines saved in the sidecar ``cachename``. Returns
+        ``False`` if there is no sidecar or it cannot be used'''
+        if not os.path.isfile(cachename) or not self._bulkloadable(True):
+            return False
+
+        import numpy as np  # keep the import very local
+        try:
+            bars = np.load(cachename, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return False  # partially written or damaged - parse again
+
+        # the bars went already through fromdate/todate and the filters
+        self._bulkload(dict((name, bars[name]) for name in bars.dtype.names))
+        self.home()
+        return True
+
+    def _savecache(self, cachename):
+        '''Saves the preloaded lines to the sidecar ``cachename`` and removes
+        the sidecars of previous versions of the file'''
+        import numpy as np  # keep the import very local
+
+        aliases = self.getlinealiases()
+        size = self.buflen()
+        bars = np.empty(size, dtype=[(a, np.float64) for a in aliases])
+        for lalias, line in zip(aliases, self.lines):
+            bars[lalias] = np.frombuffer(line.array, dtype=np.float64)[:size]
+
+        dirname, basename = os.path.split(cachename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        # write aside and rename: other processes may be reading the cache
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=dirname or None)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, bars)
+
+        os.replace(tmpname, cachename)
+
+        prefix = basename.rsplit('.', 2)[0]  # file name and parameters key
+        pattern = os.path.join(glob.escape(dirname), prefix + '.*.npy')
+        for name in glob.glob(pattern):
+            if name != cachename:
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass  # may be still in use (Windows), retry next time
+
     def _load(self):
         if self.f is None:
             return False
@@ -725,6 +878,24 @@ class CSVDataBase(with_metaclass(MetaCSVDataBase, DataBase)):
         return linetokens
 
 
+def _cachekey(value):
+    '''Returns a stable representation of a parameter value for the key of
+    the ``CSVDataBase`` cache. Raises ``TypeError`` if there is none'''
+    if value is None or isinstance(value, (bool, int, float, string_types,
+                                           datetime.date, datetime.time,
+                                           datetime.timedelta,
+                                           datetime.tzinfo)):
+        return repr(value)
+
+    if isinstance(value, (tuple, list)):
+        return tuple(_cachekey(v) for v in value)
+
+    if callable(value) and hasattr(value, '__qualname__'):
+        return '%s.%s' % (value.__module__, value.__qualname__)
+
+    raise TypeError('cannot key %r' % (value,))
+
+
 class CSVFeedBase(FeedBase):
     params = (('basepath', ''),) + CSVDataBase.params._gettuple()
 
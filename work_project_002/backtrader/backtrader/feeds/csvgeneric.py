@@ -25,10 +25,84 @@ from datetime import datetime
 import itertools
 
 from .. import feed, TimeFrame
-from ..utils import date2num
+from ..utils import date2num, date2num_array
 from ..utils.py3 import integer_types, string_types
 
 
+# strptime directives of fixed width: datetime64 unit, width, default
+_DTFIELDS = {
+    'Y': ('Y', 4, 1900), 'm': ('M', 2, 1), 'd': ('D', 2, 1),
+    'H': ('h', 2, 0), 'M': ('m', 2, 0), 'S': ('s', 2, 0),
+}
+
+
+def _strptime_array(strings, dtformat):
+    '''Vectorized ``datetime.strptime`` for formats made of the directives
+    in ``_DTFIELDS`` and literal characters, with zero padded values
+
+    Returns a ``datetime64[us]`` array or ``None`` if the format is not
+    supported or any string is not a valid date or would need the
+    flexibility of ``strptime`` (unpadded numbers, other whitespace, ...)
+    '''
+    import numpy as np  # keep the import very local
+
+    fields, literals, width = {}, [], 0
+    fmtchars = iter(dtformat)
+    for c in fmtchars:
+        if c == '%':
+            c = next(fmtchars, '')
+            if c in _DTFIELDS and _DTFIELDS[c][0] not in fields:
+                unit, size, default = _DTFIELDS[c]
+                fields[unit] = (width, size)
+                width += size
+                continue
+            elif c != '%':
+                return None  # directive of variable width or unsupported
+
+        literals.append((width, ord(c)))
+        width += 1
+
+    strings = np.asarray(strings)
+    if strings.dtype.kind != 'U' or \
+       (np.char.str_len(strings) != width).any():
+        return None
+
+    strings = strings.astype('U%d' % width)  # contiguous, exact width
+    codes = strings.view(np.uint32).reshape(len(strings), width)
+    for pos, code in literals:
+        if (codes[:, pos] != code).any():
+            return None
+
+    values = {}
+    for unit, size, default in _DTFIELDS.values():
+        if unit not in fields:
+            values[unit] = default
+            continue
+
+        pos, size = fields[unit]
+        digits = codes[:, pos:pos + size].astype(np.int64) - ord('0')
+        if ((digits < 0) | (digits > 9)).any():
+            return None
+
+        values[unit] = digits.dot(10 ** np.arange(size - 1, -1, -1))
+
+    if not (np.all(values['Y'] >= 1) and
+            np.all((values['M'] >= 1) & (values['M'] <= 12)) and
+            np.all(values['D'] >= 1) and np.all(values['h'] < 24) and
+            np.all(values['m'] < 60) and np.all(values['s'] < 60)):
+        return None
+
+    months = (values['Y'] - 1970) * 12 + values['M'] - 1
+    months = np.broadcast_to(months, strings.shape).astype('datetime64[M]')
+    days = months.astype('datetime64[D]') + (values['D'] - 1)
+    if (days.astype('datetime64[M]') != months).any():
+        return None  # day out of the month
+
+    secs = (values['h'] * 60 + values['m']) * 60 + values['s']
+    return days.astype('datetime64[us]') + \
+        np.asarray(secs * 1000000, dtype='timedelta64[us]')
+
+
 class GenericCSVData(feed.CSVDataBase):
     '''Parses a CSV file according to the order and field presence defined by the
     parameters
@@ -67,6 +141,12 @@ class GenericCSVData(feed.CSVDataBase):
       - ``tmformat``: Format used to parse the time CSV field if "present"
         (the default for the "time" CSV field is not to be present)
 
+    During ``preload`` the file is parsed column-wise with ``numpy`` if the
+    datetime format is made of the zero padded directives ``%Y``, ``%m``,
+    ``%d``, ``%H``, ``%M``, ``%S`` and all rows have the same number of
+    fields. Any other case (filters, ``tzinput``, callables, rows which need
+    the flexibility of ``strptime``) is parsed line by line
+
     '''
 
     params = (
@@ -100,6 +180,96 @@ class GenericCSVData(feed.CSVDataBase):
         else:  # assume callable
             self._dtconvert = self.p.dtformat
 
+    def _preloadbulk(self):
+        if not self._dtstr or not self.f.seekable():
+            return False
+
+        if self.p.timeframe >= TimeFrame.Days and self._tz is not None:
+            return False  # end of session is localized bar by bar
+
+        pos = self.f.tell()
+        columns = self._loadcolumns(self.f.read())
+        if columns is None:
+            self.f.seek(pos)  # let _loadline parse it (and raise errors)
+            return False
+
+        self._bulkload(columns)
+        return True
+
+    def _loadcolumns(self, text):
+        '''Parses the rest of the file column-wise as ``_loadline`` does
+        line by line. Returns the columns or ``None`` if it cannot be done'''
+        import numpy as np  # keep the import very local
+
+        lines = text.split('\n')
+        if lines[-1] == '':
+            lines.pop()  # the last line ends with a newline
+
+        if not lines:
+            return None
+
+        sep = self.separator
+        nfields = lines[0].count(sep) + 1
+        if (np.char.count(lines, sep) != nfields - 1).any():
+            return None  # rows of different lengths
+
+        tokens = np.array(sep.join(lines).split(sep))
+        tokens = tokens.reshape(len(lines), nfields)
+
+        csvidxs = (getattr(self.params, x) for x in
+                   itertools.chain(['time'], self.getlinealiases()))
+        if max(x for x in csvidxs if x is not None) >= nfields:
+            return None  # let _loadline fail on the missing field
+
+        dtfield = tokens[:, self.p.datetime]
+        dtformat = self.p.dtformat
+        if self.p.time >= 0:
+            # add time value and format if it's in a separate field
+            dtfield = np.char.add(np.char.add(dtfield, 'T'),
+                                  tokens[:, self.p.time])
+            dtformat += 'T' + self.p.tmformat
+
+        dts = _strptime_array(dtfield, dtformat)
+        if dts is None:
+            return None
+
+        dtnum = date2num_array(dts)
+        if self.p.timeframe >= TimeFrame.Days:
+            # use the expected end of session if larger than parsed
+            eos = self.p.sessionend
+            eos = ((eos.hour * 60 + eos.minute) * 60 + eos.second) * 1000000 \
+                + eos.microsecond
+            dteos = dts.astype('datetime64[D]') + np.timedelta64(eos, 'us')
+            dtnum = np.maximum(dtnum, date2num_array(dteos))
+
+        # only the bars within fromdate/todate need the values converted
+        past = np.flatnonzero(dtnum > self.todate)
+        end = past[0] if len(past) else len(dtnum)
+        inside = np.flatnonzero(dtnum[:end] >= self.fromdate)
+        tokens, dtnum = tokens[inside], dtnum[inside]
+
+        columns = {'datetime': dtnum}
+        nullvalue = float(float(self.p.nullvalue))
+        for linefield in (x for x in self.getlinealiases() if x != 'datetime'):
+            csvidx = getattr(self.params, linefield)
+
+            if csvidx is None or csvidx < 0:
+                # the field will not be present, assignt the "nullvalue"
+                columns[linefield] = np.full(len(dtnum), nullvalue)
+                continue
+
+            csvfield = tokens[:, csvidx]
+            empty = csvfield == ''
+            try:
+                values = np.where(empty, '0', csvfield).astype(np.float64)
+            except ValueError:
+                return None
+
+            values[empty] = nullvalue  # if empty ... assign the "nullvalue"
+            columns[linefield] = values
+
+        return columns
+
     def _loadline(self, linetokens):
         # Datetime needs special treatment
         dtfield = linetokens[self.p.datetime]
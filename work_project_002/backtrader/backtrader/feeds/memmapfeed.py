@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2015-2023 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import hashlib
+import os.path
+
+import backtrader as bt
+import backtrader.feed as feed
+
+__all__ = ('MemMapData', 'csv2memmap')
+
+NAN = float('NaN')
+
+
+class MemMapData(feed.DataBase):
+    '''
+    Reads bars from a binary file through a ``numpy.memmap``. Nothing is
+    parsed: during ``preload`` whole columns are appended to the lines at
+    once
+
+    The file is a ``numpy`` structured array saved with ``numpy.save``: one
+    record per bar with a ``float64`` field per line, named after the line
+    (``datetime`` holding the date number, ``open``, ``high``, ``low``,
+    ``close``, ``volume``, ``openinterest``). Lines missing in the file are
+    filled with ``NaN`` and extra fields are ignored. ``csv2memmap`` converts
+    any file which a data feed can already read
+
+    ``fromdate``/``todate``, filters and timezones work as with any other
+    feed. Bars are loaded one by one only if the lines need it (filters,
+    ``tzinput``, no preloading)
+
+    Specific parameters:
+
+      - ``dataname``: The filename of the binary file
+    '''
+
+    _bars = None
+
+    def start(self):
+        super(MemMapData, self).start()
+
+        import numpy as np  # keep the import very local
+        self._bars = np.load(self.p.dataname, mmap_mode='r')
+        self._fields = set(self._bars.dtype.names)
+        self._idx = -1
+
+    def stop(self):
+        super(MemMapData, self).stop()
+        self._bars = None
+
+    def preload(self):
+        super(MemMapData, self).preload()
+
+        # preloaded - no need to keep the mapping around
+        self._bars = None
+
+    def _preloadbulk(self):
+        self._bulkload(dict((name, self._bars[name]) for name in self._fields))
+        return True
+
+    def _load(self):
+        if self._bars is None:
+            return False
+
+        self._idx += 1
+        if self._idx >= len(self._bars):
+            return False
+
+        bar = self._bars[self._idx]
+        for lalias, line in zip(self.getlinealiases(), self.lines):
+            line[0] = float(bar[lalias]) if lalias in self._fields else NAN
+
+        return True
+
+
+def csv2memmap(dataname, filename=None, dataclass=None, force=False,
+               **kwargs):
+    '''Converts a data file to the binary format read by ``MemMapData``
+
+    The bars are loaded once with ``dataclass`` (default:
+    ``GenericCSVData``) and the given ``kwargs`` (``separator``,
+    ``dtformat``, ...) and the resulting lines are saved. Filters,
+    ``fromdate``/``todate`` and ``tzinput`` passed in ``kwargs`` are applied
+    before saving. The usual choice is to convert the whole file and filter
+    with the parameters of ``MemMapData``
+
+    Args:
+
+      - ``filename``: the binary file. Default: ``dataname`` with the
+        extension ``.npy``
+
+      - ``force``: convert even if ``filename`` is up to date
+
+    ``filename`` is up to date if it was converted from the same version of
+    ``dataname`` with the same ``dataclass`` and ``kwargs``. The key of the
+    conversion is kept next to it in ``filename`` + ``.key``
+
+    Returns the name of the binary file
+    '''
+    import numpy as np  # keep the import very local
+
+    if filename is None:
+        filename = os.path.splitext(dataname)[0] + '.npy'
+
+    dataclass = dataclass or bt.feeds.GenericCSVData
+    try:
+        key = [feed._cachekey(dataclass)]
+        key.extend((k, feed._cachekey(v)) for k, v in sorted(kwargs.items()))
+    except TypeError:
+        key = None  # some parameter cannot be keyed, always convert
+    else:
+        stat = os.stat(dataname)
+        key = '%s-%x-%x' % (
+            hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16],
+            stat.st_mtime_ns, stat.st_size)
+
+    keyname = filename + '.key'
+    if not force and key is not None and os.path.isfile(filename) and \
+       os.path.isfile(keyname):
+        with open(keyname) as f:
+            if f.read() == key:
+                return filename  # up to date
+
+    if os.path.isfile(keyname):
+        os.remove(keyname)  # the old key must not outlive a partial write
+
+    data = dataclass(dataname=dataname, **kwargs)
+    data.setenvironment(bt.Cerebro())  # the data has no owning cerebro
+    data._start()
+    data.preload()
+    data.stop()
+
+    aliases = data.getlinealiases()
+    size = data.buflen()
+    bars = np.empty(size, dtype=[(a, np.float64) for a in aliases])
+    for lalias, line in zip(aliases, data.lines):
+        bars[lalias] = np.frombuffer(line.array, dtype=np.float64)[:size]
+
+    with open(filename, 'wb') as f:  # np.save would add .npy to any name
+        np.save(f, bars)
+
+    if key is not None:
+        with open(keyname, 'w') as f:  # written last, marks a full conversion
+            f.write(key)
+
+    return filename
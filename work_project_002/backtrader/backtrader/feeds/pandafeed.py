@@ -24,6 +24,7 @@ from __future__ import (absolute_import, division, print_function,
 from backtrader.utils.py3 import filter, string_types, integer_types
 
 from backtrader import date2num
+from backtrader.utils import date2num_array
 import backtrader.feed as feed
 
 
@@ -131,6 +132,11 @@ class PandasData(feed.DataBase):
         - None: column not present
         - -1: autodetect
         - >= 0 or string: specific colum identifier
+
+      - During ``preload`` the datetimes are converted and the columns copied
+        to the lines in whole if they are numeric and the datetimes are of a
+        ``datetime64`` type (timezone aware ones are taken to UTC). Else and
+        with filters the rows are loaded one by one
     '''
 
     params = (
@@ -231,6 +237,46 @@ class PandasData(feed.DataBase):
 
             self._colmapping[k] = v
 
+    def _preloadbulk(self):
+        import numpy as np  # keep the import very local
+        import pandas as pd
+
+        df = self.p.dataname
+        coldtime = self._colmapping['datetime']
+        if coldtime is None:
+            tstamps = df.index  # standard index in the datetime
+        else:
+            tstamps = df.iloc[:, coldtime]
+
+        if not pd.api.types.is_datetime64_any_dtype(tstamps):
+            return False
+
+        tstamps = pd.DatetimeIndex(tstamps)
+        if tstamps.tz is not None:
+            tstamps = tstamps.tz_convert('UTC').tz_localize(None)
+
+        dts = tstamps.values
+        dtus = dts.astype('datetime64[us]')  # resolution of datetime
+        if np.isnat(dts).any() or (dtus != dts).any():
+            return False
+
+        columns = {'datetime': date2num_array(dtus)}
+        for datafield in self.getlinealiases():
+            colindex = self._colmapping[datafield]
+            if datafield == 'datetime' or colindex is None:
+                continue  # missing columns are left to NaN by _bulkload
+
+            col = df.iloc[:, colindex]
+            if col.dtype.kind not in 'biuf':
+                return False
+
+            columns[datafield] = col.to_numpy(dtype=np.float64,
+                                              na_value=np.nan)
+
+        self._bulkload(columns)
+        self._idx = len(df)  # all rows consumed
+        return True
+
     def _load(self):
         self._idx += 1
 
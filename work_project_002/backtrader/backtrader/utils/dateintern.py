@@ -227,6 +227,37 @@ def date2num(dt, tz=None):
     return base
 
 
+def date2num_array(dt):
+    """
+    Vectorized :func:`date2num` for naive (UTC-like) datetimes given as
+    anything ``numpy`` converts to ``datetime64``. Return value is a
+    ``numpy`` float array bit-for-bit equal to calling :func:`date2num` on
+    each value.
+
+    Within a power-of-two range of ordinals the rounding of ``date2num``
+    depends only on the time of the day, which is therefore computed once
+    with :func:`date2num` per distinct time of day and added to the ordinal
+    """
+    import numpy as np  # keep the import very local
+
+    dt = np.asarray(dt, dtype='datetime64[us]')
+    days = dt.astype('datetime64[D]')
+    ordinal = (days - np.datetime64('0001-01-01', 'D')).astype(np.int64) + 1
+    musecs = (dt - days).astype(np.int64)  # microseconds into the day
+    _, exp = np.frexp(ordinal.astype(np.float64))  # power-of-two range
+    keys, inverse = np.unique(musecs * 64 + exp, return_inverse=True)
+
+    fracs = np.empty(len(keys))
+    for i, key in enumerate(keys.tolist()):
+        musec, ex = divmod(key, 64)
+        base = 1 << (ex - 1)  # first ordinal in the range
+        dtime = (datetime.datetime.fromordinal(base) +
+                 datetime.timedelta(microseconds=musec))
+        fracs[i] = date2num(dtime) - base  # exact: same range
+
+    return ordinal.astype(np.float64) + fracs[inverse.reshape(ordinal.shape)]
+
+
 def time2num(tm):
     """
     Converts the hour/minute/second/microsecond part of tm (datetime.datetime
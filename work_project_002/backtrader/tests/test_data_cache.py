@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2015-2023 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import glob
+import os
+import shutil
+import tempfile
+
+import testcommon
+
+import backtrader as bt
+import backtrader.indicators as btind
+
+chkdatas = 1
+chkvals = [
+    ['4063.463000', '3644.444667', '3554.693333'],
+]
+
+chkmin = 30
+chkind = btind.SMA
+
+
+def getdata(cache, datacls=testcommon.DATAFEED):
+    datapath = os.path.join(testcommon.modpath, testcommon.dataspath,
+                            testcommon.datafiles[0])
+
+    return datacls(dataname=datapath,
+                   fromdate=testcommon.FROMDATE,
+                   todate=testcommon.TODATE,
+                   cache=cache)
+
+
+def test_run(main=False):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for i in range(2):  # parse and save, then load from the cache
+            datas = [getdata(tmpdir) for i in range(chkdatas)]
+            testcommon.runtest(datas,
+                               testcommon.TestStrategy,
+                               main=main,
+                               plot=main,
+                               chkind=chkind,
+                               chkmin=chkmin,
+                               chkvals=chkvals)
+
+            assert len(glob.glob(os.path.join(tmpdir, '*.npy'))) == 1
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_lines(main=False):
+    # cached lines are the same as the parsed ones, also with filters
+    tmpdir = tempfile.mkdtemp()
+    try:
+        for dofilter in (False, True):
+            loaded = []
+            for cache in (False, tmpdir, tmpdir):
+                data = getdata(cache)
+                if dofilter:
+                    data.addfilter(bt.filters.HeikinAshi)
+
+                data.setenvironment(bt.Cerebro())
+                data._start()
+                data.preload()
+                loaded.append([line.array for line in data.lines])
+
+            assert loaded[0] == loaded[1] == loaded[2]
+
+        # one sidecar per set of filters
+        assert len(glob.glob(os.path.join(tmpdir, '*.npy'))) == 2
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+class HalfData(testcommon.DATAFEED):
+    # same params as the parent, but parses the file differently
+    def _loadline(self, linetokens):
+        if not super(HalfData, self)._loadline(linetokens):
+            return False
+
+        self.lines.close[0] /= 2.0
+        return True
+
+
+def test_feedclass(main=False):
+    # feeds of different classes do not share a sidecar
+    tmpdir = tempfile.mkdtemp()
+    try:
+        closes = []
+        for datacls in (testcommon.DATAFEED, HalfData):
+            data = getdata(tmpdir, datacls)
+            data.setenvironment(bt.Cerebro())
+            data._start()
+            data.preload()
+            closes.append(data.lines.close.array[0])
+
+        assert closes[1] == closes[0] / 2.0
+        assert len(glob.glob(os.path.join(tmpdir, '*.npy'))) == 2
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    test_run(main=True)
+    test_lines(main=True)
+    test_feedclass(main=True)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2015-2023 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import io
+import math
+import os
+
+import testcommon
+
+import backtrader as bt
+import backtrader.indicators as btind
+
+chkdatas = 1
+chkvals = [
+    ['4063.463000', '3644.444667', '3554.693333'],
+]
+
+chkmin = 30
+chkind = btind.SMA
+
+
+def getdata(**kwargs):
+    datapath = os.path.join(testcommon.modpath, testcommon.dataspath,
+                            testcommon.datafiles[0])
+
+    kwargs.setdefault('dataname', datapath)
+    kwargs.setdefault('dtformat', '%Y-%m-%d')
+    kwargs.setdefault('timeframe', bt.TimeFrame.Days)
+    return bt.feeds.GenericCSVData(fromdate=testcommon.FROMDATE,
+                                   todate=testcommon.TODATE,
+                                   **kwargs)
+
+
+def preload(data, bulk):
+    if not bulk:
+        data._preloadbulk = lambda: False
+
+    data.setenvironment(bt.Cerebro())
+    data._start()
+    data.preload()
+    return [list(line.array) for line in data.lines]
+
+
+def sameloads(csv=None, **kwargs):
+    # parsing column-wise delivers the same lines as line by line
+    if csv is not None:
+        kwargs.update(name='csv', timeframe=bt.TimeFrame.Minutes)
+
+    loads = []
+    for bulk in (False, True):
+        if csv is not None:
+            kwargs['dataname'] = io.StringIO(csv)
+
+        loads.append(preload(getdata(**kwargs), bulk))
+
+    for bylines, bycols in zip(*loads):
+        assert len(bylines) == len(bycols)
+        for x, y in zip(bylines, bycols):
+            assert x == y or (math.isnan(x) and math.isnan(y))
+
+
+def test_run(main=False):
+    datas = [getdata() for i in range(chkdatas)]
+    testcommon.runtest(datas,
+                       testcommon.TestStrategy,
+                       main=main,
+                       plot=main,
+                       chkind=chkind,
+                       chkmin=chkmin,
+                       chkvals=chkvals)
+
+
+def test_lines(main=False):
+    sameloads()
+    sameloads(timeframe=bt.TimeFrame.Minutes)
+    sameloads(nullvalue=0.0, openinterest=-1)
+
+    # separated time field, empty fields and times out of fromdate/todate
+    csv = ('Date,Time,Open,High,Low,Close,Volume\n'
+           '2005-12-30,18:45:00,1,2,3,4,5\n'
+           '2006-01-02,10:00:05,1,2,,4,5\n'
+           '2006-01-02,10:01:05,1,2,3,4,\n'
+           '2007-01-02,10:00:00,1,2,3,4,5\n')
+    for nullvalue in (float('NaN'), -1.0):
+        sameloads(csv, time=1, open=2, high=3, low=4, close=5, volume=6,
+                  openinterest=-1, nullvalue=nullvalue)
+
+    # not zero padded: parsed line by line by strptime
+    csv = 'Date,Close\n2006-1-02,1\n2006-01-03,2\n'
+    sameloads(csv, open=-1, high=-1, low=-1, close=1, volume=-1,
+              openinterest=-1)
+
+
+if __name__ == '__main__':
+    test_run(main=True)
+    test_lines(main=True)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2015-2023 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import datetime
+import os
+import shutil
+import tempfile
+
+import testcommon
+
+import backtrader as bt
+import backtrader.indicators as btind
+
+chkdatas = 1
+chkvals = [
+    ['4063.463000', '3644.444667', '3554.693333'],
+]
+
+chkmin = 30
+chkind = btind.SMA
+
+
+def getdata(tmpdir):
+    datapath = os.path.join(testcommon.modpath, testcommon.dataspath,
+                            testcommon.datafiles[0])
+    filename = bt.feeds.csv2memmap(datapath,
+                                   os.path.join(tmpdir, 'data.npy'),
+                                   dataclass=testcommon.DATAFEED)
+
+    return bt.feeds.MemMapData(dataname=filename,
+                               fromdate=testcommon.FROMDATE,
+                               todate=testcommon.TODATE)
+
+
+def test_run(main=False):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        datas = [getdata(tmpdir) for i in range(chkdatas)]
+        testcommon.runtest(datas,
+                           testcommon.TestStrategy,
+                           main=main,
+                           plot=main,
+                           chkind=chkind,
+                           chkmin=chkmin,
+                           chkvals=chkvals)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_lines(main=False):
+    # preloaded lines are the same as those of the converted feed
+    tmpdir = tempfile.mkdtemp()
+    try:
+        csvdata = testcommon.getdata(0)
+        mmdata = getdata(tmpdir)
+        for data in (csvdata, mmdata):
+            data.setenvironment(bt.Cerebro())
+            data._start()
+            data.preload()
+
+        assert mmdata.buflen() == csvdata.buflen()
+        for mmline, csvline in zip(mmdata.lines, csvdata.lines):
+            assert mmline.array == csvline.array
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_convert(main=False):
+    # the binary file is converted again only if the kwargs change
+    tmpdir = tempfile.mkdtemp()
+    try:
+        datapath = os.path.join(testcommon.modpath, testcommon.dataspath,
+                                testcommon.datafiles[0])
+        filename = os.path.join(tmpdir, 'data.npy')
+        sizes = []
+        middate = datetime.datetime(2006, 7, 1)
+        for fromdate in (None, middate, middate):
+            kwargs = {} if fromdate is None else dict(fromdate=fromdate)
+            bt.feeds.csv2memmap(datapath, filename,
+                                dataclass=testcommon.DATAFEED, **kwargs)
+            sizes.append((os.path.getsize(filename),
+                          os.stat(filename).st_mtime_ns))
+
+        assert sizes[1][0] < sizes[0][0]  # fromdate applied, not stale bars
+        assert sizes[2] == sizes[1]  # same kwargs, not converted again
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    test_run(main=True)
+    test_lines(main=True)
+    test_convert(main=True)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2015-2023 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###############################################################################
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import testcommon
+
+import backtrader as bt
+import backtrader.indicators as btind
+
+chkdatas = 1
+chkvals = [
+    ['4063.463000', '3644.444667', '3554.693333'],
+]
+
+chkmin = 30
+chkind = btind.SMA
+
+
+def getframe():
+    datapath = os.path.join(testcommon.modpath, testcommon.dataspath,
+                            testcommon.datafiles[0])
+
+    return pd.read_csv(datapath, index_col=0, parse_dates=True)
+
+
+def getdata(df=None, **kwargs):
+    return bt.feeds.PandasData(dataname=getframe() if df is None else df,
+                               fromdate=testcommon.FROMDATE,
+                               todate=testcommon.TODATE,
+                               **kwargs)
+
+
+def preload(data, bulk):
+    if not bulk:
+        data._preloadbulk = lambda: False
+
+    data.setenvironment(bt.Cerebro())
+    data._start()
+    data.preload()
+    return [np.frombuffer(line.array) for line in data.lines]
+
+
+def sameloads(df, **kwargs):
+    # whole columns deliver the same lines as row by row
+    for byrows, bycols in zip(preload(getdata(df, **kwargs), False),
+                              preload(getdata(df, **kwargs), True)):
+        assert np.array_equal(byrows, bycols, equal_nan=True)
+
+
+def test_run(main=False):
+    datas = [getdata() for i in range(chkdatas)]
+    testcommon.runtest(datas,
+                       testcommon.TestStrategy,
+                       main=main,
+                       plot=main,
+                       chkind=chkind,
+                       chkmin=chkmin,
+                       chkvals=chkvals)
+
+
+def test_lines(main=False):
+    df = getframe()
+    df.iloc[10, 1] = np.nan
+    df.index += pd.Timedelta(hours=18, minutes=30)
+    sameloads(df)
+    sameloads(df, openinterest=None)
+    sameloads(df.reset_index(), datetime=0)
+    sameloads(df.tz_localize('Europe/Moscow'))
+
+
+if __name__ == '__main__':
+    test_run(main=True)
+    test_lines(main=True)
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; py-indent-offset:4 -*-
+###############################################################################
+#
+# Copyright (C) 2015-2023 Daniel Rodriguez
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import testcommon
+
+import backtrader as bt
+import backtrader.indicators as btind
+
+
+# optreturn=False pickles whole strategies. Their lines classes are looked up
+# by name in backtrader.lineseries, so the name must not clash with the
+# TestStrategy of other test modules
+class OptMPStrategy(bt.Strategy):
+    params = (
+        ('period', 15),
+    )
+
+    def __init__(self):
+        sma = btind.SMA(self.data, period=self.p.period)
+        self.cross = btind.CrossOver(self.data.close, sma)
+
+    def next(self):
+        if not self.position.size:
+            if self.cross > 0.0:
+                self.buy()
+
+        elif self.cross < 0.0:
+            self.close()
+
+
+def optimize(**kwargs):
+    cerebro = bt.Cerebro(**kwargs)
+    cerebro.adddata(testcommon.getdata(0))
+    cerebro.optstrategy(OptMPStrategy, period=range(5, 45))
+    cerebro.addanalyzer(bt.analyzers.TradeAnalyzer)
+    cerebro.addanalyzer(bt.analyzers.SQN)
+
+    results = list()
+    for stratlist in cerebro.run():
+        strat = stratlist[0]
+        results.append((strat.p.period,
+                        strat.analyzers.tradeanalyzer.get_analysis(),
+                        strat.analyzers.sqn.get_analysis()))
+
+    return results
+
+
+def test_run(main=False):
+    chkresults = optimize(maxcpus=1)
+    for kwargs in [dict(), dict(optchunksize=1), dict(optchunksize=100),
+                   dict(runonce=False), dict(optdatas=False),
+                   dict(optreturn=False)]:
+        results = optimize(maxcpus=2, **kwargs)
+        if main:
+            print(kwargs, results == chkresults)
+        else:
+            assert results == chkresults
+
+
+if __name__ == '__main__':
+    test_run(main=True)
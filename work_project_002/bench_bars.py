@@ -0,0 +1,80 @@
+import argparse
+from multiprocessing import Process, Event
+import os
+import shutil
+import tempfile
+
+from QuikPy import QuikPy  # Работа с QUIK из Python через LUA скрипты QuikSharp
+from QuikPy.QuikStandIn import QuikStandIn  # Локальная замена QUIK
+from BackTraderQuik.QKBarStore import QKBarStore  # Хранилище баров в двоичных файлах по колонкам
+from BackTraderQuik.QKDownloader import QKDownloader  # Конвейерная загрузка истории многих тикеров
+
+
+def serve(sec_codes, history, latency, port, ready, stop):
+    """Замена QUIK в отдельном процессе, как терминал. Ответы готовятся параллельно с разбором и записью"""
+    stand_in = QuikStandIn(requests_port=port, callbacks_port=port + 1, history=history, latency=latency, aggregate=True)  # Замена QUIK со своей историей
+    for i, sec_code in enumerate(sec_codes):
+        stand_in.add_security('TQBR', sec_code, price=100.0 + i)
+        stand_in.get_candles('TQBR', sec_code, 1)  # История строится заранее, чтобы не попасть в замер
+    stand_in.start()
+    ready.set()
+    stop.wait()
+    stand_in.stop()
+
+
+def run(symbols, history, latency, port, in_flight, workers, from_m1):
+    """Загрузка истории всех тикеров с локальной замены QUIK в новые хранилища
+
+    :return: Итоги загрузки QKDownloader.run и содержимое хранилищ для сверки
+    """
+    sec_codes = tuple(f'S{i:03d}' for i in range(symbols))  # Тикеры
+    ready, stop = Event(), Event()  # Замена QUIK запущена, замена QUIK больше не нужна
+    server = Process(target=serve, args=(sec_codes, history, latency, port, ready, stop), daemon=True)
+    server.start()
+    ready.wait()
+    qp_provider = QuikPy(requests_port=port, callbacks_port=port + 1)
+    datapath = os.path.join(tempfile.mkdtemp(prefix='bench_bars_'), '')  # Новые хранилища на каждый замер
+    try:
+        downloader = QKDownloader(qp_provider, datapath, in_flight, workers, export_csv=True, progress=None)
+        time_frames = (('D', 1, True), ('M', 60, False), ('M', 15, False), ('M', 5, False))  # Интервалы, которые загружаем
+        if from_m1:  # Если строим интервалы из минутных баров
+            downloader.add_from_m1('TQBR', sec_codes, time_frames)
+        else:  # Если получаем каждый интервал из QUIK
+            for time_frame, compression, four_price_doji in time_frames + (('M', 1, True),):
+                downloader.add('TQBR', sec_codes, time_frame, compression, four_price_doji=four_price_doji)
+        stats = downloader.run()
+        stores = {}  # Кол-во строк и последнее закрытие по хранилищам
+        for name in sorted(os.listdir(datapath)):
+            if os.path.isdir(os.path.join(datapath, name)):
+                store = QKBarStore(os.path.join(datapath, name))
+                stores[name] = (len(store), float(store.read()['close'][-1]))
+        return stats, stores
+    finally:
+        qp_provider.CloseConnectionAndThread()
+        stop.set()
+        server.join()
+        shutil.rmtree(datapath, ignore_errors=True)
+
+
+if __name__ == '__main__':  # Точка входа при запуске этого скрипта
+    parser = argparse.ArgumentParser(description='Загрузка истории многих тикеров по очереди и конвейером на локальной замене QUIK')
+    parser.add_argument('--symbols', type=int, default=40, help='Кол-во тикеров')
+    parser.add_argument('--history', type=int, default=20000, help='Кол-во минутных баров истории по тикеру')
+    parser.add_argument('--latency', type=float, default=0.1, help='Задержка ответа замены QUIK на каждый запрос в секундах')
+    parser.add_argument('--in-flight', type=int, nargs='+', default=[2, 4, 8], help='Кол-во запросов без ответа конвейера')
+    parser.add_argument('--workers', type=int, default=None, help='Кол-во процессов разбора конвейера. По умолчанию по кол-ву ядер')
+    parser.add_argument('--per-interval', action='store_true', help='Получать каждый интервал из QUIK. По умолчанию интервалы строятся из минутных баров')
+    parser.add_argument('--port', type=int, default=45130, help='Порт запросов замены QUIK. Порт функций обратного вызова на 1 больше')
+    args = parser.parse_args()
+    print(f'{"Режим":>24} {"Время, с":>10} {"Загрузок/с":>12} {"Баров/с":>12} {"МБ/с":>8} {"Ускорение":>10}')
+    baseline = None  # Время и хранилища загрузки по очереди
+    for i, (in_flight, workers) in enumerate([(1, 0)] + [(n, args.workers) for n in args.in_flight]):  # Сначала по очереди, затем конвейером
+        stats, stores = run(args.symbols, args.history, args.latency, args.port + 2 * i, in_flight, workers, not args.per_interval)
+        if baseline is None:
+            baseline = stats['seconds'], stores
+        mode = 'по очереди' if workers == 0 else f'конвейер, запросов {in_flight}'
+        notes = ' хранилища отличаются' if stores != baseline[1] else ''  # Конвейер должен записать те же бары
+        if stats['errors']:  # Если были ошибки загрузки
+            notes += f' ошибок {stats["errors"]}'
+        print(f'{mode:>24} {stats["seconds"]:>10.2f} {stats["done"] / stats["seconds"]:>12.1f} {stats["received"] / stats["seconds"]:>12.0f} '
+              f'{stats["bytes"] / stats["seconds"] / 1048576:>8.1f} {baseline[0] / stats["seconds"]:>9.1f}x{notes}')
@@ -0,0 +1,99 @@
+import argparse
+import statistics
+import threading
+import time
+
+import numpy as np
+import backtrader as bt
+from QuikPy.QuikStandIn import QuikStandIn  # Локальная замена QUIK
+from BackTraderQuik.QKStore import QKStore  # Хранилище QUIK
+from BackTraderQuik.QKLogger import start_logging  # Асинхронное логирование
+from scanner import MacdRsiStochScanner  # Сканер многих тикеров
+
+
+class BenchScanner(MacdRsiStochScanner):
+    """Сканер для замера. После расчета индикаторов по новым барам каждый раз отправляет заявку по одному из тикеров"""
+    params = (('done', None),)  # Функция, которую вызываем после обработки баров: кол-во баров входа, время обработки
+
+    def next_batch(self, updated):
+        super(BenchScanner, self).next_batch(updated)  # Полный расчет индикаторов и сигналов
+        fast = updated[updated % 2 == 0]  # Данные с новыми барами входа
+        if len(fast) and self.live[fast].all():  # Если бары пришли в режиме реальной торговли
+            self.buy(data=self.datas[fast[-1]], size=1)  # то отправляем заявку по последнему тикеру
+            self.p.done(len(fast), time.perf_counter())
+
+
+def run(symbols, rounds, port):
+    """Замер по заданному кол-ву тикеров
+
+    :return: Задержки от отправки баров до заявки и до обработки всех баров в секундах
+    """
+    stand_in = QuikStandIn(requests_port=port, callbacks_port=port + 1, history=300)  # Замена QUIK со своей историей
+    for i in range(symbols):  # Тикеры для сканера
+        stand_in.add_security('TQBR', f'S{i:03d}', price=100.0 + i)
+    stand_in.start()
+    counts = []  # Кол-во обработанных баров входа текущего раунда
+    round_done = threading.Event()  # Все бары раунда обработаны
+    times = []  # Время обработки последнего бара раунда
+
+    def done(count, t):
+        counts.append(count)
+        if sum(counts) >= symbols:  # Если обработаны бары по всем тикерам
+            times.append(t)
+            round_done.set()
+
+    cerebro = bt.Cerebro(stdstats=False)
+    cerebro.addstrategy(BenchScanner, done=done)
+    connection = dict(RequestsPort=port, CallbacksPort=port + 1)  # Подключение к замене QUIK. Хранилище одно на брокера и все данные
+    store = QKStore(**connection)
+    cerebro.setbroker(store.getbroker(use_positions=False, TradeAccountId='BENCH', IsFutures=True, **connection))
+    for i in range(symbols):  # Бары входа 1 минута и бары для MACD 4 минуты по подписке
+        for compression in (1, 4):
+            cerebro.adddata(store.getdata(dataname=f'TQBR.S{i:03d}', timeframe=bt.TimeFrame.Minutes, compression=compression, LiveBars=True, **connection))
+    push_times = []  # Время отправки баров по раундам
+    order_times = []  # Время получения первой заявки раунда заменой QUIK
+
+    def pusher():
+        while len(stand_in.subscriptions) < 2 * symbols:  # Ждем, пока все данные подпишутся на новые бары
+            time.sleep(0.01)
+        for i in range(rounds + 1):  # Первый раунд переводит данные в режим реальной торговли и не учитывается
+            counts.clear()
+            round_done.clear()
+            transactions = len(stand_in.transactions)  # Кол-во транзакций до раунда
+            push_times.append(time.perf_counter())
+            stand_in.push_candles(1)  # Новые бары по всем тикерам
+            if not round_done.wait(10):  # Если бары раунда не обработаны
+                break
+            while len(stand_in.transactions) == transactions:  # Ждем заявку раунда
+                time.sleep(0.0005)
+            order_times.append(stand_in.transactions[transactions][0])
+            time.sleep(0.05)  # Даем брокеру обработать ответы
+        cerebro.runstop()
+
+    thread = threading.Thread(target=pusher, daemon=True)
+    thread.start()
+    cerebro.run()
+    thread.join()
+    stand_in.stop()
+    order_latencies = [order - push for push, order in zip(push_times[1:], order_times[1:])]  # От отправки баров до заявки
+    batch_latencies = [done - push for push, done in zip(push_times[1:], times[1:])]  # От отправки баров до обработки всех баров
+    return order_latencies, batch_latencies
+
+
+if __name__ == '__main__':  # Точка входа при запуске этого скрипта
+    parser = argparse.ArgumentParser(description='Задержка от нового бара до заявки сканера в зависимости от кол-ва тикеров на локальной замене QUIK')
+    parser.add_argument('--symbols', type=int, nargs='+', default=[1, 10, 40, 100], help='Кол-во тикеров')
+    parser.add_argument('--rounds', type=int, default=30, help='Кол-во новых баров на каждое кол-во тикеров')
+    parser.add_argument('--port', type=int, default=44130, help='Порт запросов замены QUIK. Порт функций обратного вызова на 1 больше')
+    args = parser.parse_args()
+    start_logging(level=30)  # Только предупреждения и ошибки
+    print(f'{"Тикеров":>8} {"До заявки, мс (медиана / 95%)":>32} {"Все бары, мс (медиана / 95%)":>32} {"На тикер, мкс":>14}')
+    for i, symbols in enumerate(args.symbols):  # Пробегаемся по всем кол-вам тикеров
+        order_latencies, batch_latencies = run(symbols, args.rounds, args.port + 2 * i)  # Для каждого замера свое подключение
+        if not order_latencies:  # Если замер не удался
+            print(f'{symbols:>8} замер не удался')
+            continue
+        order_ms = np.array(order_latencies) * 1000
+        batch_ms = np.array(batch_latencies) * 1000
+        print(f'{symbols:>8} {statistics.median(order_ms):>18.2f} / {np.percentile(order_ms, 95):>10.2f} '
+              f'{statistics.median(batch_ms):>18.2f} / {np.percentile(batch_ms, 95):>10.2f} {statistics.median(batch_ms) * 1000 / symbols:>14.1f}')
@@ -110,11 +110,14 @@ class MacdRsiStochStrategy(bt.Strategy):
 if __name__ == '__main__':  # Точка входа при запуске этого скрипта
     cerebro = bt.Cerebro()  # Инициируем "движок" BT
     cerebro.addstrategy(MacdRsiStochStrategy)  # Привязываем торговую систему с параметрами
-    data = bt.feeds.GenericCSVData(
-        dataname='Data\\SPBFUT.VBZ3_M15.txt',  # Файл для импорта
+    datafile = bt.feeds.csv2memmap(  # Двоичный файл баров. Пересоздается только при изменении текстового файла
+        'Data\\SPBFUT.VBZ3_M15.txt',  # Файл для импорта
         separator='\t',  # Колонки разделены табуляцией
         dtformat='%d.%m.%Y %H:%M',  # Формат даты/времени DD.MM.YYYY HH:MI
         openinterest=-1,  # Открытого интереса в файле нет
+        timeframe=bt.TimeFrame.Minutes)
+    data = bt.feeds.MemMapData(  # Бары читаются из двоичного файла без разбора текста
+        dataname=datafile,  # Двоичный файл
         fromdate=datetime(2023, 9, 15),  # Начальная дата приема исторических данных (Входит)
         todate=datetime(2023, 11, 14),  # Конечная дата приема исторических данных (Не входит)
         timeframe=bt.TimeFrame.Minutes,
@@ -0,0 +1,103 @@
+from datetime import datetime, time
+import logging
+
+import numpy as np
+import backtrader as bt
+from BackTraderQuik.QKStore import QKStore  # Хранилище QUIK
+from BackTraderQuik.QKScanner import QKScanner, BatchMACD, BatchRSI, BatchStochastic  # Сканер многих тикеров
+from BackTraderQuik.QKLogger import start_logging  # Асинхронное логирование
+from trader import MacdRsiStochStrategy  # Торговая система по одному тикеру
+
+logger = logging.getLogger('scanner')  # Лог сканера
+
+
+class MacdRsiStochScanner(QKScanner):
+    """Система MacdRsiStochStrategy по многим тикерам в одном процессе
+    Данные добавляются парами по каждому тикеру: бары входа (15 минут) и бары для MACD (4 часа)
+    Индикаторы всех тикеров считаются по массивам и только по тикерам с новыми барами
+    """
+    params = tuple(MacdRsiStochStrategy.params._getitems())  # Параметры как у системы по одному тикеру
+
+    def __init__(self):
+        """Инициализация торговой системы"""
+        super(MacdRsiStochScanner, self).__init__()
+        n = len(self.datas) // 2  # Кол-во тикеров
+        self.stoch = BatchStochastic(n, self.p.k_period, self.p.d_period)  # Stochastic Oscillator по барам входа
+        self.rsi = BatchRSI(n, self.p.rsiperiod)  # RSI по барам входа
+        self.macd = BatchMACD(n, self.p.macd_2_1, self.p.macd_2_2, self.p.macdsig_2_1)  # MACD по барам большего интервала
+
+    def next_batch(self, updated):
+        """Новые бары по тикерам"""
+        rows = updated[updated % 2 == 1] // 2  # Тикеры с новыми барами большего интервала
+        if len(rows):  # Если такие есть
+            close, = self.get_lines(rows * 2 + 1, 'close')
+            self.macd.update(rows, close)  # то пересчитываем по ним MACD
+        rows = updated[updated % 2 == 0] // 2  # Тикеры с новыми барами входа
+        if not len(rows):  # Если таких нет
+            return  # то сигналов нет
+        high, low, close = self.get_lines(rows * 2, 'high', 'low', 'close')
+        perc_k, perc_d = self.stoch.update(rows, high, low, close)
+        rsi = self.rsi.update(rows, close)
+        k_prev, d_prev = self.stoch.percK.previous[rows], self.stoch.percD.previous[rows]  # Линии Stochastic на прошлом баре
+        cross_up = (k_prev < d_prev) & (perc_k > perc_d)  # Пересечение %K снизу вверх
+        cross_down = (k_prev > d_prev) & (perc_k < perc_d)  # Пересечение %K сверху вниз
+        macd, signal = self.macd.macd[rows], self.macd.signal.values[rows]  # MACD на последнем баре большего интервала
+        macd_prev, signal_prev = self.macd.macd_previous[rows], self.macd.signal.previous[rows]  # и на прошлом баре
+        long_setup = (macd < signal) & (signal - macd < signal_prev - macd_prev) | \
+            (macd > signal) & (macd - signal > macd_prev - signal_prev)  # MACD для покупки
+        short_setup = ~long_setup & ((macd > signal) & (macd - signal < macd_prev - signal_prev) |
+                                     (macd < signal) & (signal - macd > signal_prev - macd_prev))  # MACD для продажи
+        buy_signal = cross_up & (rsi >= 50)  # Сигнал на покупку/закрытие продажи
+        sell_signal = cross_down & (rsi <= 50)  # Сигнал на продажу/закрытие покупки
+        for i in np.flatnonzero(self.live[rows * 2] & (buy_signal | sell_signal)):  # Позиции проверяем только по тикерам с сигналами в режиме реальной торговли
+            data = self.datas[rows[i] * 2]  # Данные тикера
+            size = self.getposition(data).size  # Позиция по тикеру
+            if not size and long_setup[i] and buy_signal[i]:
+                self.log(data, 'Открытие покупки')
+                self.buy(data=data)  # Заявка на покупку по рыночной цене
+            elif not size and short_setup[i] and sell_signal[i]:
+                self.log(data, 'Открытие продажи')
+                self.sell(data=data)  # Заявка на продажу по рыночной цене
+            elif size > 0 and sell_signal[i] or size < 0 and buy_signal[i]:
+                self.log(data, 'Закрытие позиции %s', size)
+                self.close(data=data)  # Закрываем позицию
+
+    def notify_data(self, data, status, *args, **kwargs):
+        """Изменение статуса приходящих баров"""
+        super(MacdRsiStochScanner, self).notify_data(data, status, *args, **kwargs)
+        logger.info('%s %s', data.p.dataname, data._getstatusname(status))
+
+    def notify_order(self, order):
+        """Изменение статуса заявки"""
+        if order.status in (bt.Order.Canceled, bt.Order.Margin, bt.Order.Rejected, bt.Order.Expired, bt.Order.Completed):  # Если заявка завершена
+            self.log(order.data, '%s. TransId=%s, Price=%.5f', order.getstatusname(), order.ref, order.executed.price)
+
+    def log(self, data, txt, *args):
+        """Вывод строки с тикером и датой бара в лог"""
+        if logger.isEnabledFor(logging.INFO):  # Если лог пишется
+            logger.info('%s %s, ' + txt, data.p.dataname, bt.num2date(data.datetime[0]).strftime('%d.%m.%Y %H:%M'), *args)
+
+
+if __name__ == '__main__':  # Точка входа при запуске этого скрипта
+    cerebro = bt.Cerebro(stdstats=False)  # Инициируем "движок" BackTrader
+    clientCode = 'Код клиента'  # Код клиента (присваивается брокером)
+    firmId = 'Код фирмы'  # Код фирмы (присваивается брокером)
+    symbols = ('SBER', 'VTBR', 'GAZP', 'MTLR', 'LKOH', 'PLZL', 'SBERP', 'BSPB', 'POLY', 'RNFT',
+               'GMKN', 'AFLT', 'NVTK', 'TATN', 'YNDX', 'MGNT', 'ROSN', 'AFKS', 'NLMK', 'ALRS',
+               'MOEX', 'SMLT', 'MAGN', 'CHMF', 'CBOM', 'MTLRP', 'SNGS', 'BANEP', 'MTSS', 'IRAO',
+               'SNGSP', 'SELG', 'UPRO', 'RUAL', 'TRNFP', 'FEES', 'SGZH', 'BANE', 'PHOR', 'PIKK')  # TOP 40 акций ММВБ
+
+    start_logging(filename='scanner.log')  # Лог пишется фоновым потоком на консоль и в файлы
+    cerebro.addstrategy(MacdRsiStochScanner)  # Одна торговая система на все тикеры
+    store = QKStore(PingInterval=10, AutoReconnect=True)  # Одно подключение к QUIK на все тикеры
+    broker = store.getbroker(use_positions=False, ClientCode=clientCode, FirmId=firmId, TradeAccountId='L01-00000F00',
+                             LimitKind=2, CurrencyCode='SUR', IsFutures=False)  # Брокер со счетом фондового рынка РФ
+    cerebro.setbroker(broker)
+    for symbol in symbols:  # Пробегаемся по всем тикерам
+        data = store.getdata(dataname=f'TQBR.{symbol}', timeframe=bt.TimeFrame.Minutes, compression=15,
+                             fromdate=datetime(2023, 9, 5), sessionstart=time(7, 0), LiveBars=True)  # Бары входа по подписке
+        cerebro.adddata(data)
+        cerebro.adddata(store.getdata(dataname=f'TQBR.{symbol}', timeframe=bt.TimeFrame.Minutes, compression=240,
+                                      fromdate=datetime(2023, 9, 5), sessionstart=time(7, 0), LiveBars=True, BaseData=data))  # 4-х часовые бары из 15-и минутных
+    cerebro.addsizer(bt.sizers.FixedSize, stake=10)  # Кол-во акций для покупки/продажи
+    cerebro.run()  # Запуск сканера
@@ -1,6 +1,14 @@
 from datetime import datetime, time
+import logging
 import backtrader as bt
 from BackTraderQuik.QKStore import QKStore  # Хранилище QUIK
+from BackTraderQuik.QKStorePool import QKStorePool  # Пул хранилищ нескольких терминалов QUIK
+from BackTraderQuik.QKMultiBroker import QKMultiBroker  # Брокер для нескольких счетов
+from BackTraderQuik.QKPaperBroker import QKPaperBroker  # Бумажный брокер по котировкам QUIK
+from BackTraderQuik.QKCheckpoint import QKCheckpoint  # Контрольная точка торговой системы
+from BackTraderQuik.QKLogger import start_logging  # Асинхронное логирование
+
+logger = logging.getLogger('trader')  # Лог торговой системы
 
 
 class MacdRsiStochStrategy(bt.Strategy):
@@ -15,10 +23,12 @@ class MacdRsiStochStrategy(bt.Strategy):
         ('macdsig_2_1', 9),  # сигнальная линия (индикатор MACD)
         ('rsiperiod', 12),  # индикатор RSI
     )
-    def log(self, txt, dt=None):
-        """Вывод строки с датой на консоль"""
+    def log(self, txt, *args, dt=None):
+        """Вывод строки с датой в лог. Аргументы подставляются в текст при записи лога"""
+        if not logger.isEnabledFor(logging.INFO):  # Если лог не пишется
+            return  # то дату не получаем
         dt = bt.num2date(self.datas[0].datetime[0]) if not dt else dt  # Заданная дата или дата текущего бара
-        print(f'{dt.strftime("%d.%m.%Y %H:%M")}, {txt}')  # Выводим дату и время с заданным текстом на консоль
+        logger.info('%s, ' + txt, dt.strftime('%d.%m.%Y %H:%M'), *args)  # Выводим дату и время с заданным текстом в лог
 
     def __init__(self):
         """Инициализация торговой системы"""
@@ -47,12 +57,12 @@ class MacdRsiStochStrategy(bt.Strategy):
     def next(self):
         """Получение следующего исторического/нового бара"""
         for data in self.datas:  # Пробегаемся по всем запрошенным барам
-            self.log(f'{data.p.dataname} Open={data.open[0]:.5f}, High={data.high[0]:.5f}, Low={data.low[0]:.5f}, '
-                     f'Close={data.close[0]:.5f}, Volume={data.volume[0]:.2f}')
+            self.log('%s Open=%.5f, High=%.5f, Low=%.5f, Close=%.5f, Volume=%.2f',
+                     data.p.dataname, data.open[0], data.high[0], data.low[0], data.close[0], data.volume[0])
 
         if self.isLive:  # Если в режиме реальной торговли
-            self.log(f'Свободные средства: {self.broker.getcash()}, Баланс: {self.broker.getvalue()}')
-            self.log(f'Close={self.DataClose[0]:.5f}')
+            self.log('Свободные средства: %s, Баланс: %s', self.broker.getcash(), self.broker.getvalue())
+            self.log('Close=%.5f', self.DataClose[0])
 
             position = self.getposition()
 
@@ -65,7 +75,7 @@ class MacdRsiStochStrategy(bt.Strategy):
                                 -1]):
 
                     if self.crossover_up and self.rsi[0] >= 50:
-                        self.log(f'Открытие покупки')
+                        self.log('Открытие покупки')
                         self.buy()  # Заявка на покупку по рыночной цене
 
                 elif (self.macd1.macd[0] > self.macd1.signal[0]
@@ -74,47 +84,51 @@ class MacdRsiStochStrategy(bt.Strategy):
                             and self.macd1.signal[0] - self.macd1.macd[0] > self.macd1.signal[-1] - self.macd1.macd[
                                 -1]):
                     if self.crossover_down and self.rsi[0] <= 50:
-                        self.log(f'Открытие продажи')
+                        self.log('Открытие продажи')
                         self.sell()  # Заявка на продажу по рыночной цене
 
             if position.size > 0:
                 if self.crossover_down and self.rsi[0] <= 50:
-                    self.log(f'Закрытие покупки')
+                    self.log('Закрытие покупки')
                     # закрываем покупку
                     self.close()
 
             if position.size < 0:
                 if self.crossover_up and self.rsi[0] >= 50:
-                    self.log(f'Закрытие продажи')
+                    self.log('Закрытие продажи')
                     # закрываем продажу
                     self.close()
 
     def notify_data(self, data, status, *args, **kwargs):
         """Изменение статуса приходящих баров"""
         data_status = data._getstatusname(status)  # Получаем статус (только при LiveBars=True)
-        print(data_status)  # Не можем вывести в лог, т.к. первый статус DELAYED получаем до первого бара (и его даты)
+        logger.info(data_status)  # Без даты, т.к. первый статус DELAYED получаем до первого бара (и его даты)
         self.isLive = data_status == 'LIVE'  # Режим реальной торговли
 
+    def notify_store(self, msg, *args, **kwargs):
+        """Уведомления хранилища: зависание и восстановление связи с QUIK"""
+        logger.warning('%s %s', msg, args)
+
     def notify_order(self, order):
         """Изменение статуса заявки"""
         if order.status in (bt.Order.Created, bt.Order.Submitted, bt.Order.Accepted):  # Если заявка создана,
             # отправлена брокеру, принята брокером (не исполнена)
-            self.log(f'Alive Status: {order.getstatusname()}. TransId={order.ref}')
+            self.log('Alive Status: %s. TransId=%s', order.getstatusname(), order.ref)
         elif order.status in (bt.Order.Canceled, bt.Order.Margin, bt.Order.Rejected, bt.Order.Expired):  # Если заявка
             # отменена, нет средств, заявка отклонена брокером, снята по времени (снята)
-            self.log(f'Cancel Status: {order.getstatusname()}. TransId={order.ref}')
+            self.log('Cancel Status: %s. TransId=%s', order.getstatusname(), order.ref)
         elif order.status == bt.Order.Partial:  # Если заявка частично исполнена
-            self.log(f'Part Status: {order.getstatusname()}. TransId={order.ref}')
+            self.log('Part Status: %s. TransId=%s', order.getstatusname(), order.ref)
         elif order.status == bt.Order.Completed:  # Если заявка полностью исполнена
             if order.isbuy():  # Заявка на покупку
-                self.log(f'Bought @{order.executed.price:.5f}, Cost={order.executed.value:.5f}, Comm={order.executed.comm:.5f}')
+                self.log('Bought @%.5f, Cost=%.5f, Comm=%.5f', order.executed.price, order.executed.value, order.executed.comm)
             elif order.issell():  # Заявка на продажу
-                self.log(f'Sold @{order.executed.price:.5f}, Cost={order.executed.value:.5f}, Comm={order.executed.comm:.5f}')
+                self.log('Sold @%.5f, Cost=%.5f, Comm=%.5f', order.executed.price, order.executed.value, order.executed.comm)
 
     def notify_trade(self, trade):
         """Изменение статуса позиции"""
         if trade.isclosed:  # Если позиция закрыта
-            self.log(f'Trade Profit, Gross={trade.pnl:.5f}, NET={trade.pnlcomm:.5f}')
+            self.log('Trade Profit, Gross=%.5f, NET=%.5f', trade.pnl, trade.pnlcomm)
 
 
 if __name__ == '__main__':  # Точка входа при запуске этого скрипта
@@ -126,21 +140,42 @@ if __name__ == '__main__':  # Точка входа при запуске это
     # symbol = 'TQBR.SBER'  # Тикер
     symbol = 'VBH4'  # Для фьючерсов: <Код тикера><Месяц экспирации: 3-H, 6-M, 9-U, 12-Z><Последняя цифра года>
 
+    start_logging(filename='trader.log')  # Лог пишется фоновым потоком на консоль и в файлы, которые меняются по размеру
     cerebro.addstrategy(MacdRsiStochStrategy)  # Добавляем торговую систему
-    store = QKStore()  # Хранилище QUIK
+    store = QKStore(MetricsPort=8000, PingInterval=10, AutoReconnect=True)  # Хранилище QUIK. Метрики работы для Prometheus:
+    # http://127.0.0.1:8000/metrics. Связь с QUIK проверяется каждые 10 с. При зависании связи переподключаемся
+    # pool = QKStorePool({'main': dict(), 'reserve': dict(RequestsPort=34140, CallbacksPort=34141)},
+    #                    accounts={'L01-00000F00': 'main'})  # Несколько терминалов QUIK в одном процессе
+    # data = pool.getdata(dataname=symbol, timeframe=bt.TimeFrame.Minutes, compression=15)  # Данные на менее загруженном терминале
+    # broker = pool.getbroker(ClientCode=clientCode, FirmId=firmId, TradeAccountId='L01-00000F00')  # Брокер на терминале счета
     broker = store.getbroker(use_positions=False, ClientCode=clientCode, FirmId=firmId, TradeAccountId='L01-00000F00',
-                             LimitKind=2, CurrencyCode='SUR', IsFutures=False)  # Брокер со счетом фондового рынка РФ
+                             LimitKind=2, CurrencyCode='SUR', IsFutures=False,
+                             Journal='trader.jnl', NativeBrackets=True,
+                             Risk=dict(max_order_size=100000, max_position=200000, max_orders_per_minute=10))  # Брокер
+    # со счетом фондового рынка РФ. После сбоя состояние восстанавливается из журнала. Заявки сверх лимитов не отправляются
+    # Тейк профит и стоп bracket заявок стоят на сервере QUIK сразу после постановки родительской заявки
     # broker = store.getbroker(use_positions=False)  # Брокер со счетом по умолчанию (срочный рынок РФ)
+    # broker = QKMultiBroker(Accounts={  # Брокер сразу для нескольких счетов. Заявки идут на счет по рынку тикера
+    #     'stocks': dict(use_positions=False, ClientCode=clientCode, FirmId=firmId, TradeAccountId='L01-00000F00',
+    #                    LimitKind=2, CurrencyCode='SUR', IsFutures=False),  # Счет фондового рынка РФ
+    #     'futures': dict(use_positions=False)})  # Счет срочного рынка РФ. Заявку можно отправить явно: self.buy(account='futures')
+    # broker = QKPaperBroker(Quotes='BidAsk')  # Бумажный брокер. Заявки исполняются локально по лучшим ценам QUIK
+    # broker.setcash(1000000)  # Стартовые средства бумажного брокера
     cerebro.setbroker(broker)  # Устанавливаем брокера
     data = store.getdata(dataname=symbol, timeframe=bt.TimeFrame.Minutes, compression=15,
-                         fromdate=datetime(2023, 9, 5), sessionstart=time(7, 0), LiveBars=True)  # Исторические и
-    # новые минутные бары за все время
+                         fromdate=datetime(2023, 9, 5), sessionstart=time(7, 0), LiveBars=True, Checkpoint='trader.chk')  # Исторические и
+    # новые минутные бары за все время. Если есть контрольная точка, то история загружается только после нее
+    # data = store.getdata(dataname=symbol, timeframe=bt.TimeFrame.Minutes, compression=15,
+    #                      fromdate=datetime(2023, 9, 5), sessionstart=time(7, 0), LiveBars=True, TickBars=True)  # Новые
+    # бары строятся из обезличенных сделок и закрываются точно на границе интервала
     cerebro.adddata(data)  # Добавляем данные
 
     data1 = store.getdata(dataname=symbol, timeframe=bt.TimeFrame.Minutes, compression=240,
-                         fromdate=datetime(2023, 9, 5), sessionstart=time(7, 0), LiveBars=True)  # Исторические и
-    # новые минутные бары за все время
+                         fromdate=datetime(2023, 9, 5), sessionstart=time(7, 0), LiveBars=True, BaseData=data)  # 4-х
+    # часовые бары строятся из 15-и минутных без своей загрузки истории и подписки
     cerebro.adddata(data1)
 
     cerebro.addsizer(bt.sizers.FixedSize, stake=100000)  # Кол-во акций для покупки/продажи
+    cerebro.addanalyzer(QKCheckpoint, FileName='trader.chk')  # При перезапуске индикаторы восстанавливаются из контрольной
+    # точки, а в торговую систему приходят только бары после нее
     cerebro.run()  # Запуск торговой системы